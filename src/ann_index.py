@@ -0,0 +1,334 @@
+# src/ann_index.py
+# Approximate nearest-neighbour search (IVF: k-means centroids + inverted lists) over numpy.
+# The index is persisted next to index.db as <index.db>.ivf.npz. It stores the
+# centroids plus the list assignment of every chunk, keyed by (documents.id,
+# chunk ordinal), so it can be bound to whatever VectorIndex a process holds.
+# Binding returns a new IVFIndex for that VectorIndex (sharing the centroids),
+# so searches still running on an older VectorIndex keep their own lists.
+# Extended VectorIndex versions extend the binding: appended rows are assigned
+# and probed as a tail, and regrouped into the inverted lists only once the
+# tail grew by REGROUP_FRACTION.
+import copy
+import os
+import sys
+import time
+from typing import List, Tuple
+import numpy as np
+
+from retrieval import RowBuffer, VectorIndex, as_query_matrix, select_top_k
+
+ANN_MIN_CHUNKS = 50_000   # Below this, exact search is fast enough and is used instead
+DEFAULT_NPROBE = 8        # Lists scanned per query: higher = better recall, more latency
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 100_000   # Rows used to train the centroids
+RETRAIN_GROWTH = 4.0      # Retrain once the corpus grew this much since training
+ASSIGN_BATCH = 65_536
+REGROUP_FRACTION = 0.1    # Regroup the inverted lists once the unsorted tail is this large relative to them
+
+
+def ann_path(db_file: str) -> str:
+    return db_file + ".ivf.npz"
+
+
+def default_n_lists(n_chunks: int) -> int:
+    return int(max(1, min(65_536, 4 * np.sqrt(n_chunks))))
+
+
+def kmeans(matrix: np.ndarray, n_lists: int, n_iter: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means on normalized rows; returns normalized (n_lists, dim) centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n_lists = min(n_lists, len(matrix))
+    centroids = matrix[rng.choice(len(matrix), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = _nearest(centroids, matrix)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, matrix)
+        counts = np.bincount(assignment, minlength=n_lists)
+        # Re-seed empty lists with random rows so no centroid is wasted.
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = matrix[rng.choice(len(matrix), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+def _nearest(centroids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BATCH):
+        block = vectors[start:start + ASSIGN_BATCH]
+        out[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def _chunk_keys(vector_index: VectorIndex) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (documents.id, chunk ordinal) for every row of the VectorIndex matrix.
+    """
+    doc_ids = np.array([doc["id"] for doc in vector_index.docs[:vector_index.n_docs]], dtype=np.int64)
+    rows = np.arange(vector_index.n_rows)
+    ordinals = rows - vector_index.doc_offsets[vector_index.chunk_to_doc]
+    return doc_ids[vector_index.chunk_to_doc], ordinals.astype(np.int32)
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, doc_ids: np.ndarray, ordinals: np.ndarray,
+                 list_ids: np.ndarray, trained_size: int, nprobe: int = DEFAULT_NPROBE):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.doc_ids = doc_ids
+        self.ordinals = ordinals
+        self.list_ids = list_ids
+        self.trained_size = trained_size
+        self.nprobe = nprobe
+        self.added = 0
+        self._index = None
+
+    @classmethod
+    def train(cls, vector_index: VectorIndex, n_lists: int = None, n_iter: int = KMEANS_ITERATIONS,
+              seed: int = 0, nprobe: int = DEFAULT_NPROBE) -> "IVFIndex":
+        matrix = vector_index.matrix
+        n_lists = n_lists or default_n_lists(len(matrix))
+        rng = np.random.default_rng(seed)
+        sample = matrix if len(matrix) <= KMEANS_SAMPLE else matrix[rng.choice(len(matrix), KMEANS_SAMPLE, replace=False)]
+        centroids = kmeans(sample, n_lists, n_iter, seed)
+        doc_ids, ordinals = _chunk_keys(vector_index)
+        ivf = cls(centroids, doc_ids, ordinals, _nearest(centroids, matrix), len(matrix), nprobe)
+        return ivf.bind(vector_index)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def needs_retraining(self, n_chunks: int) -> bool:
+        return n_chunks > RETRAIN_GROWTH * max(self.trained_size, 1)
+
+    def bind(self, vector_index: VectorIndex) -> "IVFIndex":
+        """
+        A new IVFIndex over the rows of `vector_index`, with this one's
+        assignments mapped onto them. Assignments of deleted documents are
+        dropped and rows without an assignment (incremental inserts) are
+        assigned to their nearest centroid; `added` counts those. This index
+        is left unchanged.
+        """
+        doc_ids, ordinals = _chunk_keys(vector_index)
+        stored_doc_ids, stored_ordinals, stored_lists = self.keys()
+        n_rows = len(doc_ids)
+        row_lists = np.full(n_rows, -1, dtype=np.int32)
+        if n_rows and len(stored_doc_ids):
+            # Match stored (doc_id, ordinal) keys against the resident rows.
+            keys = doc_ids << 20 | ordinals
+            stored = stored_doc_ids << 20 | stored_ordinals
+            order = np.argsort(keys)
+            pos = np.searchsorted(keys, stored, sorter=order)
+            pos = np.minimum(pos, n_rows - 1)
+            found = keys[order[pos]] == stored
+            row_lists[order[pos[found]]] = stored_lists[found]
+        missing = np.flatnonzero(row_lists < 0)
+        if len(missing):
+            row_lists[missing] = _nearest(self.centroids, vector_index.rows(missing))
+        bound = IVFIndex(self.centroids, doc_ids, ordinals, row_lists, self.trained_size, self.nprobe)
+        bound.added = len(missing)
+        bound._index = vector_index
+        bound._lists = RowBuffer(row_lists)
+        bound._group(n_rows)
+        return bound
+
+    def extend(self, vector_index: VectorIndex, rows: np.ndarray) -> "IVFIndex":
+        """
+        This binding carried over to `vector_index`, a version extended from
+        the bound one by `rows`: only those are assigned. This index is left
+        unchanged.
+        """
+        assigned = _nearest(self.centroids, rows) if len(rows) else np.zeros(0, dtype=np.int32)
+        extended = self._rebound(vector_index, self._lists.append(self._index.n_rows, assigned))
+        extended.added = self.added + len(rows)
+        if vector_index.n_rows - self._n_grouped > REGROUP_FRACTION * max(self._n_grouped, 1):
+            extended._group(vector_index.n_rows)
+        return extended
+
+    def compact(self, vector_index: VectorIndex, kept_rows: np.ndarray) -> "IVFIndex":
+        """
+        This binding carried over to `vector_index`, built from the kept_rows of the bound one.
+        """
+        compacted = self._rebound(vector_index, RowBuffer(self._lists.view(self._index.n_rows)[kept_rows]))
+        compacted._group(vector_index.n_rows)
+        return compacted
+
+    def _rebound(self, vector_index: VectorIndex, lists: RowBuffer) -> "IVFIndex":
+        rebound = copy.copy(self)
+        # Keys of the rows are derived from the index when needed (see keys).
+        rebound.doc_ids = rebound.ordinals = rebound.list_ids = None
+        rebound._index = vector_index
+        rebound._lists = lists
+        return rebound
+
+    @property
+    def nbytes(self) -> int:
+        nbytes = self.centroids.nbytes
+        if self._index is not None:
+            nbytes += self._lists.data.nbytes + self._rows.nbytes + self._list_offsets.nbytes
+        return nbytes
+
+    def _group(self, n_rows: int):
+        """
+        Inverted lists over the first n_rows rows: rows grouped by list id.
+        """
+        row_lists = self._lists.view(n_rows)
+        self._rows = np.argsort(row_lists, kind="stable")
+        counts = np.bincount(row_lists, minlength=self.n_lists)
+        self._list_offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._n_grouped = n_rows
+
+    def keys(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (documents.id, chunk ordinal, list id) of every assigned chunk.
+        """
+        if self.doc_ids is None:
+            doc_ids, ordinals = _chunk_keys(self._index)
+            return doc_ids, ordinals, self._lists.view(self._index.n_rows)
+        return self.doc_ids, self.ordinals, self.list_ids
+
+    def search(self, query_embeddings, top_k: int = 2, min_similarity: float = 0.6,
+               nprobe: int = None) -> List[List[Tuple[int, float]]]:
+        """
+        Same contract as VectorIndex.search, scoring only the chunks in the
+        nprobe lists closest to each query.
+        """
+        vi = self._index
+        results = []
+        for query, rows in self._probe(query_embeddings, nprobe):
+            if len(rows) == 0:
+                results.append([])
+                continue
+            scores = vi.rows(rows) @ query
+            docs = vi.chunk_to_doc[rows]
+            # Best chunk per candidate document: sort by (doc, -score) and keep the first of each doc.
+            order = np.lexsort((-scores, docs))
+            docs, scores = docs[order], scores[order]
+            first = np.concatenate(([True], docs[1:] != docs[:-1]))
+            candidates = docs[first]
+            hits = select_top_k(scores[first][None, :], top_k, min_similarity)[0]
+            results.append([(int(candidates[i]), score) for i, score in hits])
+        return results
+
+    def search_chunks(self, query_embeddings, top_k: int = 4, min_similarity: float = 0.6,
+                      nprobe: int = None) -> List[List[Tuple[int, int, float]]]:
+        """
+        Same contract as VectorIndex.search_chunks over the probed lists only.
+        """
+        vi = self._index
+        results = []
+        for query, rows in self._probe(query_embeddings, nprobe):
+            if len(rows) == 0:
+                results.append([])
+                continue
+            hits = select_top_k((vi.rows(rows) @ query)[None, :], top_k, min_similarity)[0]
+            results.append([vi.locate(rows[i]) + (score,) for i, score in hits])
+        return results
+
+    def _probe(self, query_embeddings, nprobe: int = None):
+        """
+        Yield (normalized query, candidate matrix rows) for each query; rows
+        of deleted documents are left out.
+        """
+        vi = self._index
+        queries = as_query_matrix(query_embeddings, vi.dim)
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        tail_lists = self._lists.view(vi.n_rows)[self._n_grouped:]
+        for query, lists in zip(queries, probes):
+            rows = [self._rows[self._list_offsets[l]:self._list_offsets[l + 1]] for l in lists]
+            if len(tail_lists):
+                rows.append(self._n_grouped + np.flatnonzero(np.isin(tail_lists, lists)))
+            rows = np.concatenate(rows)
+            if vi.n_dead_rows:
+                rows = rows[vi.row_alive[rows]]
+            yield query, rows
+
+    def save(self, path: str):
+        tmp = path + ".tmp.npz"
+        doc_ids, ordinals, list_ids = self.keys()
+        np.savez(tmp, centroids=self.centroids, doc_ids=doc_ids, ordinals=ordinals,
+                 list_ids=list_ids, trained_size=self.trained_size, nprobe=self.nprobe)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        data = np.load(path)
+        return cls(data["centroids"], data["doc_ids"], data["ordinals"], data["list_ids"],
+                   int(data["trained_size"]), int(data["nprobe"]))
+
+
+def attach_ann(vector_index: VectorIndex, ivf: IVFIndex, min_chunks: int = ANN_MIN_CHUNKS):
+    """
+    Route vector_index searches through ivf, unless the corpus is small enough
+    for exact search.
+    """
+    if ivf is None or vector_index.n_rows < min_chunks:
+        vector_index.ann = None
+        return
+    vector_index.ann = ivf.bind(vector_index)
+
+
+def update_ann_index(db_file: str, vector_index: VectorIndex, min_chunks: int = ANN_MIN_CHUNKS):
+    """
+    Build, extend or retrain the ANN index persisted next to db_file.
+    Small corpora get no ANN index (and any stale one is removed).
+    """
+    path = ann_path(db_file)
+    n_chunks = vector_index.n_rows
+    if n_chunks < min_chunks:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    ivf = IVFIndex.load(path) if os.path.exists(path) else None
+    if ivf is None or ivf.needs_retraining(n_chunks) or ivf.centroids.shape[1] != vector_index.dim:
+        print(f"Training IVF index over {n_chunks} chunks...")
+        ivf = IVFIndex.train(vector_index)
+    else:
+        ivf = ivf.bind(vector_index)
+        print(f"Updated IVF index with {ivf.added} new chunks")
+    ivf.save(path)
+    return ivf
+
+
+def recall_report(vector_index: VectorIndex, ivf: IVFIndex, queries: np.ndarray, k: int = 10,
+                  nprobe_values=(1, 2, 4, 8, 16, 32, 64)) -> List[dict]:
+    """
+    recall@k and mean per-query latency of the IVF index at several nprobe
+    settings, measured against exact search on the same queries.
+    """
+    ivf = ivf.bind(vector_index)
+    start = time.perf_counter()
+    exact = vector_index.search_exact(queries, k, -1.0)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    report = [{"method": "exact", "nprobe": None, "recall": 1.0, "latency_ms": exact_ms}]
+    for nprobe in nprobe_values:
+        if nprobe > ivf.n_lists:
+            break
+        start = time.perf_counter()
+        approx = ivf.search(queries, k, -1.0, nprobe=nprobe)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = sum(len({i for i, _ in a} & {i for i, _ in e}) for a, e in zip(approx, exact))
+        total = sum(len(e) for e in exact)
+        report.append({"method": "ivf", "nprobe": nprobe, "recall": hits / max(total, 1), "latency_ms": latency_ms})
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python ann_index.py <index.db> [n_queries] [k]
+    from index_cache import IndexCache
+    db_file = sys.argv[1]
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    vi = IndexCache(db_file).vector_index
+    ivf = IVFIndex.load(ann_path(db_file)) if os.path.exists(ann_path(db_file)) else IVFIndex.train(vi)
+    rng = np.random.default_rng(0)
+    # Perturbed stored chunks stand in for real queries.
+    queries = vi.matrix[rng.choice(len(vi.matrix), n_queries)] + rng.normal(0, 0.05, (n_queries, vi.dim)).astype(np.float32)
+    print(f"{'method':<8}{'nprobe':>8}{'recall@' + str(k):>12}{'ms/query':>12}")
+    for row in recall_report(vi, ivf, queries, k):
+        print(f"{row['method']:<8}{str(row['nprobe'] or '-'):>8}{row['recall']:>12.3f}{row['latency_ms']:>12.3f}")
@@ -0,0 +1,317 @@
+# src/backends.py
+# Model backends behind LocalEmbeddingNode and LocalLLMNode. "vllm" runs the
+# real models; "cpu" is a deterministic stand-in (hashing embedder and a fake
+# generator with configurable latency) so indexing, retrieval and the Flask app
+# can be exercised and benchmarked without a GPU or downloaded weights.
+# "remote" forwards to a model server process (model_server.py) that runs one
+# of the other backends, so web workers do not each load the engines.
+import os
+import re
+import time
+import zlib
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+BACKEND_VLLM = "vllm"
+BACKEND_CPU = "cpu"
+BACKEND_REMOTE = "remote"
+# Selected with the RAG_BACKEND environment variable unless a backend is passed explicitly.
+DEFAULT_BACKEND = os.environ.get("RAG_BACKEND", BACKEND_VLLM)
+
+CPU_EMBEDDING_DIM = 384
+CPU_SHARED_COMPONENT = 1.0  # Weight of the direction every CPU embedding shares, see HashingEmbeddingBackend
+CPU_VOCAB_SIZE = 1 << 20
+CPU_FIRST_TOKEN_LATENCY = float(os.environ.get("RAG_CPU_FIRST_TOKEN_LATENCY", "0.05"))  # Seconds
+CPU_TOKEN_LATENCY = float(os.environ.get("RAG_CPU_TOKEN_LATENCY", "0.01"))              # Seconds per token
+CPU_MAX_NEW_TOKENS = 64
+
+
+def resolve_backend(backend: Optional[str]) -> str:
+    backend = backend or DEFAULT_BACKEND
+    if backend not in (BACKEND_VLLM, BACKEND_CPU, BACKEND_REMOTE):
+        raise ValueError(f"Unknown model backend: {backend!r}")
+    return backend
+
+
+class EmbeddingBackend:
+    """
+    Embeds prompts, each a string or {"prompt_token_ids": [...]} from get_tokenizer().
+    """
+
+    def get_tokenizer(self):
+        raise NotImplementedError
+
+    def embed(self, prompts: List) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class ChatBackend:
+    """
+    Generates one reply per conversation (a list of chat messages). When
+    on_delta is given, on_delta(i, text) is called with each new piece of
+    conversation i's reply as it is produced.
+    """
+
+    def get_tokenizer(self):
+        raise NotImplementedError
+
+    def generate(self, conversations: List[List[Dict]],
+                 on_delta: Optional[Callable[[int, str], None]] = None) -> List[str]:
+        raise NotImplementedError
+
+
+class VLLMEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, model_path: str):
+        from vllm import LLM
+        self.llm = LLM(model_path, task="embed", trust_remote_code=True)
+
+    def get_tokenizer(self):
+        return self.llm.get_tokenizer()
+
+    def embed(self, prompts):
+        outputs = self.llm.embed(prompts, use_tqdm=False)
+        return [output.outputs.embedding for output in outputs]
+
+
+class VLLMChatBackend(ChatBackend):
+    def __init__(self, model_path: str):
+        from vllm import LLM, SamplingParams
+        self.sampling_params = SamplingParams(temperature=0.5, top_p=0.9)
+        self.llm = LLM(model_path, cpu_offload_gb=3, swap_space= 4, gpu_memory_utilization=0.8, enforce_eager=True)
+        self._next_request_id = 0
+
+    def get_tokenizer(self):
+        return self.llm.get_tokenizer()
+
+    def generate(self, conversations, on_delta=None):
+        # LLM.chat has no streaming API, so requests are added to the engine and
+        # it is stepped directly, reporting each request's new text after every step.
+        tokenizer = self.llm.get_tokenizer()
+        llm_engine = self.llm.llm_engine
+        positions = {}
+        texts = [""] * len(conversations)
+        try:
+            for i, conversation in enumerate(conversations):
+                prompt = tokenizer.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True)
+                request_id = f"chat-{self._next_request_id}"
+                self._next_request_id += 1
+                llm_engine.add_request(request_id, prompt, self.sampling_params)
+                positions[request_id] = i
+            while llm_engine.has_unfinished_requests():
+                for output in llm_engine.step():
+                    i = positions.get(output.request_id)
+                    if i is None:
+                        continue
+                    text = output.outputs[0].text
+                    if len(text) > len(texts[i]):
+                        if on_delta is not None:
+                            on_delta(i, text[len(texts[i]):])
+                        texts[i] = text
+        except BaseException:
+            # Drop our requests so a failed batch does not linger in the engine.
+            for request_id in positions:
+                llm_engine.abort_request(request_id)
+            raise
+        return texts
+
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+
+class HashingTokenizer:
+    """
+    Word-level tokenizer with hashed ids that mimics the parts of the
+    Hugging Face tokenizer API used in this repo (offset mapping, special
+    tokens, chat template).
+    """
+    cls_token_id = 1
+    sep_token_id = 2
+
+    def __init__(self, vocab_size: int = CPU_VOCAB_SIZE):
+        self.vocab_size = vocab_size
+        self._words = {}
+
+    def _token_id(self, word: str) -> int:
+        token_id = 3 + zlib.crc32(word.lower().encode("utf-8")) % (self.vocab_size - 3)
+        self._words.setdefault(token_id, word)
+        return token_id
+
+    def __call__(self, text: str, add_special_tokens: bool = True, return_offsets_mapping: bool = False):
+        matches = list(_WORD.finditer(text))
+        encoding = {"input_ids": [self._token_id(m.group()) for m in matches]}
+        if return_offsets_mapping:
+            encoding["offset_mapping"] = [m.span() for m in matches]
+        if add_special_tokens:
+            encoding["input_ids"] = self.build_inputs_with_special_tokens(encoding["input_ids"])
+            if return_offsets_mapping:
+                encoding["offset_mapping"] = [(0, 0)] + encoding["offset_mapping"] + [(0, 0)]
+        return encoding
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        return self(text, add_special_tokens=add_special_tokens)["input_ids"]
+
+    def decode(self, ids: List[int]) -> str:
+        return " ".join(self._words.get(i, "") for i in ids if i > self.sep_token_id)
+
+    def num_special_tokens_to_add(self, pair: bool = False) -> int:
+        return 2
+
+    def build_inputs_with_special_tokens(self, ids: List[int]) -> List[int]:
+        return [self.cls_token_id] + list(ids) + [self.sep_token_id]
+
+    def apply_chat_template(self, conversation, tokenize: bool = False, add_generation_prompt: bool = True):
+        text = "".join(f"<|{m['role']}|>\n{m['content']}\n" for m in conversation)
+        if add_generation_prompt:
+            text += "<|assistant|>\n"
+        return self.encode(text) if tokenize else text
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Feature-hashing embedder: each distinct token and token bigram adds a
+    signed unit to one of `dim - 1` buckets. Texts that share words get similar
+    vectors, so retrieval results are meaningful. Like real embedding models,
+    all vectors also share a common direction (the last dimension), which lifts
+    cosine scores into the range the QA similarity threshold is tuned for.
+    """
+
+    def __init__(self, model_path: str = None, dim: int = CPU_EMBEDDING_DIM,
+                 shared_component: float = CPU_SHARED_COMPONENT):
+        self.dim = dim
+        self.shared_component = shared_component
+        self.tokenizer = HashingTokenizer()
+
+    def get_tokenizer(self):
+        return self.tokenizer
+
+    def _embed_ids(self, ids: List[int]) -> List[float]:
+        ids = np.asarray([i for i in ids if i > HashingTokenizer.sep_token_id], dtype=np.uint64)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if len(ids):
+            features = np.unique(np.concatenate([ids, ids[:-1] * np.uint64(1_000_003) + ids[1:]]))
+            mixed = (features * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+            signs = np.where(mixed & np.uint64(1), 1.0, -1.0).astype(np.float32)
+            np.add.at(vector, (mixed >> np.uint64(1)) % np.uint64(self.dim - 1), signs)
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector /= norm
+        vector[-1] = self.shared_component
+        vector /= np.linalg.norm(vector)
+        return vector.tolist()
+
+    def embed(self, prompts):
+        return [self._embed_ids(p["prompt_token_ids"] if isinstance(p, dict) else self.tokenizer.encode(p))
+                for p in prompts]
+
+
+class FakeChatBackend(ChatBackend):
+    """
+    Deterministic generator: the reply is built from the last user message and
+    emitted word by word after first_token_latency, then token_latency per word.
+    Conversations of one batch are generated in lockstep like a real engine.
+    """
+
+    def __init__(self, model_path: str = None, first_token_latency: float = CPU_FIRST_TOKEN_LATENCY,
+                 token_latency: float = CPU_TOKEN_LATENCY, max_new_tokens: int = CPU_MAX_NEW_TOKENS):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.max_new_tokens = max_new_tokens
+        self.tokenizer = HashingTokenizer()
+
+    def get_tokenizer(self):
+        return self.tokenizer
+
+    def _reply(self, conversation) -> List[str]:
+        question = next((m["content"] for m in reversed(conversation) if m["role"] == "user"), "")
+        # Answer prompts from qa_node end with "Question: ...\nAnswer:".
+        match = re.search(r"Question:\s*(.*?)\s*Answer:\s*$", question, re.S)
+        words = (match.group(1) if match else question).split()
+        digest = zlib.crc32(question.encode("utf-8"))
+        reply = [f"[{digest:08x}]", "Answer", "about:"] + words
+        return [w if i == 0 else " " + w for i, w in enumerate(reply[:self.max_new_tokens])]
+
+    def generate(self, conversations, on_delta=None):
+        replies = [self._reply(conversation) for conversation in conversations]
+        time.sleep(self.first_token_latency)
+        for step in range(max((len(r) for r in replies), default=0)):
+            if step:
+                time.sleep(self.token_latency)
+            if on_delta is not None:
+                for i, reply in enumerate(replies):
+                    if step < len(reply):
+                        on_delta(i, reply[step])
+        return ["".join(reply) for reply in replies]
+
+
+def load_tokenizer(backend: str, model_path: str):
+    """
+    The tokenizer of model_path under backend, without loading the model.
+    """
+    if backend == BACKEND_CPU:
+        return HashingTokenizer()
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+
+
+class RemoteEmbeddingBackend(EmbeddingBackend):
+    """
+    Embeds through the model server. Only the tokenizer is loaded locally.
+    """
+
+    def __init__(self, model_path: str):
+        from model_client import get_client
+        self.client = get_client()
+        self.model_path = model_path
+        # Loads the model on the server if needed, and names the backend it runs.
+        info = self.client.call({"op": "load", "kind": "embedding", "model_path": model_path})
+        self.tokenizer = load_tokenizer(info["backend"], model_path)
+
+    def get_tokenizer(self):
+        return self.tokenizer
+
+    def embed(self, prompts):
+        return self.client.call({"op": "embed", "model_path": self.model_path, "prompts": list(prompts)})
+
+
+class RemoteChatBackend(ChatBackend):
+    """
+    Generates through the model server, relaying its streamed deltas to on_delta.
+    """
+
+    def __init__(self, model_path: str):
+        from model_client import get_client
+        self.client = get_client()
+        self.model_path = model_path
+        info = self.client.call({"op": "load", "kind": "chat", "model_path": model_path})
+        self.tokenizer = load_tokenizer(info["backend"], model_path)
+
+    def get_tokenizer(self):
+        return self.tokenizer
+
+    def generate(self, conversations, on_delta=None):
+        request = {"op": "generate", "model_path": self.model_path,
+                   "conversations": conversations, "stream": on_delta is not None}
+        for message in self.client.stream(request):
+            if message[0] == "delta":
+                on_delta(message[1], message[2])
+            elif message[0] == "done":
+                return message[1]
+
+
+def create_embedding_backend(model_path: str, backend: str = None) -> EmbeddingBackend:
+    backend = resolve_backend(backend)
+    if backend == BACKEND_CPU:
+        return HashingEmbeddingBackend(model_path)
+    if backend == BACKEND_REMOTE:
+        return RemoteEmbeddingBackend(model_path)
+    return VLLMEmbeddingBackend(model_path)
+
+
+def create_chat_backend(model_path: str, backend: str = None) -> ChatBackend:
+    backend = resolve_backend(backend)
+    if backend == BACKEND_CPU:
+        return FakeChatBackend(model_path)
+    if backend == BACKEND_REMOTE:
+        return RemoteChatBackend(model_path)
+    return VLLMChatBackend(model_path)
@@ -0,0 +1,105 @@
+# src/batch_scheduler.py
+# Micro-batching in front of the model engines: concurrent requests arriving
+# within a short window are submitted to the engine as one batch call.
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+MAX_BATCH_SIZE = 32
+MAX_WAIT_SECONDS = 0.01  # How long the first request of a batch waits for company
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Collects items from many threads and calls `batch_fn(items)` on a single
+    worker thread, which must return one result per item in order. A batch is
+    dispatched as soon as it holds max_batch_size items or max_wait seconds
+    have passed since its first item arrived. Since only the worker calls the
+    engine, engine access is also serialized.
+    """
+
+    def __init__(self, batch_fn: Callable[[List], List], max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait: float = MAX_WAIT_SECONDS, name: str = "batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._closed = False
+        self.batches = 0
+        self.items = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def submit_many(self, items: List) -> List[Future]:
+        return [self.submit(item) for item in items]
+
+    def __call__(self, item):
+        """
+        Submit one item and block until its result is available.
+        """
+        return self.submit(item).result()
+
+    def map(self, items: List) -> List:
+        return [future.result() for future in self.submit_many(items)]
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Leave the stop marker for the next _collect after this batch runs.
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"batch_fn returned {len(results)} results for {len(items)} items")
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def close(self):
+        """
+        Stop the worker after the queued items are processed.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0}
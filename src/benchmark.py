@@ -0,0 +1,295 @@
+# src/benchmark.py
+# Benchmarks for the indexing and query hot paths on a synthetic corpus, run
+# against the CPU model backend so no GPU or weights are needed. Each stage
+# reports throughput and p50/p95/p99 latency; results are written as JSON and
+# can be compared with an earlier run to catch regressions.
+#
+# Usage: python benchmark.py [--docs N] [--doc-words N] [--dim N] [--queries N]
+#                            [--output results.json] [--compare baseline.json]
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
+
+import backends
+from quantization import (
+    QUANTIZATION_NONE, QUANTIZATION_INT8, QUANTIZATION_BINARY, attach_quantized, memory_report, recall_report,
+)
+
+DEFAULT_DOCS = 1000
+DEFAULT_DOC_WORDS = 300
+DEFAULT_DIM = 1024           # Embedding dimension of the synthetic retrieval index
+DEFAULT_CHUNKS_PER_DOC = 4
+DEFAULT_QUERIES = 200
+N_TOPICS = 50
+REGRESSION_TOLERANCE = 1.25  # A stage regresses when its p95 grows beyond this factor
+
+_COMMON_WORDS = ("the of and to in is that for it as with was on be by this are from or an at which "
+                 "data system model time use user value result process method case level point").split()
+
+
+def _topic_words(topic: int, n: int = 12) -> List[str]:
+    return [f"t{topic}w{i}" for i in range(n)]
+
+
+def synthetic_corpus(n_docs: int, words_per_doc: int, seed: int = 0) -> List[Dict]:
+    """
+    Documents of sentences mixing common words with the words of one topic,
+    so topic-word queries have a known set of relevant documents.
+    """
+    rng = np.random.default_rng(seed)
+    docs = []
+    for i in range(n_docs):
+        topic = int(rng.integers(N_TOPICS))
+        vocabulary = _COMMON_WORDS + _topic_words(topic) * 2
+        words = rng.choice(vocabulary, words_per_doc)
+        sentences = [" ".join(words[j:j + 12]).capitalize() + "." for j in range(0, words_per_doc, 12)]
+        docs.append({"name": f"doc{i:06d}.txt", "topic": topic, "text": " ".join(sentences)})
+    return docs
+
+
+def synthetic_queries(n_queries: int, seed: int = 1) -> List[str]:
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(_topic_words(int(rng.integers(N_TOPICS))), 4)) + "?" for _ in range(n_queries)]
+
+
+def synthetic_index(n_docs: int, chunks_per_doc: int, dim: int, seed: int = 0) -> List[Dict]:
+    """
+    Documents with random unit chunk embeddings, in the shape load_index_sqlite returns.
+    """
+    rng = np.random.default_rng(seed)
+    docs = []
+    for i in range(n_docs):
+        embedding = rng.standard_normal((chunks_per_doc, dim)).astype(np.float32)
+        embedding /= np.linalg.norm(embedding, axis=1, keepdims=True)
+        docs.append({"id": i + 1, "file": f"doc{i:06d}.txt", "content": f"document {i}", "embedding": embedding})
+    return docs
+
+
+def write_synthetic_db(db_file: str, docs: List[Dict], dtype: str = "float32"):
+    from embedding_store import ensure_index_tables, insert_document
+    conn = sqlite3.connect(db_file)
+    ensure_index_tables(conn)
+    cursor = conn.cursor()
+    for doc in docs:
+        insert_document(cursor, "file", doc["file"], doc["content"],
+                        [{"embedding": vector} for vector in doc["embedding"]], dtype)
+    conn.commit()
+    conn.close()
+
+
+def latency_stats(samples: List[float], items: int = None) -> Dict:
+    """
+    Summary of per-call latencies in seconds; throughput counts `items`
+    (default: one per call) per second of total time.
+    """
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    total = float(ms.sum()) / 1000
+    items = len(samples) if items is None else items
+    return {
+        "calls": len(samples),
+        "items": items,
+        "total_s": round(total, 4),
+        "throughput_per_s": round(items / total, 2) if total else None,
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def time_calls(fn: Callable, args: Iterable, warmup: int = 1) -> List[float]:
+    args = list(args)
+    for arg in args[:warmup]:
+        fn(arg)
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_chunking(corpus: List[Dict]) -> Dict:
+    from embedding_model import split_text_into_chunks
+    tokenizer = backends.HashingTokenizer()
+    samples = time_calls(lambda doc: split_text_into_chunks(doc["text"], tokenizer), corpus)
+    return latency_stats(samples)
+
+
+def bench_indexing(corpus: List[Dict], work_dir: str) -> Dict:
+    """
+    Full fetch -> embed -> write pipeline over the corpus as local files.
+    """
+    from embedding_node import run_indexing
+    data_dir = os.path.join(work_dir, "data")
+    os.makedirs(os.path.join(data_dir, "links"), exist_ok=True)
+    for doc in corpus:
+        with open(os.path.join(data_dir, doc["name"]), "w", encoding="utf-8") as f:
+            f.write(doc["text"])
+    db_file = os.path.join(work_dir, "index.db")
+    start = time.perf_counter()
+    run_indexing(os.path.join(data_dir, "links"), db_file, "benchmark-embedding")
+    return dict(latency_stats([time.perf_counter() - start], items=len(corpus)), db_file=db_file)
+
+
+def bench_retrieval(docs: List[Dict], queries: np.ndarray, work_dir: str) -> Dict:
+    from qa_node import load_index_sqlite, retrieve_relevant_documents, retrieve_relevant_chunks
+    from index_cache import IndexCache
+    from retrieval import VectorIndex
+    from vector_store import update_vector_store
+    db_file = os.path.join(work_dir, "retrieval.db")
+    write_synthetic_db(db_file, docs)
+    results = {}
+    results["load_index_sqlite"] = latency_stats(time_calls(lambda _: load_index_sqlite(db_file), range(3)),
+                                                 items=3 * len(docs))
+    results["index_cache_refresh"] = latency_stats(time_calls(lambda _: IndexCache(db_file).vector_index, range(3)),
+                                                   items=3 * len(docs))
+    # The same load when the memory-mapped vector store is present.
+    update_vector_store(db_file)
+    results["index_cache_mapped"] = latency_stats(time_calls(lambda _: IndexCache(db_file).vector_index, range(3)),
+                                                  items=3 * len(docs))
+    results["vector_index_build"] = latency_stats(time_calls(lambda _: VectorIndex(docs), range(3)), items=3 * len(docs))
+    # What a refresh pays per newly indexed document, against the full build above.
+    growing = [VectorIndex(docs)]
+
+    def extend_one(doc):
+        growing[0] = growing[0].extend([dict(doc, id=-1 - len(growing[0].docs))])
+    results["vector_index_extend"] = latency_stats(time_calls(extend_one, docs[:50]))
+    index = VectorIndex(docs)
+    results["retrieve_relevant_documents"] = latency_stats(
+        time_calls(lambda q: retrieve_relevant_documents(q, index, min_similarity=-1.0), queries))
+    results["retrieve_relevant_chunks"] = latency_stats(
+        time_calls(lambda q: retrieve_relevant_chunks(q, index, min_similarity=-1.0), queries))
+    for method in (QUANTIZATION_INT8, QUANTIZATION_BINARY):
+        attach_quantized(index, method)
+        results[f"retrieve_relevant_documents_{method}"] = latency_stats(
+            time_calls(lambda q: retrieve_relevant_documents(q, index, min_similarity=-1.0), queries))
+    attach_quantized(index, QUANTIZATION_NONE)
+    return results
+
+
+def quantization_report(docs: List[Dict], n_queries: int, k: int = 10) -> Dict:
+    """
+    Memory of the int8/binary codes and their recall@k against float32 search,
+    with queries that are perturbed stored chunks (so true neighbours exist).
+    """
+    from retrieval import VectorIndex
+    index = VectorIndex(docs)
+    rng = np.random.default_rng(3)
+    queries = index.matrix[rng.choice(len(index.matrix), n_queries)]
+    queries = queries + rng.normal(0, 0.05, queries.shape).astype(np.float32)
+    return {"memory": memory_report(index), "recall": recall_report(index, queries, k)}
+
+
+def bench_retrieval_modes(db_file: str, queries: List[str]) -> Dict:
+    """
+    Dense, lexical and hybrid retrieval over the indexed synthetic corpus.
+    """
+    from qa_node import QAClass, RETRIEVAL_MODES
+    qa = QAClass(db_file, "benchmark-embedding", "benchmark-llm")
+    index = qa.index_cache.vector_index
+    embedded = [(query, qa.embedding_model.embed_text(query)) for query in queries]
+    return {f"retrieve_{mode}": latency_stats(time_calls(lambda item: qa._retrieve(item[0], item[1], index, mode, {}),
+                                                         embedded))
+            for mode in RETRIEVAL_MODES}
+
+
+def bench_answer(db_file: str, queries: List[str], llm_latency: float = 0.0) -> Dict:
+    from qa_node import QAClass
+    qa = QAClass(db_file, "benchmark-embedding", "benchmark-llm")
+    generator = qa.llm.model.engine
+    generator.first_token_latency = generator.token_latency = llm_latency
+    results = {"answer": latency_stats(time_calls(qa.answer, queries))}
+    ttft = []
+    for query in queries:
+        for event in qa.answer_stream(query):
+            if event["type"] == "done" and event["ttft_ms"] is not None:
+                ttft.append(event["ttft_ms"] / 1000)
+    results["answer_stream_ttft"] = latency_stats(ttft)
+    return results
+
+
+def run_benchmarks(n_docs: int = DEFAULT_DOCS, doc_words: int = DEFAULT_DOC_WORDS, dim: int = DEFAULT_DIM,
+                   chunks_per_doc: int = DEFAULT_CHUNKS_PER_DOC, n_queries: int = DEFAULT_QUERIES,
+                   llm_latency: float = 0.0) -> Dict:
+    # Stub models: hashing embedder and a fake generator with the given per-token latency.
+    backends.DEFAULT_BACKEND = backends.BACKEND_CPU
+    work_dir = tempfile.mkdtemp(prefix="rag-bench-")
+    try:
+        corpus = synthetic_corpus(n_docs, doc_words)
+        query_texts = synthetic_queries(n_queries)
+        rng = np.random.default_rng(2)
+        query_vectors = rng.standard_normal((n_queries, dim)).astype(np.float32)
+        stages = {"split_text_into_chunks": bench_chunking(corpus)}
+        indexing = bench_indexing(corpus, work_dir)
+        db_file = indexing.pop("db_file")
+        stages["run_indexing"] = indexing
+        synthetic = synthetic_index(n_docs, chunks_per_doc, dim)
+        stages.update(bench_retrieval(synthetic, query_vectors, work_dir))
+        quantization = quantization_report(synthetic, n_queries)
+        stages.update(bench_retrieval_modes(db_file, query_texts))
+        stages.update(bench_answer(db_file, query_texts, llm_latency))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "config": {"docs": n_docs, "doc_words": doc_words, "dim": dim, "chunks_per_doc": chunks_per_doc,
+                   "queries": n_queries, "llm_latency": llm_latency, "backend": backends.BACKEND_CPU},
+        "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                        "platform": platform.platform(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "stages": stages,
+        "quantization": quantization,
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = REGRESSION_TOLERANCE) -> List[str]:
+    """
+    Stages whose p95 latency grew by more than `tolerance` times the baseline's.
+    """
+    regressions = []
+    for stage, stats in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if before and before["p95_ms"] and stats["p95_ms"] > before["p95_ms"] * tolerance:
+            regressions.append(f"{stage}: p95 {before['p95_ms']:.3f} ms -> {stats['p95_ms']:.3f} ms")
+    return regressions
+
+
+def print_table(results: Dict):
+    print(f"{'stage':<36}{'calls':>7}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, s in results["stages"].items():
+        print(f"{stage:<36}{s['calls']:>7}{str(s['throughput_per_s']):>12}"
+              f"{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}{s['p99_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark indexing and query stages on a synthetic corpus.")
+    parser.add_argument("--docs", type=int, default=DEFAULT_DOCS)
+    parser.add_argument("--doc-words", type=int, default=DEFAULT_DOC_WORDS)
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM, help="embedding dimension for the retrieval stages")
+    parser.add_argument("--chunks-per-doc", type=int, default=DEFAULT_CHUNKS_PER_DOC)
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="fake generator seconds per token")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON; exit 1 if any stage's p95 regressed")
+    args = parser.parse_args()
+    results = run_benchmarks(args.docs, args.doc_words, args.dim, args.chunks_per_doc, args.queries, args.llm_latency)
+    print_table(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f))
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,187 @@
+# src/caches.py
+# Query-embedding LRU cache and an opt-in semantic answer cache backed by chat_history.
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from db import connection
+from embedding_store import decode_embeddings
+
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL = 24 * 3600           # Seconds
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_TTL = 3600               # Seconds
+ANSWER_CACHE_THRESHOLD = 0.97         # Cosine similarity needed to reuse an answer
+
+
+class LRUCache:
+    """
+    Thread-safe LRU map with optional per-entry TTL and hit/miss counters.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl is not None and time.monotonic() - item[1] > self.ttl:
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def items(self):
+        """
+        Snapshot of live (key, value) pairs, most recently used last.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [(k, v) for k, (v, t) in self._data.items() if self.ttl is None or now - t <= self.ttl]
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hits / total if total else 0.0}
+
+
+query_embedding_cache = LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+
+def _normalize_query(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+def embed_query(embedding_model, model_path: str, text: str):
+    """
+    embed_text with an LRU cache keyed by model and whitespace/case-normalized text.
+    """
+    key = (model_path, _normalize_query(text))
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        embedding = embedding_model.embed_text(text)
+        query_embedding_cache.put(key, embedding)
+    return embedding
+
+
+def _unit_vector(embedding) -> np.ndarray:
+    vec = np.asarray(embedding, dtype=np.float32)
+    vec = vec.reshape(-1, vec.shape[-1]).mean(axis=0)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class SemanticAnswerCache:
+    """
+    Returns a stored answer when a new query is within `threshold` cosine
+    similarity of a recent one asked in the same session and answered against
+    the same index version. Answers depend on the session's conversation
+    memory, so they are never shared between sessions. Entries are warmed
+    from the session's chat_history rows that recorded the current index version.
+    """
+
+    def __init__(self, db_file: str, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL):
+        self.db_file = db_file
+        self.threshold = threshold
+        self._entries = LRUCache(maxsize, ttl)
+        self._warmed_version = None
+        self._warmed_sessions = set()
+        self._lock = threading.Lock()
+
+    def _warm(self, index_version: str, session_id: Optional[str]):
+        """
+        Load the session's recent answers for this index version from chat_history
+        (once per session and version).
+        """
+        with self._lock:
+            if self._warmed_version != index_version:
+                self._warmed_version = index_version
+                self._warmed_sessions.clear()
+            if session_id in self._warmed_sessions:
+                return
+            self._warmed_sessions.add(session_id)
+            with connection(self.db_file) as conn:
+                cursor = conn.execute("""
+                    SELECT user_message, bot_answer, user_embedding, embedding_dim, embedding_dtype
+                    FROM chat_history
+                    WHERE session_id IS ? AND index_version = ? AND user_embedding IS NOT NULL
+                      AND timestamp >= datetime('now', ?)
+                    ORDER BY id DESC LIMIT ?
+                """, (session_id, index_version, f"-{int(self._entries.ttl or 0)} seconds", self._entries.maxsize))
+                rows = cursor.fetchall()
+        # Oldest first so the most recent rows end up most recently used.
+        for query, answer, blob, dim, dtype in reversed(rows):
+            self.add(query, decode_embeddings(blob, dim, dtype), answer, index_version, session_id)
+
+    def lookup(self, query_embedding, index_version: str, session_id: str = None) -> Optional[str]:
+        self._warm(index_version, session_id)
+        query_vec = _unit_vector(query_embedding)
+        candidates = [(key, vec, answer) for key, (vec, answer, version) in self._entries.items()
+                      if key[0] == session_id and version == index_version and vec.shape == query_vec.shape]
+        if candidates:
+            scores = np.stack([vec for _, vec, _ in candidates]) @ query_vec
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                # Counts the hit and refreshes the entry's LRU position.
+                self._entries.get(candidates[best][0])
+                return candidates[best][2]
+        self._entries.record_miss()
+        return None
+
+    def add(self, query: str, query_embedding, answer: str, index_version: str, session_id: str = None):
+        self._entries.put((session_id, _normalize_query(query)), (_unit_vector(query_embedding), answer, index_version))
+
+    def stats(self) -> dict:
+        return dict(self._entries.stats(), threshold=self.threshold)
+
+
+_answer_caches = {}
+_answer_caches_lock = threading.Lock()
+
+
+def get_answer_cache(db_file: str) -> SemanticAnswerCache:
+    with _answer_caches_lock:
+        if db_file not in _answer_caches:
+            _answer_caches[db_file] = SemanticAnswerCache(db_file)
+        return _answer_caches[db_file]
+
+
+def cache_stats() -> dict:
+    stats = {"query_embeddings": query_embedding_cache.stats()}
+    with _answer_caches_lock:
+        for db_file, cache in _answer_caches.items():
+            stats[f"answers:{db_file}"] = cache.stats()
+    return stats
@@ -0,0 +1,134 @@
+# src/chunker.py
+# Single-pass token chunker shared by the embedding and QA paths.
+# The text is tokenized once; chunks are token ranges whose text is sliced from
+# the original string through the tokenizer's offset mapping, so nothing is
+# decoded and re-encoded, and each chunk is guaranteed to fit the token limit.
+import re
+from typing import Dict, List
+
+SNAP_NONE = "none"
+SNAP_SENTENCE = "sentence"
+SNAP_PARAGRAPH = "paragraph"
+
+_BOUNDARIES = {
+    SNAP_PARAGRAPH: re.compile(r"\n\s*\n"),
+    SNAP_SENTENCE: re.compile(r"(?:[.!?]['\")\]]*\s+)|\n\s*\n"),
+}
+MIN_SNAP_FRACTION = 0.5  # Never snap a chunk below this share of the token budget
+
+
+def special_tokens_count(tokenizer) -> int:
+    """
+    Number of special tokens (e.g. CLS/SEP) the model adds around each input.
+    """
+    try:
+        return tokenizer.num_special_tokens_to_add(pair=False)
+    except (AttributeError, TypeError):
+        return 0
+
+
+def _encode(text: str, tokenizer):
+    """
+    Token ids and (start, end) character offsets for text, without special tokens.
+    Offsets are None when the tokenizer cannot provide them (slow tokenizers).
+    """
+    try:
+        encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        return list(encoding["input_ids"]), [tuple(o) for o in encoding["offset_mapping"]]
+    except (NotImplementedError, KeyError, TypeError, ValueError):
+        return list(tokenizer.encode(text, add_special_tokens=False)), None
+
+
+def _boundary_starts(text: str, mode: str) -> List[int]:
+    pattern = _BOUNDARIES.get(mode)
+    if pattern is None:
+        return []
+    return [m.end() for m in pattern.finditer(text)]
+
+
+def _snap_end(offsets, boundaries, start: int, end: int, budget: int) -> int:
+    """
+    Move `end` back to the last token that starts right after a boundary, as
+    long as the chunk keeps at least MIN_SNAP_FRACTION of the budget.
+    """
+    if not boundaries:
+        return end
+    floor = start + max(1, int(budget * MIN_SNAP_FRACTION))
+    # Character position the chunk currently ends at.
+    limit = offsets[end][0]
+    lo = offsets[floor][0] if floor < end else limit
+    best = None
+    for pos in boundaries:
+        if pos > limit:
+            break
+        if pos >= lo:
+            best = pos
+    if best is None:
+        return end
+    # First token that starts at or after the boundary.
+    for i in range(floor, end):
+        if offsets[i][0] >= best:
+            return i
+    return end
+
+
+def chunk_text(text: str, tokenizer, max_tokens: int, overlap: int = 0, snap: str = SNAP_NONE,
+               reserve_special_tokens: bool = True, with_token_ids: bool = False) -> List[Dict]:
+    """
+    Split text into chunks of at most max_tokens tokens (including the model's
+    special tokens when reserve_special_tokens is set).
+
+    Each chunk is a dict with token_start/token_end and char_start/char_end
+    (None if the tokenizer has no offset mapping) plus "text". Consecutive chunks
+    share `overlap` tokens. With snap="sentence" or "paragraph", chunk ends are
+    moved back to the nearest boundary when one is close enough. With
+    with_token_ids=True each chunk also carries "token_ids" ready to be sent to
+    the engine, including special tokens, so it is not tokenized again.
+    """
+    budget = max_tokens - (special_tokens_count(tokenizer) if reserve_special_tokens else 0)
+    if budget <= 0:
+        raise ValueError(f"max_tokens={max_tokens} leaves no room for content")
+    overlap = max(0, min(overlap, budget - 1))
+    ids, offsets = _encode(text, tokenizer)
+    boundaries = _boundary_starts(text, snap) if offsets is not None else []
+
+    ranges = []
+    start = 0
+    while True:
+        end = min(start + budget, len(ids))
+        if end < len(ids):
+            end = _snap_end(offsets, boundaries, start, end, budget) if boundaries else end
+        ranges.append((start, end))
+        if end >= len(ids):
+            break
+        start = max(end - overlap, start + 1)
+
+    chunks = []
+    for i, (start, end) in enumerate(ranges):
+        chunk = {"token_start": start, "token_end": end}
+        if offsets is not None:
+            if len(ranges) == 1:
+                char_start, char_end = 0, len(text)
+            else:
+                # Without overlap, chunks tile the text: each ends where the next begins.
+                char_start = 0 if start == 0 else offsets[start][0]
+                if end >= len(ids):
+                    char_end = len(text)
+                elif overlap == 0:
+                    char_end = offsets[end][0]
+                else:
+                    char_end = offsets[end - 1][1]
+            chunk.update(char_start=char_start, char_end=char_end, text=text[char_start:char_end])
+        else:
+            chunk.update(char_start=None, char_end=None, text=tokenizer.decode(ids[start:end]))
+        if with_token_ids:
+            chunk["token_ids"] = _with_special_tokens(tokenizer, ids[start:end]) if reserve_special_tokens else ids[start:end]
+        chunks.append(chunk)
+    return chunks
+
+
+def _with_special_tokens(tokenizer, ids: List[int]) -> List[int]:
+    try:
+        return tokenizer.build_inputs_with_special_tokens(ids)
+    except (AttributeError, NotImplementedError):
+        return ids
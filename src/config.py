@@ -0,0 +1,12 @@
+# src/config.py
+# Paths and model names shared by the web app, the indexer and the model server.
+# Kept free of imports beyond os, so any process can read them without loading Flask.
+import os
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LINKS_FILE = os.path.join(BASE_DIR, "data", "links", "example_links.txt")
+INDEX_OUTPUT_FILE = os.path.join(BASE_DIR, "data", "index.db")
+#EMBEDDING_MODEL_PATH = os.path.join(BASE_DIR, "models", "embedding_model", "UAE-large-V1-quant.onnx")
+EMBEDDING_MODEL_PATH = "WhereIsAI/UAE-Large-V1"
+LLM_MODEL_PATH = "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B"
+UPLOAD_FOLDER = os.path.join(BASE_DIR, "data", "uploaded")
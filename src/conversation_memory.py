@@ -0,0 +1,141 @@
+# src/conversation_memory.py
+# Per-session chat history for the LLM: each session keeps only the most recent
+# turns that fit a token budget, older turns are dropped (or folded into a short
+# summary), and the number of sessions held in memory is bounded by an LRU.
+import threading
+from typing import Callable, Dict, List, Optional
+
+from caches import LRUCache
+
+SYSTEM_PROMPT = "You are a helpful assistant for answering questions based on the provided embedded documents."
+HISTORY_TOKEN_BUDGET = 2048        # Tokens of previous turns (and summary) sent with each prompt
+SESSION_STORE_SIZE = 256           # Sessions kept in memory; least recently used are evicted
+SESSION_TTL = 6 * 3600             # Seconds of inactivity before a session is forgotten
+
+
+class Conversation:
+    def __init__(self):
+        # (user_text, assistant_text, tokens) per turn, oldest first.
+        self.turns = []
+        self.tokens = 0
+        self.summary = None
+        self.summary_tokens = 0
+        # Dropped turns waiting to be folded into the summary.
+        self.pending = []
+        self.lock = threading.Lock()
+        # Held while summarizing (outside `lock`), so one summary is generated at a time.
+        self.compact_lock = threading.Lock()
+
+
+class ConversationMemory:
+    """
+    Conversation state keyed by session id. `count_tokens(text)` measures
+    message length; `summarize(previous_summary, turns)` is optional and, when
+    given, turns that fall out of the budget are compacted into a summary that
+    is sent as part of the system message instead of being forgotten.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], token_budget: int = HISTORY_TOKEN_BUDGET,
+                 maxsize: int = SESSION_STORE_SIZE, ttl: float = SESSION_TTL,
+                 summarize: Optional[Callable[[Optional[str], List], str]] = None,
+                 system_prompt: str = SYSTEM_PROMPT):
+        self.count_tokens = count_tokens
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.system_prompt = system_prompt
+        self._sessions = LRUCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self.compactions = 0
+
+    def _get(self, session_id: str) -> Conversation:
+        conversation = self._sessions.get(session_id)
+        if conversation is None:
+            with self._lock:
+                conversation = self._sessions.get(session_id)
+                if conversation is None:
+                    conversation = Conversation()
+                    self._sessions.put(session_id, conversation)
+        return conversation
+
+    def messages(self, session_id: Optional[str], prompt: str) -> List[Dict]:
+        """
+        Chat messages for the next turn: system message, the session's retained
+        turns and the new prompt. Without a session id the prompt is sent alone.
+        """
+        system = self.system_prompt
+        turns = []
+        if session_id is not None:
+            conversation = self._get(session_id)
+            with conversation.lock:
+                if conversation.summary:
+                    system = f"{system}\n\nSummary of the earlier conversation:\n{conversation.summary}"
+                turns = list(conversation.turns)
+        messages = [{"role": "system", "content": system}]
+        for user_text, assistant_text, _ in turns:
+            messages.append({"role": "user", "content": user_text})
+            messages.append({"role": "assistant", "content": assistant_text})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def record(self, session_id: Optional[str], prompt: str, reply: str):
+        """
+        Append a finished turn and trim the session back under the token budget.
+        """
+        if session_id is None:
+            return
+        conversation = self._get(session_id)
+        tokens = self.count_tokens(prompt) + self.count_tokens(reply)
+        with conversation.lock:
+            conversation.turns.append((prompt, reply, tokens))
+            conversation.tokens += tokens
+            # With compaction on, half of the budget is reserved for the summary.
+            turn_budget = self.token_budget - (self.token_budget // 2 if self.summarize is not None else 0)
+            dropped = []
+            # Always keep the latest turn, even if it alone exceeds the budget.
+            while len(conversation.turns) > 1 and conversation.tokens > turn_budget:
+                turn = conversation.turns.pop(0)
+                conversation.tokens -= turn[2]
+                dropped.append(turn)
+            if not dropped or self.summarize is None:
+                return
+            conversation.pending.extend(dropped)
+        self._compact(conversation, self.token_budget - turn_budget)
+
+    def _compact(self, conversation: Conversation, summary_budget: int):
+        """
+        Fold the conversation's pending turns into its summary. The summary is
+        generated without holding conversation.lock, so the session's turns can
+        be read and recorded meanwhile; turns dropped by such a record are
+        folded in by the compaction already running instead of waiting for it.
+        """
+        if not conversation.compact_lock.acquire(blocking=False):
+            return
+        try:
+            while True:
+                with conversation.lock:
+                    dropped, conversation.pending = conversation.pending, []
+                    previous = conversation.summary
+                    if not dropped:
+                        # Released under conversation.lock: a record that adds pending turns
+                        # after this either was seen above or can take the compaction over.
+                        conversation.compact_lock.release()
+                        return
+                summary = self.summarize(previous, dropped)
+                summary_tokens = self.count_tokens(summary)
+                with conversation.lock:
+                    # A summary that outgrows its share is discarded rather than crowding out recent turns.
+                    if summary_tokens <= summary_budget:
+                        conversation.summary, conversation.summary_tokens = summary, summary_tokens
+                    else:
+                        conversation.summary, conversation.summary_tokens = None, 0
+                    self.compactions += 1
+        except BaseException:
+            conversation.compact_lock.release()
+            raise
+
+    def reset(self, session_id: str):
+        with self._lock:
+            self._sessions.put(session_id, Conversation())
+
+    def stats(self) -> dict:
+        return dict(self._sessions.stats(), token_budget=self.token_budget, compactions=self.compactions)
@@ -0,0 +1,125 @@
+# src/db.py
+# Shared access to index.db. Connections run in WAL mode, so readers (the
+# status page, chat history, the index cache) keep working while indexing
+# holds the write lock, and are pooled per database file: a thread borrows one
+# for the duration of a `with connection(db_file)` block and hands it back.
+# The schema (tables, secondary indexes, migrations) is set up once per file,
+# when its pool is created, instead of on every request.
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+POOL_SIZE = 8             # Idle connections kept per database file
+BUSY_TIMEOUT_SECONDS = 5  # How long a writer waits for the lock before failing
+
+
+def open_connection(db_file: str, check_same_thread: bool = False) -> sqlite3.Connection:
+    """
+    A new connection with the settings every user of index.db relies on.
+    """
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=check_same_thread)
+    # WAL is persistent in the file; setting it again is a no-op.
+    conn.execute("PRAGMA journal_mode=WAL")
+    # Durable across application crashes; only an OS crash can lose the last commits.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def ensure_schema(conn: sqlite3.Connection):
+    """
+    Create or migrate every table and index the application uses.
+    """
+    from embedding_store import ensure_index_tables, ensure_chat_history_table
+    from fingerprints import ensure_fingerprints_table
+    ensure_index_tables(conn)
+    ensure_chat_history_table(conn)
+    ensure_fingerprints_table(conn)
+    conn.commit()
+
+
+class ConnectionPool:
+    """
+    Connections to one database file. A connection is used by one thread at a
+    time and returned to the pool afterwards, so request threads do not pay
+    for opening (and configuring) a connection each time.
+    """
+
+    def __init__(self, db_file: str, size: int = POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection; the transaction is committed when the block
+        succeeds and rolled back when it raises.
+        """
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = open_connection(self.db_file)
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_file: str) -> ConnectionPool:
+    """
+    The process-wide pool for db_file, setting up its schema on first use.
+    """
+    key = os.path.abspath(db_file)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(db_file)
+            with pool.connection() as conn:
+                ensure_schema(conn)
+            _pools[key] = pool
+        return pool
+
+
+def init_db(db_file: str):
+    """
+    Set up the schema at startup, so the first request does not pay for it.
+    """
+    get_pool(db_file)
+
+
+def connection(db_file: str):
+    """
+    Borrow a pooled connection to db_file: `with connection(db_file) as conn: ...`.
+    """
+    return get_pool(db_file).connection()
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
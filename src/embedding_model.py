@@ -1,46 +1,80 @@
 # src/embedding_model.py
 # Removed langgraph dependency and implemented a custom LocalEmbeddingNode.
-from vllm import LLM 
+from backends import create_embedding_backend
+from chunker import chunk_text, SNAP_SENTENCE
+from batch_scheduler import MicroBatcher
 
-MAX_TOKENS = 512  # Adjust based on model token limit
-TOKEN_OVERHEAD = 8  # Reserve extra tokens (adjust if needed)
-EFFECTIVE_MAX = MAX_TOKENS - TOKEN_OVERHEAD
+MAX_TOKENS = 512  # Adjust based on model token limit (special tokens included)
+EMBED_BATCH_SIZE = 64  # Chunks submitted to the engine per embed call
+CHUNK_OVERLAP = 0  # Tokens shared by consecutive chunks
+CHUNK_SNAP = SNAP_SENTENCE  # Prefer ending chunks at sentence boundaries
 
-# New helper that uses the engine's tokenizer to compute token count and split text
-### TODO fix problem with chunking the incoming text that make overflow the token length ###
+# Uses the engine's tokenizer to split text into chunks that fit the model.
 def split_text_into_chunks(text: str, tokenizer, max_tokens: int = MAX_TOKENS):
-    tokens = tokenizer.encode(text)
-    # Change "<" to "<=" so that a prompt with exactly max_tokens is not split.
-    if len(tokens) <= EFFECTIVE_MAX:
-        return [text]
-    chunks = []
-    for i in range(0, len(tokens), EFFECTIVE_MAX):
-        chunk_tokens = tokens[i:i+EFFECTIVE_MAX]
-        chunk_text = tokenizer.decode(chunk_tokens)
-        chunks.append(chunk_text)
-    return chunks
+    return [chunk["text"] for chunk in chunk_text(text, tokenizer, max_tokens, CHUNK_OVERLAP, CHUNK_SNAP)]
 
 class LocalEmbeddingNode:
-    def __init__(self, model_path: str):
-        self.engine = LLM(model_path, task="embed", trust_remote_code=True)
+    def __init__(self, model_path: str, backend: str = None):
+        # vLLM or the CPU stand-in, see backends.py.
+        self.engine = create_embedding_backend(model_path, backend)
+        # Concurrent callers (e.g. query embeddings from several Flask threads)
+        # are merged into shared engine.embed calls.
+        self.batcher = MicroBatcher(self._embed_prompts, max_batch_size=EMBED_BATCH_SIZE, name="embed-batcher")
+
+    def _embed_prompts(self, prompts):
+        # One embedding per prompt.
+        return self.engine.embed(prompts)
     
     def run(self, text: str):
-        # Generate output using vllm's embed method
-        outputs = self.engine.embed(text)
-        return [output.outputs.embedding for output in outputs] 
+        return [self.batcher(text)]
+
+    def run_batch(self, prompts):
+        # A prompt is a string or {"prompt_token_ids": [...]} for pre-tokenized input.
+        return self.batcher.map(prompts)
+
+    def close(self):
+        self.batcher.close()
 
 class EmbeddingModel:
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, backend: str = None):
         # Instantiate the local embedding node using the given model_path.
-        self.model = LocalEmbeddingNode(model_path=model_path)
+        self.model = LocalEmbeddingNode(model_path=model_path, backend=backend)
+
+    def close(self):
+        self.model.close()
 
     def embed_text(self, text: str):
         """
         Generate embeddings for the given text by splitting based on token count.
         Returns a list of embeddings (one per chunk).
         """
-        # Use the engine's tokenizer to split the text
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts, batch_size: int = EMBED_BATCH_SIZE, return_spans: bool = False):
+        """
+        Embed many texts at once. All texts are split into chunks, the chunks are
+        sent to the engine in batches of batch_size, and the results are regrouped
+        so that entry i is the list of chunk embeddings for texts[i].
+        With return_spans=True each chunk is a dict with its char/token offsets
+        and its "embedding" instead of a bare vector.
+        """
+        # Tokenize each text once; the chunk token ids go straight to the engine.
         tokenizer = self.model.engine.get_tokenizer()
-        chunks = split_text_into_chunks(text, tokenizer, max_tokens=MAX_TOKENS)
-        embeddings = [self.model.run(chunk) for chunk in chunks]
+        all_chunks = []
+        owners = []
+        for i, text in enumerate(texts):
+            for chunk in chunk_text(text, tokenizer, MAX_TOKENS, CHUNK_OVERLAP, CHUNK_SNAP, with_token_ids=True):
+                all_chunks.append(chunk)
+                owners.append(i)
+        vectors = []
+        for start in range(0, len(all_chunks), batch_size):
+            batch = all_chunks[start:start + batch_size]
+            vectors.extend(self.model.run_batch([{"prompt_token_ids": chunk["token_ids"]} for chunk in batch]))
+        embeddings = [[] for _ in texts]
+        for owner, chunk, vector in zip(owners, all_chunks, vectors):
+            if return_spans:
+                span = {key: chunk[key] for key in ("char_start", "char_end", "token_start", "token_end")}
+                embeddings[owner].append(dict(span, embedding=vector))
+            else:
+                embeddings[owner].append(vector)
         return embeddings
@@ -0,0 +1,327 @@
+# src/embedding_store.py
+# Binary storage format and schema for embeddings kept in index.db.
+# Vectors are little-endian BLOBs of shape (n, embedding_dim), stored together
+# with the dimension and dtype needed to decode them: one row per chunk in the
+# chunks table, and one row per message pair in chat_history.
+import json
+import re
+import sqlite3
+import sys
+import numpy as np
+
+DEFAULT_DTYPE = "float32"
+SUPPORTED_DTYPES = ("float32", "float16")
+# Terms of a lexical query: words, and codes/identifiers such as ERR-42 or v1.2.
+_QUERY_TERM = re.compile(r"\w[\w.\-:/]*\w|\w")
+
+
+def _np_dtype(dtype: str):
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype} (expected one of {SUPPORTED_DTYPES})")
+    return np.dtype(dtype).newbyteorder("<")
+
+
+def encode_embeddings(embeddings, dtype: str = DEFAULT_DTYPE):
+    """
+    Pack a list of chunk embeddings (any nesting ending in the vector axis) into bytes.
+    Returns (blob, dim, dtype).
+    """
+    arr = np.asarray(embeddings, dtype=_np_dtype(dtype))
+    if arr.ndim == 0 or arr.size == 0:
+        raise ValueError("Cannot encode an empty embedding")
+    dim = arr.shape[-1]
+    arr = np.ascontiguousarray(arr.reshape(-1, dim))
+    return arr.tobytes(), dim, dtype
+
+
+def decode_embeddings(blob: bytes, dim: int, dtype: str = DEFAULT_DTYPE) -> np.ndarray:
+    """
+    Zero-copy view of a stored BLOB as a read-only (n_chunks, dim) array.
+    """
+    return np.frombuffer(blob, dtype=_np_dtype(dtype)).reshape(-1, dim)
+
+
+def _columns(cursor, table: str):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _migrate_json_columns(conn, table: str, json_columns, dtype: str = DEFAULT_DTYPE) -> int:
+    """
+    Convert JSON-encoded embedding columns of a legacy table to BLOBs in place and
+    add the embedding_dim / embedding_dtype metadata columns. Returns the number of rows converted.
+    """
+    cursor = conn.cursor()
+    columns = _columns(cursor, table)
+    if not columns or "embedding_dim" in columns:
+        return 0
+    print(f"Migrating {table} vectors from JSON to {dtype} BLOBs...")
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN embedding_dim INTEGER")
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN embedding_dtype TEXT")
+    cursor.execute(f"SELECT id, {', '.join(json_columns)} FROM {table}")
+    updates = []
+    for row in cursor.fetchall():
+        row_id, values = row[0], row[1:]
+        blobs, dim = [], None
+        for value in values:
+            if value is None:
+                blobs.append(None)
+                continue
+            blob, dim, _ = encode_embeddings(json.loads(value), dtype)
+            blobs.append(blob)
+        updates.append((*blobs, dim, dtype, row_id))
+    assignments = ", ".join(f"{col} = ?" for col in json_columns)
+    cursor.executemany(
+        f"UPDATE {table} SET {assignments}, embedding_dim = ?, embedding_dtype = ? WHERE id = ?",
+        updates,
+    )
+    conn.commit()
+    return len(updates)
+
+
+def _ensure_legacy_embeddings_binary(conn):
+    """
+    Bring a pre-chunk embeddings table (one row per source) to the BLOB format.
+    """
+    _migrate_json_columns(conn, "embeddings", ["embedding"])
+
+
+def _migrate_embeddings_to_chunks(conn) -> int:
+    """
+    Split the legacy embeddings table into documents + chunks, keeping document ids.
+    Character/token offsets of legacy chunks are unknown and left NULL, so
+    retrieval falls back to the whole document for them. Returns documents migrated.
+    """
+    cursor = conn.cursor()
+    if not _columns(cursor, "embeddings"):
+        return 0
+    _ensure_legacy_embeddings_binary(conn)
+    print("Migrating embeddings table to documents + chunks...")
+    cursor.execute("SELECT id, source_type, source, content, embedding, embedding_dim, embedding_dtype FROM embeddings")
+    migrated = 0
+    for row_id, source_type, source, content, blob, dim, dtype in cursor.fetchall():
+        conn.execute(
+            "INSERT INTO documents (id, source_type, source, content) VALUES (?, ?, ?, ?)",
+            (row_id, source_type, source, content),
+        )
+        vectors = decode_embeddings(blob, dim, dtype) if blob is not None else []
+        conn.executemany(
+            "INSERT INTO chunks (document_id, ordinal, embedding, embedding_dim, embedding_dtype) VALUES (?, ?, ?, ?, ?)",
+            [(row_id, ordinal, vector.tobytes(), dim, dtype) for ordinal, vector in enumerate(vectors)],
+        )
+        migrated += 1
+    conn.execute("DROP TABLE embeddings")
+    conn.commit()
+    return migrated
+
+
+def ensure_index_tables(conn) -> int:
+    """
+    Create the documents and chunks tables, migrating a legacy one-row-per-source
+    embeddings table (JSON or BLOB) if one exists. Each document's content is
+    stored once; each chunk row records its position in the document and its vector.
+    Returns the number of legacy documents migrated.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_type TEXT,
+            source TEXT,
+            content TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            document_id INTEGER REFERENCES documents(id) ON DELETE CASCADE,
+            ordinal INTEGER,
+            char_start INTEGER,
+            char_end INTEGER,
+            token_start INTEGER,
+            token_end INTEGER,
+            embedding BLOB,
+            embedding_dim INTEGER,
+            embedding_dtype TEXT
+        )
+    """)
+    migrated = _migrate_embeddings_to_chunks(conn)
+    _ensure_unique_sources(conn)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks(document_id, ordinal)")
+    _ensure_fulltext(conn)
+    return migrated
+
+
+def _ensure_fulltext(conn):
+    """
+    BM25 full-text index over each document's source and content. It is an
+    external-content FTS5 table (the text is not stored twice), kept in sync
+    with documents by triggers, so every writer maintains it. Existing
+    documents are indexed when the table is first created. Without FTS5 in
+    the SQLite build, lexical retrieval is unavailable and queries fall back
+    to dense retrieval.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents_fts'").fetchone()
+    if exists:
+        return
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE documents_fts USING fts5(
+                source, content, content='documents', content_rowid='id'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"Full-text index unavailable: {e}")
+        return
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON documents BEGIN
+            INSERT INTO documents_fts (rowid, source, content) VALUES (new.id, new.source, new.content);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON documents BEGIN
+            INSERT INTO documents_fts (documents_fts, rowid, source, content)
+            VALUES ('delete', old.id, old.source, old.content);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE ON documents BEGIN
+            INSERT INTO documents_fts (documents_fts, rowid, source, content)
+            VALUES ('delete', old.id, old.source, old.content);
+            INSERT INTO documents_fts (rowid, source, content) VALUES (new.id, new.source, new.content);
+        END
+    """)
+    conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+def fts_query(text: str) -> str:
+    """
+    FTS5 query matching any term of free text. Each term is quoted, so
+    operators and punctuation in the question are never parsed as syntax; a
+    code such as ERR-42 becomes the phrase "err 42".
+    """
+    terms = _QUERY_TERM.findall(text)
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search_fulltext(conn, text: str, limit: int):
+    """
+    (document id, bm25) of the best `limit` documents for text, best first.
+    bm25 is negative; lower is a better match. Empty when the full-text
+    index is unavailable or the text has no terms.
+    """
+    query = fts_query(text)
+    if not query:
+        return []
+    try:
+        cursor = conn.execute(
+            "SELECT rowid, bm25(documents_fts) FROM documents_fts WHERE documents_fts MATCH ? "
+            "ORDER BY rank LIMIT ?",
+            (query, limit),
+        )
+    except sqlite3.OperationalError:
+        return []
+    return cursor.fetchall()
+
+
+def _ensure_unique_sources(conn):
+    """
+    One document per source. Databases written before the constraint may hold
+    duplicates; only the newest row of each source is kept.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_documents_source'"
+    ).fetchone()
+    if exists:
+        return
+    stale = "SELECT id FROM documents WHERE id NOT IN (SELECT MAX(id) FROM documents GROUP BY source)"
+    conn.execute(f"DELETE FROM chunks WHERE document_id IN ({stale})")
+    conn.execute(f"DELETE FROM documents WHERE id IN ({stale})")
+    conn.execute("CREATE UNIQUE INDEX idx_documents_source ON documents(source)")
+    conn.commit()
+
+
+def delete_document(cursor, source: str):
+    """
+    Remove a source's document row and all of its chunks.
+    """
+    delete_documents(cursor, [source])
+
+
+def delete_documents(cursor, sources):
+    """
+    Remove the document rows and chunks of several sources in one statement each.
+    """
+    rows = [(source,) for source in sources]
+    cursor.executemany("DELETE FROM chunks WHERE document_id IN (SELECT id FROM documents WHERE source = ?)", rows)
+    cursor.executemany("DELETE FROM documents WHERE source = ?", rows)
+
+
+def insert_document(cursor, source_type: str, source: str, content: str, chunks, dtype: str = DEFAULT_DTYPE) -> int:
+    """
+    Insert a document and its chunks. `chunks` is a list of dicts with
+    char_start/char_end/token_start/token_end (may be None) and embedding.
+    """
+    cursor.execute(
+        "INSERT INTO documents (source_type, source, content) VALUES (?, ?, ?)",
+        (source_type, source, content),
+    )
+    document_id = cursor.lastrowid
+    rows = []
+    for ordinal, chunk in enumerate(chunks):
+        blob, dim, chunk_dtype = encode_embeddings(chunk["embedding"], dtype)
+        rows.append((document_id, ordinal, chunk.get("char_start"), chunk.get("char_end"),
+                     chunk.get("token_start"), chunk.get("token_end"), blob, dim, chunk_dtype))
+    cursor.executemany("""
+        INSERT INTO chunks (document_id, ordinal, char_start, char_end, token_start, token_end,
+                            embedding, embedding_dim, embedding_dtype)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    return document_id
+
+
+def ensure_chat_history_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            user_message TEXT,
+            bot_answer TEXT,
+            user_embedding BLOB,
+            bot_embedding BLOB,
+            embedding_dim INTEGER,
+            embedding_dtype TEXT,
+            index_version TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    _migrate_json_columns(conn, "chat_history", ["user_embedding", "bot_embedding"])
+    # Older tables predate the index version used by the semantic answer cache.
+    if "index_version" not in _columns(conn.cursor(), "chat_history"):
+        conn.execute("ALTER TABLE chat_history ADD COLUMN index_version TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_session ON chat_history(session_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_version ON chat_history(index_version, id)")
+
+
+def migrate_index_db(db_file: str):
+    """
+    One-shot migration of an existing index.db to the binary, chunk-level format.
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        converted = {"chat_history": _migrate_json_columns(conn, "chat_history", ["user_embedding", "bot_embedding"])}
+        # Creating the chunk-level tables converts a legacy embeddings table.
+        converted["documents"] = ensure_index_tables(conn)
+        # Reclaim the space freed by the much smaller BLOBs.
+        if any(converted.values()):
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return converted
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python embedding_store.py <path/to/index.db>")
+        sys.exit(1)
+    print(migrate_index_db(sys.argv[1]))
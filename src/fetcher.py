@@ -0,0 +1,181 @@
+# src/fetcher.py
+# Concurrent URL fetching with a shared pooled session, per-host rate limits and retries.
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MAX_WORKERS = 8             # Concurrent fetches overall
+MAX_PER_HOST = 2            # Concurrent fetches against one host
+MIN_HOST_INTERVAL = 0.2     # Seconds between request starts to the same host
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5          # Seconds; doubles on every retry
+REQUEST_TIMEOUT = 10
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostLimiter:
+    """
+    Bounds concurrency per host and spaces out request starts to the same host.
+    """
+
+    def __init__(self, max_per_host: int = MAX_PER_HOST, min_interval: float = MIN_HOST_INTERVAL):
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_start = {}
+
+    def _semaphore(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._semaphores[host]
+
+    def acquire(self, host: str):
+        self._semaphore(host).acquire()
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def release(self, host: str):
+        self._semaphore(host).release()
+
+
+class Fetcher:
+    def __init__(self, max_workers: int = MAX_WORKERS, max_per_host: int = MAX_PER_HOST,
+                 min_host_interval: float = MIN_HOST_INTERVAL, max_retries: int = MAX_RETRIES,
+                 backoff_base: float = BACKOFF_BASE, timeout: float = REQUEST_TIMEOUT,
+                 session: Optional[requests.Session] = None):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.limiter = HostLimiter(max_per_host, min_host_interval)
+        self.session = session or requests.Session()
+        # One keep-alive pool per host, sized to the per-host concurrency limit.
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max(max_per_host, 1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Issue a request through the shared session, honouring the host limits and
+        retrying connection errors and retryable statuses with exponential backoff.
+        """
+        host = urlparse(url).netloc
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            self.limiter.acquire(host)
+            try:
+                response = self.session.request(method, url, **kwargs)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+            finally:
+                self.limiter.release(host)
+            retryable = error is not None or response.status_code in RETRY_STATUSES
+            if not retryable or attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                return response
+            delay = self.backoff_base * (2 ** attempt)
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, **kwargs)
+
+    def fetch_text(self, url: str) -> str:
+        """
+        Fetch a page and return its visible text, or "" on failure.
+        """
+        try:
+            response = self.get(url)
+            response.raise_for_status()
+            return extract_text(response.text)
+        except Exception as e:
+            print(f"Failed to fetch content from {url}: {e}")
+            return ""
+
+    def fetch_conditional(self, url: str, headers: Optional[Dict[str, str]] = None) -> Optional[requests.Response]:
+        """
+        GET with optional conditional headers. Returns the response (200 or 304),
+        or None on failure.
+        """
+        try:
+            response = self.get(url, headers=headers or {})
+            if response.status_code != 304:
+                response.raise_for_status()
+            return response
+        except Exception as e:
+            print(f"Failed to fetch content from {url}: {e}")
+            return None
+
+    def map(self, fn: Callable, items: Iterable) -> Iterator[Tuple]:
+        """
+        Run fn over items on the fetch pool, yielding (item, result) as each completes.
+        Items are pulled lazily so at most 2 * max_workers results are in flight or
+        waiting to be consumed at any time.
+        """
+        items = iter(items)
+        max_pending = 2 * self.max_workers
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {}
+            for item in items:
+                pending[pool.submit(fn, item)] = item
+                if len(pending) >= max_pending:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    yield item, future.result()
+                    for next_item in items:
+                        pending[pool.submit(fn, next_item)] = next_item
+                        break
+
+    def fetch_all(self, urls: Iterable[str]) -> Iterator[Tuple[str, str]]:
+        """
+        Fetch many URLs concurrently, yielding (url, text) as each one completes.
+        Failed or empty pages yield "" and do not stop the remaining fetches.
+        """
+        return self.map(self.fetch_text, urls)
+
+
+def extract_text(html: str) -> str:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    # Remove unwanted elements
+    for script in soup(["script", "style"]):
+        script.decompose()
+    return soup.get_text(separator=" ", strip=True)
+
+
+_default_fetcher = None
+_default_lock = threading.Lock()
+
+
+def get_fetcher() -> Fetcher:
+    """
+    Process-wide Fetcher so every caller shares the same connection pools.
+    """
+    global _default_fetcher
+    with _default_lock:
+        if _default_fetcher is None:
+            _default_fetcher = Fetcher()
+        return _default_fetcher
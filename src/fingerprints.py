@@ -0,0 +1,76 @@
+# src/fingerprints.py
+# Per-source fingerprints so unchanged sources are not re-fetched or re-embedded.
+import hashlib
+import os
+from typing import Dict, Iterable, Optional
+
+FINGERPRINT_COLUMNS = ("source", "source_type", "size", "mtime", "sha256", "etag", "last_modified")
+
+
+def ensure_fingerprints_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS source_fingerprints (
+            source TEXT PRIMARY KEY,
+            source_type TEXT,
+            size INTEGER,
+            mtime REAL,
+            sha256 TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def load_fingerprints(conn) -> Dict[str, Dict]:
+    ensure_fingerprints_table(conn)
+    cursor = conn.execute(f"SELECT {', '.join(FINGERPRINT_COLUMNS)} FROM source_fingerprints")
+    return {row[0]: dict(zip(FINGERPRINT_COLUMNS, row)) for row in cursor.fetchall()}
+
+
+def save_fingerprint(cursor, fingerprint: Dict):
+    save_fingerprints(cursor, [fingerprint])
+
+
+def save_fingerprints(cursor, fingerprints: Iterable[Dict]):
+    """
+    Upsert a batch of fingerprints with one executemany.
+    """
+    rows = [[fingerprint.get(col) for col in FINGERPRINT_COLUMNS] for fingerprint in fingerprints]
+    cursor.executemany(f"""
+        INSERT INTO source_fingerprints ({', '.join(FINGERPRINT_COLUMNS)}, updated_at)
+        VALUES ({', '.join('?' for _ in FINGERPRINT_COLUMNS)}, CURRENT_TIMESTAMP)
+        ON CONFLICT(source) DO UPDATE SET
+            {', '.join(f'{col} = excluded.{col}' for col in FINGERPRINT_COLUMNS[1:])},
+            updated_at = CURRENT_TIMESTAMP
+    """, rows)
+
+
+def sha256_hex(data) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def stat_unchanged(path: str, known: Optional[Dict]) -> Optional[os.stat_result]:
+    """
+    Returns None when size and mtime match the stored fingerprint, otherwise the
+    fresh stat result the caller should hash.
+    """
+    st = os.stat(path)
+    if known and known.get("size") == st.st_size and known.get("mtime") == st.st_mtime:
+        return None
+    return st
+
+
+def conditional_headers(known: Optional[Dict]) -> Dict[str, str]:
+    """
+    If-None-Match / If-Modified-Since headers for a conditional GET.
+    """
+    headers = {}
+    if known:
+        if known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        if known.get("last_modified"):
+            headers["If-Modified-Since"] = known["last_modified"]
+    return headers
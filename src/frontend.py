@@ -1,29 +1,34 @@
-from flask import Flask, request, redirect, url_for, flash, render_template_string, session
+from flask import Flask, request, redirect, url_for, flash, render_template_string, session, Response, stream_with_context
+import json
 import os
-from embedding_node import run_indexing
-import requests  # added import for checking URL accessibility
-import sqlite3  # already imported in this file's context if needed
-import threading  # added import for background processing
-from qa_node import run_qa  # now importing only run_qa
+from model_registry import (registry, get_llm_model, lease_embedding_model, start_warm_up, warm_up_status,
+                            unload_models)
+from indexing_jobs import get_job_manager
+from db import connection, init_db
+from config import LINKS_FILE, INDEX_OUTPUT_FILE, EMBEDDING_MODEL_PATH, LLM_MODEL_PATH, UPLOAD_FOLDER
 import uuid  # to create a unique session id
-import json  # to save embeddings as JSON strings
+# The indexing, QA and cache modules (and numpy, requests, bs4 and the model
+# backends behind them) are imported inside the routes that use them, so the
+# process starts quickly and serves the indexer and status pages right away.
+# import_budget.py checks that this stays true.
 
 app = Flask(__name__)
 app.secret_key = "change_this_secret_key"
 
-# Paths configuration
-BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-LINKS_FILE = os.path.join(BASE_DIR, "data", "links", "example_links.txt")
-INDEX_OUTPUT_FILE = os.path.join(BASE_DIR, "data", "index.db")
-#EMBEDDING_MODEL_PATH = os.path.join(BASE_DIR, "models", "embedding_model", "UAE-large-V1-quant.onnx")
-EMBEDDING_MODEL_PATH = "WhereIsAI/UAE-Large-V1"
-LLM_MODEL_PATH = "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B"
-UPLOAD_FOLDER = os.path.join(BASE_DIR, "data", "uploaded")
+# Reuse a session's stored answers for near-identical questions while the index is
+# unchanged; off unless RAG_SEMANTIC_CACHE=1.
+SEMANTIC_CACHE_ENABLED = os.environ.get("RAG_SEMANTIC_CACHE", "0") == "1"
+# Load the models in a background thread at startup; with RAG_WARM_UP=0 they load
+# on POST /api/models/warm-up or on the first chat request.
+WARM_UP_ON_START = os.environ.get("RAG_WARM_UP", "1") != "0"
+# POST /api/models/unload is unauthenticated, so it is off unless RAG_ALLOW_MODEL_UNLOAD=1.
+MODEL_UNLOAD_ENABLED = os.environ.get("RAG_ALLOW_MODEL_UNLOAD", "0") == "1"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 def check_url_accessible(url: str) -> bool:
+    from fetcher import get_fetcher  # shared pooled session for checking URL accessibility
     try:
-        response = requests.head(url, timeout=5)
+        response = get_fetcher().head(url, timeout=5)
         return response.status_code < 400
     except Exception:
         return False
@@ -44,23 +49,6 @@ def assign_session_id():
     if "session_id" not in session:
         session["session_id"] = str(uuid.uuid4())
 
-def ensure_chat_history_table():
-    conn = sqlite3.connect(INDEX_OUTPUT_FILE)
-    cursor = conn.cursor()
-    cursor.execute(""" 
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT,
-            user_message TEXT,
-            bot_answer TEXT,
-            user_embedding TEXT,
-            bot_embedding TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    conn.commit()
-    conn.close()
-
 @app.route("/", methods=["GET"])
 def index():
     if not os.path.exists(LINKS_FILE):
@@ -170,59 +158,35 @@ def update():
     flash("Links updated successfully.")
     return redirect(url_for("index"))
 
+def _indexing_run(progress):
+    from embedding_node import run_indexing
+    run_indexing(os.path.dirname(LINKS_FILE), INDEX_OUTPUT_FILE, EMBEDDING_MODEL_PATH, progress=progress)
+
 @app.route("/run-indexing", methods=["POST"])
 def run_indexing_route():
-    # Run indexing in a background thread
-    def background_indexing():
-        run_indexing(os.path.dirname(LINKS_FILE), INDEX_OUTPUT_FILE, EMBEDDING_MODEL_PATH)
-    thread = threading.Thread(target=background_indexing)
-    thread.start()
-    # Render a progress page with a spinner and auto-redirect to the status page
-    html = """
-    <!DOCTYPE html>
-    <html>
-      <head>
-        <meta charset="utf-8"/>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0"/>
-        <title>Indexing In Progress</title>
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/materialize/1.0.0/css/materialize.min.css">
-        <style>
-          .spinner {
-            margin: 50px auto;
-            width: 50px;
-            height: 50px;
-            border: 5px solid #ccc;
-            border-top-color: #1abc9c;
-            border-radius: 100%;
-            animation: spin 1s infinite linear;
-          }
-          @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-          }
-        </style>
-      </head>
-      <body>
-        <nav>
-          <div class="nav-wrapper teal">
-            <a href="#" class="brand-logo center">Indexing Status</a>
-          </div>
-        </nav>
-        <div class="container center-align" style="margin-top:50px;">
-          <h5>Indexing process started. Please wait...</h5>
-          <div class="spinner"></div>
-          <p>This may take a few moments.</p>
-        </div>
-        <script>
-          // Redirect to status page after 5 seconds (adjust delay as needed)
-          setTimeout(function(){
-             window.location.href = "/status";
-          }, 5000);
-        </script>
-      </body>
-    </html>
-    """
-    return html
+    # One indexing run at a time; clicks during a run schedule a single follow-up run.
+    get_job_manager().start(_indexing_run)
+    return redirect(url_for("status"))
+
+# Indexing job state polled by the /status page.
+@app.route("/api/indexing", methods=["GET"])
+def api_indexing_status():
+    from flask import jsonify
+    return jsonify(get_job_manager().status())
+
+# Start (or resume, after a cancel or failure) an indexing run.
+@app.route("/api/indexing", methods=["POST"])
+def api_indexing_start():
+    from flask import jsonify
+    return jsonify(get_job_manager().start(_indexing_run)), 202
+
+@app.route("/api/indexing/cancel", methods=["POST"])
+def api_indexing_cancel():
+    from flask import jsonify
+    job = get_job_manager().cancel()
+    if job is None:
+        return jsonify({"error": "No indexing job is running"}), 409
+    return jsonify(job)
 
 @app.route("/upload", methods=["POST"])
 def upload():
@@ -244,11 +208,8 @@ def status():
     # Retrieve indexed websites from the SQLite DB
     indexed = []
     try:
-        conn = sqlite3.connect(INDEX_OUTPUT_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT source_type, source FROM embeddings")
-        indexed = cursor.fetchall()
-        conn.close()
+        with connection(INDEX_OUTPUT_FILE) as conn:
+            indexed = conn.execute("SELECT source_type, source FROM documents ORDER BY id").fetchall()
     except Exception as e:
         print(f"Error reading index: {e}")
     
@@ -272,6 +233,20 @@ def status():
           </div>
         </nav>
         <div class="container" style="margin-top:20px;">
+          <h5>Indexing Job</h5>
+          <div class="card">
+            <div class="card-content">
+              <p id="job-state">No indexing job has run yet.</p>
+              <div class="progress"><div id="job-bar" class="determinate" style="width: 0%"></div></div>
+              <p id="job-counts" class="grey-text"></p>
+            </div>
+            <div class="card-action">
+              <form action="/run-indexing" method="post" style="display:inline;">
+                <button type="submit" class="btn-flat teal-text">Run / Resume</button>
+              </form>
+              <button id="job-cancel" class="btn-flat red-text" style="display:none;">Cancel</button>
+            </div>
+          </div>
           <h5>Indexed Websites</h5>
           <ul class="collection">
             {% for typ, src in indexed %}
@@ -284,41 +259,151 @@ def status():
           <pre>{{ tree }}</pre>
         </div>
         <script src="https://cdnjs.cloudflare.com/ajax/libs/materialize/1.0.0/js/materialize.min.js"></script>
+        <script>
+          const cancelBtn = document.getElementById("job-cancel");
+          let wasActive = false;
+
+          function describe(job) {
+              const p = job.progress;
+              let text = "Job " + job.id + ": " + job.state;
+              if (job.resumes) text += " (resuming " + job.resumes + ")";
+              if (p.eta_s !== null && job.state === "running") text += ", about " + Math.ceil(p.eta_s) + " s left";
+              if (job.error) text += " - " + job.error;
+              return text;
+          }
+
+          async function poll() {
+              try {
+                  const status = await (await fetch("/api/indexing")).json();
+                  const job = status.current || status.recent[0];
+                  const active = Boolean(status.current);
+                  cancelBtn.style.display = active ? "inline-block" : "none";
+                  if (job) {
+                      const p = job.progress;
+                      document.getElementById("job-state").textContent =
+                          describe(job) + (status.pending ? " - another run is queued" : "");
+                      document.getElementById("job-bar").style.width = (p.percent || 0) + "%";
+                      document.getElementById("job-counts").textContent =
+                          p.done + "/" + (p.discovered === null ? "?" : p.discovered) + " sources - " +
+                          p.fetched + " fetched, " + p.embedded + " embedded (" + p.chunks + " chunks), " +
+                          p.written + " written, " + p.unchanged + " unchanged, " + p.skipped + " skipped, " +
+                          p.failed + " failed - " + p.sources_per_s + " sources/s";
+                  }
+                  // Reload once a run finishes so the indexed sources list is current.
+                  if (wasActive && !active) {
+                      window.location.reload();
+                      return;
+                  }
+                  wasActive = active;
+                  setTimeout(poll, active ? 1000 : 5000);
+              } catch (err) {
+                  setTimeout(poll, 5000);
+              }
+          }
+
+          cancelBtn.addEventListener("click", async function() {
+              await fetch("/api/indexing/cancel", { method: "POST" });
+          });
+          poll();
+        </script>
       </body>
     </html>
     """
     return render_template_string(html, indexed=indexed, tree=tree)
 
+def save_chat_turn(session_id: str, query: str, answer: str, index_version: str):
+    from caches import embed_query
+    from embedding_store import encode_embeddings
+    with lease_embedding_model(EMBEDDING_MODEL_PATH) as emb_model:
+        # The query embedding was cached when the QA step embedded it.
+        user_embed, dim, dtype = encode_embeddings(embed_query(emb_model, EMBEDDING_MODEL_PATH, query))
+        bot_embed, _, _ = encode_embeddings(emb_model.embed_text(answer))
+    with connection(INDEX_OUTPUT_FILE) as conn:
+        conn.execute("""
+            INSERT INTO chat_history (session_id, user_message, bot_answer, user_embedding, bot_embedding, embedding_dim, embedding_dtype, index_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            session_id,
+            query,
+            answer,
+            user_embed,
+            bot_embed,
+            dim,
+            dtype,
+            index_version
+        ))
+
 # New API endpoint for interactive chat
 @app.route("/api/chat", methods=["POST"])
 def api_chat():
     from flask import jsonify
-    ensure_chat_history_table()
+    from qa_node import run_qa, RETRIEVAL_MODES
+    from metrics import Trace, span
     data = request.get_json()
     query = data.get("query")
     if not query:
         return jsonify({"error": "Empty query"}), 400
-    answer = run_qa(query, INDEX_OUTPUT_FILE, EMBEDDING_MODEL_PATH, LLM_MODEL_PATH)
-    from embedding_model import EmbeddingModel
-    emb_model = EmbeddingModel(model_path=EMBEDDING_MODEL_PATH)
-    user_embed = emb_model.embed_text(query)
-    bot_embed = emb_model.embed_text(answer)
-    conn = sqlite3.connect(INDEX_OUTPUT_FILE)
-    cursor = conn.cursor()
-    cursor.execute("""
-            INSERT INTO chat_history (session_id, user_message, bot_answer, user_embedding, bot_embedding)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
-            session["session_id"],
-            query,
-            answer,
-            json.dumps(user_embed),
-            json.dumps(bot_embed)
-        ))
-    conn.commit()
-    conn.close()
+    # Optional per-query retrieval mode: "dense", "lexical" or "hybrid".
+    retrieval_mode = data.get("retrieval")
+    if retrieval_mode is not None and retrieval_mode not in RETRIEVAL_MODES:
+        return jsonify({"error": f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}"}), 400
+    # Per-stage timing breakdown in the response with {"timings": true} or ?timings=1.
+    trace = Trace() if data.get("timings") or request.args.get("timings") else None
+    answer, index_version = run_qa(query, INDEX_OUTPUT_FILE, EMBEDDING_MODEL_PATH, LLM_MODEL_PATH,
+                                   use_answer_cache=SEMANTIC_CACHE_ENABLED, session_id=session["session_id"],
+                                   trace=trace, retrieval_mode=retrieval_mode, return_version=True)
+    with span("chat.save_history", trace):
+        save_chat_turn(session["session_id"], query, answer, index_version)
+    if trace is not None:
+        return jsonify({"query": query, "answer": answer, "timings": trace.breakdown()})
     return jsonify({"query": query, "answer": answer})
 
+# Streaming variant of /api/chat as Server-Sent Events: a "sources" event once
+# retrieval is done, "token" events while the answer is generated, then "done"
+# with the full answer and its time-to-first-token.
+@app.route("/api/chat/stream", methods=["POST"])
+def api_chat_stream():
+    from flask import jsonify
+    from qa_node import run_qa_stream, RETRIEVAL_MODES
+    data = request.get_json()
+    query = data.get("query")
+    if not query:
+        return jsonify({"error": "Empty query"}), 400
+    retrieval_mode = data.get("retrieval")
+    if retrieval_mode is not None and retrieval_mode not in RETRIEVAL_MODES:
+        return jsonify({"error": f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}"}), 400
+    session_id = session["session_id"]
+
+    def finish(event):
+        print(f"Streamed answer: ttft={event['ttft_ms']} ms, total={event['total_ms']} ms")
+        save_chat_turn(session_id, query, event["answer"], event["index_version"])
+
+    def events():
+        stream = run_qa_stream(query, INDEX_OUTPUT_FILE, EMBEDDING_MODEL_PATH, LLM_MODEL_PATH,
+                               use_answer_cache=SEMANTIC_CACHE_ENABLED, session_id=session_id,
+                               retrieval_mode=retrieval_mode)
+        try:
+            for event in stream:
+                if event["type"] == "done":
+                    finish(event)
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        except GeneratorExit:
+            # The client went away mid-answer: finish generating it so the turn is still saved.
+            try:
+                for event in stream:
+                    if event["type"] == "done":
+                        finish(event)
+            except Exception as e:
+                print(f"Error finishing answer after disconnect: {e}")
+            raise
+        except Exception as e:
+            print(f"Error streaming answer: {e}")
+            yield f"event: error\ndata: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+
+    # X-Accel-Buffering stops reverse proxies from holding the stream back.
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # Modified /chat route with improved styling and appearance for the chat interface.
 @app.route("/chat", methods=["GET"])
 def chat():
@@ -359,6 +444,12 @@ def chat():
               align-self: flex-start;
               margin-right: auto;
           }
+          .sources {
+              background-color: #EEEEEE;
+              font-size: 0.85em;
+              align-self: flex-start;
+              margin-right: auto;
+          }
           /* Improved text input styling */
           #chat-input {
               min-height: 60px;
@@ -404,6 +495,7 @@ def chat():
               div.textContent = (role === "user" ? "You: " : "AI: ") + message;
               chatWindow.appendChild(div);
               chatWindow.scrollTop = chatWindow.scrollHeight;
+              return div;
           }
 
           async function sendMessage() {
@@ -411,23 +503,59 @@ def chat():
               if (!query) return;
               appendMessage("user", query);
               chatInput.value = "";
+              const botDiv = appendMessage("bot", "");
+              let answer = "";
               try {
-                  const response = await fetch("/api/chat", {
+                  const response = await fetch("/api/chat/stream", {
                       method: "POST",
                       headers: { "Content-Type": "application/json" },
                       body: JSON.stringify({ query })
                   });
-                  const data = await response.json();
-                  if (data.answer) {
-                      appendMessage("bot", data.answer);
-                  } else {
-                      appendMessage("bot", "Error: " + (data.error || "Unknown error"));
+                  if (!response.ok) {
+                      const data = await response.json();
+                      botDiv.textContent = "Error: " + (data.error || "Unknown error");
+                      return;
+                  }
+                  // Read the Server-Sent Events stream and render tokens as they arrive.
+                  const reader = response.body.getReader();
+                  const decoder = new TextDecoder();
+                  let buffer = "";
+                  while (true) {
+                      const { value, done } = await reader.read();
+                      if (done) break;
+                      buffer += decoder.decode(value, { stream: true });
+                      const events = buffer.split("\\n\\n");
+                      buffer = events.pop();
+                      for (const raw of events) {
+                          const line = raw.split("\\n").find(l => l.startsWith("data: "));
+                          if (!line) continue;
+                          const event = JSON.parse(line.slice(6));
+                          if (event.type === "sources") {
+                              showSources(event.sources, botDiv);
+                          } else if (event.type === "token") {
+                              answer += event.text;
+                              botDiv.textContent = "AI: " + answer;
+                              chatWindow.scrollTop = chatWindow.scrollHeight;
+                          } else if (event.type === "done") {
+                              botDiv.title = "First token after " + event.ttft_ms + " ms, total " + event.total_ms + " ms";
+                          } else if (event.type === "error") {
+                              botDiv.textContent = "Error: " + event.error;
+                          }
+                      }
                   }
               } catch (err) {
-                  appendMessage("bot", "Error sending message.");
+                  botDiv.textContent = "Error sending message.";
               }
           }
 
+          function showSources(sources, botDiv) {
+              if (!sources.length) return;
+              const div = document.createElement("div");
+              div.className = "chat-message sources";
+              div.textContent = "Sources: " + sources.map(s => s.source).join(", ");
+              chatWindow.insertBefore(div, botDiv);
+          }
+
           sendBtn.addEventListener("click", sendMessage);
           // Allow Enter to send message (Shift+Enter for newline)
           chatInput.addEventListener("keydown", function(event) {
@@ -444,12 +572,68 @@ def chat():
 @app.route("/delete-chat-history", methods=["POST", "GET"])
 def delete_chat_history():
     if "session_id" in session:
-        conn = sqlite3.connect(INDEX_OUTPUT_FILE)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM chat_history WHERE session_id = ?", (session["session_id"],))
-        conn.commit()
-        conn.close()
+        with connection(INDEX_OUTPUT_FILE) as conn:
+            conn.execute("DELETE FROM chat_history WHERE session_id = ?", (session["session_id"],))
+        # Also forget the conversation the LLM keeps for this session.
+        if registry.is_loaded("llm", LLM_MODEL_PATH):
+            get_llm_model(LLM_MODEL_PATH).reset_session(session["session_id"])
     return ("", 204)
 
+# Hit/miss counters of the query-embedding and semantic answer caches.
+@app.route("/api/cache/stats", methods=["GET"])
+def api_cache_stats():
+    from flask import jsonify
+    from caches import cache_stats
+    stats = cache_stats()
+    if registry.is_loaded("llm", LLM_MODEL_PATH):
+        stats["conversations"] = get_llm_model(LLM_MODEL_PATH).memory.stats()
+    return jsonify(stats)
+
+# Release the shared models, e.g. to free GPU memory between indexing and chat sessions.
+# Requests still using a model finish first; it is closed after the last of them.
+@app.route("/api/models/unload", methods=["POST"])
+def api_unload_models():
+    from flask import jsonify
+    if not MODEL_UNLOAD_ENABLED:
+        return jsonify({"error": "Model unloading is disabled (set RAG_ALLOW_MODEL_UNLOAD=1)"}), 403
+    return jsonify({"unloaded": unload_models()})
+
+# Stage latency histograms and item counters in Prometheus text format.
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    from metrics import render_prometheus
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+# Readiness probe: 200 once both models are loaded, 503 while they are still loading.
+@app.route("/api/ready", methods=["GET"])
+def api_ready():
+    from flask import jsonify
+    models = {
+        "embedding": registry.is_loaded("embedding", EMBEDDING_MODEL_PATH),
+        "llm": registry.is_loaded("llm", LLM_MODEL_PATH),
+    }
+    ready = all(models.values())
+    body = {"ready": ready, "models": models, "warm_up": warm_up_status()}
+    # With RAG_BACKEND=remote the models above are local proxies; the engines live in the model server.
+    from backends import resolve_backend, BACKEND_REMOTE
+    if resolve_backend(None) == BACKEND_REMOTE:
+        from model_client import get_client
+        body["model_server"] = get_client().health()
+        ready = body["ready"] = ready and body["model_server"]["ok"]
+    return jsonify(body), (200 if ready else 503)
+
+# Explicit warm-up step, e.g. when the server was started with RAG_WARM_UP=0.
+@app.route("/api/models/warm-up", methods=["POST"])
+def api_warm_up():
+    from flask import jsonify
+    start_warm_up(EMBEDDING_MODEL_PATH, LLM_MODEL_PATH)
+    return jsonify(warm_up_status()), 202
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # Tables, indexes and migrations are set up once here rather than per request.
+    init_db(INDEX_OUTPUT_FILE)
+    # Load the models once in the background so the first chat request does not pay for it.
+    if WARM_UP_ON_START:
+        start_warm_up(EMBEDDING_MODEL_PATH, LLM_MODEL_PATH)
+    # The reloader would spawn a second process holding its own copy of the engines.
+    app.run(debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,60 @@
+# src/import_budget.py
+# Startup guard for the web process: importing `frontend` must stay within a
+# time budget and must not pull in the numerical, scraping or model stacks,
+# which are only imported once a request needs them.
+# Usage: python import_budget.py [module] [budget_seconds]  (exit status 1 on a regression)
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+IMPORT_BUDGET_SECONDS = 1.0
+IMPORT_RUNS = 3  # Fresh interpreters measured; the fastest run is compared to the budget
+LAZY_MODULES = ("vllm", "torch", "transformers", "numpy", "bs4", "requests")
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "modules": sorted(m for m in sys.modules if "." not in m)}}))
+"""
+
+
+def measure_import(module: str = "frontend") -> Dict:
+    """
+    Import module in a fresh interpreter and return the import time and the
+    top-level modules loaded by then.
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src_dir, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-c", _PROBE.format(module=module)],
+                            cwd=src_dir, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check_import_budget(module: str = "frontend", budget: float = IMPORT_BUDGET_SECONDS,
+                        runs: int = IMPORT_RUNS) -> List[str]:
+    """
+    Return the list of budget violations (empty when the import is within budget).
+    """
+    measurements = [measure_import(module) for _ in range(runs)]
+    best = min(m["seconds"] for m in measurements)
+    problems = []
+    if best > budget:
+        problems.append(f"importing {module} took {best:.3f}s (budget {budget:.3f}s)")
+    eager = sorted(set(LAZY_MODULES) & set(measurements[0]["modules"]))
+    if eager:
+        problems.append(f"importing {module} loaded modules that should be lazy: {', '.join(eager)}")
+    print(f"import {module}: {best:.3f}s (best of {runs}), budget {budget:.3f}s")
+    return problems
+
+
+if __name__ == "__main__":
+    module = sys.argv[1] if len(sys.argv) > 1 else "frontend"
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else IMPORT_BUDGET_SECONDS
+    problems = check_import_budget(module, budget)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,351 @@
+# src/index_cache.py
+# Resident, incrementally refreshed copy of the chunk vectors for the QA layer.
+import os
+import threading
+from typing import List, Dict, Tuple
+import numpy as np
+
+from db import init_db, open_connection
+from embedding_store import decode_embeddings, search_fulltext
+from retrieval import VectorIndex, normalize_rows
+from ann_index import IVFIndex, ann_path, attach_ann
+from quantization import QUANTIZATION, QUANTIZATION_NONE, attach_quantized
+from vector_store import MANIFEST, VectorStore, vector_store_path
+
+
+NEIGHBOUR_WINDOW = 1  # Chunks included on each side of a retrieved chunk
+COMPACT_DEAD_FRACTION = 0.25  # Compact a resident index once this share of its rows belongs to deleted documents
+FETCH_BATCH = 500  # Documents per query when reading chunk vectors back from SQLite
+
+
+def row_to_doc(row_id, source_type, source, embedding=None) -> Dict:
+    key = "url" if source_type == "url" else "file"
+    doc = {"id": row_id, key: source}
+    if embedding is not None:
+        doc["embedding"] = embedding
+    return doc
+
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+class IndexCache:
+    """
+    Loads every document's chunk vectors once and afterwards only pulls documents
+    that were inserted or deleted since the last refresh, which extend the
+    index (see VectorIndex.extend) instead of rebuilding it. Changes are detected with
+    PRAGMA data_version on a long-lived connection, which only moves when
+    another connection commits to the database file; the documents are only
+    diffed when their max id or count moved too. Document content is not
+    kept in memory; the text of retrieved chunks is read on demand.
+    Documents are treated as immutable: a re-indexed source is a delete plus an insert.
+    With quantized search (RAG_QUANTIZATION) a resident index keeps only the
+    codes in memory and reads the rows it rescores from SQLite.
+    When the memory-mapped vector store (see vector_store) matches the database,
+    the index is built over it instead and no vectors are decoded or copied;
+    while the database is ahead of the store, its changes extend that index.
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        init_db(db_file)
+        # Its own connection, outside the pool: data_version is per connection.
+        self._conn = open_connection(db_file)
+        # Reentrant: a refresh may read dropped rows back (see _chunk_vectors).
+        self._lock = threading.RLock()
+        self._docs = {}
+        self._watermark = 0
+        self._data_version = None
+        self._doc_signal = None
+        self._vector_index = None
+        self._ann = None
+        self._ann_mtime = None
+        self._store = None
+        self._store_mtime = None
+        self._mapped = False
+
+    def _read_data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _read_doc_signal(self, cursor=None):
+        """
+        (max id, count) of documents: ids are AUTOINCREMENT, so every insert
+        raises the first and every delete lowers the second. Unlike
+        data_version it ignores commits to other tables, such as chat turns.
+        """
+        return tuple((cursor or self._conn).execute("SELECT max(id), count(*) FROM documents").fetchone())
+
+    def refresh(self) -> bool:
+        """
+        Bring the cache up to date with the database. Returns True if anything changed.
+        """
+        with self._lock:
+            data_version = self._read_data_version()
+            ann_changed = self._ann_file_changed()
+            store_changed = self._store_changed()
+            if (self._vector_index is not None and data_version != self._data_version and not store_changed
+                    and self._read_doc_signal() == self._doc_signal):
+                # Another table was written (e.g. chat_history): no documents to diff.
+                self._data_version = data_version
+            if self._vector_index is not None and data_version == self._data_version and not store_changed:
+                if ann_changed:
+                    self._load_ann()
+                    attach_ann(self._vector_index, self._ann)
+                return False
+            if store_changed:
+                self._store_mtime = self._store_manifest_mtime()
+                self._store = VectorStore.open(self.db_file)
+                # A store that caught up with the database replaces the resident rows.
+                if self._store is not None and self._refresh_mapped(data_version, ann_changed):
+                    return True
+            cursor = self._conn.cursor()
+            # Read documents and chunks from one snapshot so a concurrent batch
+            # commit cannot leave a document without its chunks.
+            cursor.execute("BEGIN")
+            try:
+                doc_signal = self._read_doc_signal(cursor)
+                # Deletions: compare the id set (ids only, no payload) with what we hold.
+                cursor.execute("SELECT id FROM documents")
+                live_ids = {row[0] for row in cursor.fetchall()}
+                # Insertions: ids are AUTOINCREMENT so new documents are above the watermark.
+                cursor.execute(
+                    "SELECT id, source_type, source FROM documents WHERE id > ? ORDER BY id",
+                    (self._watermark,),
+                )
+                new_docs = cursor.fetchall()
+                cursor.execute(
+                    "SELECT document_id, embedding, embedding_dim, embedding_dtype FROM chunks "
+                    "WHERE document_id > ? ORDER BY document_id, ordinal",
+                    (self._watermark,),
+                )
+                vectors = {}
+                for document_id, blob, dim, dtype in cursor.fetchall():
+                    vectors.setdefault(document_id, []).append(decode_embeddings(blob, dim, dtype))
+            finally:
+                cursor.execute("COMMIT")
+            removed = [row_id for row_id in self._docs if row_id not in live_ids]
+            for row_id in removed:
+                del self._docs[row_id]
+            added = []
+            for row_id, source_type, source in new_docs:
+                chunks = vectors.get(row_id)
+                embedding = np.concatenate(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+                self._docs[row_id] = row_to_doc(row_id, source_type, source, embedding)
+                self._watermark = max(self._watermark, row_id)
+                added.append(self._docs[row_id])
+            self._data_version = data_version
+            self._doc_signal = doc_signal
+            changed = self._vector_index is None or bool(removed) or bool(added)
+            vi = self._vector_index
+            if vi is None:
+                vi = VectorIndex(list(self._docs.values()))
+                if ann_changed:
+                    self._load_ann()
+                # Rows added since the ANN index was written are assigned on bind.
+                attach_ann(vi, self._ann)
+                self._quantize(vi)
+            else:
+                if changed:
+                    # Appends the new rows and masks the deleted ones; the ANN index and codes follow.
+                    vi = vi.extend(added, removed)
+                    # An index that started empty has no codes to extend yet.
+                    if vi.quantized is None and QUANTIZATION != QUANTIZATION_NONE:
+                        self._quantize(vi)
+                # A mapped index is rebuilt when the store catches up instead.
+                if not self._mapped and vi.n_dead_rows > COMPACT_DEAD_FRACTION * vi.n_rows:
+                    vi = vi.compact()
+                if ann_changed:
+                    self._load_ann()
+                    attach_ann(vi, self._ann)
+            self._vector_index = vi
+            # The index holds the normalized rows (or their codes) from here on.
+            for doc in added:
+                doc.pop("embedding", None)
+            if changed:
+                print(f"Index cache refreshed: +{len(added)} / -{len(removed)} documents ({len(self._docs)} total)")
+            return changed
+
+    def _store_manifest_mtime(self):
+        path = os.path.join(vector_store_path(self.db_file), MANIFEST)
+        return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+    def _store_changed(self) -> bool:
+        return self._store_manifest_mtime() != self._store_mtime
+
+    def _refresh_mapped(self, data_version, ann_changed: bool) -> bool:
+        """
+        Build the index over the memory-mapped store if it holds exactly the
+        documents in the database. Returns False when the store is stale.
+        """
+        rows = self._conn.execute("SELECT id, source_type, source FROM documents ORDER BY id").fetchall()
+        if len(rows) != len(self._store.doc_ids) or any(
+                row[0] != doc_id for row, doc_id in zip(rows, self._store.doc_ids.tolist())):
+            return False
+        self._docs = {row_id: row_to_doc(row_id, source_type, source) for row_id, source_type, source in rows}
+        self._watermark = rows[-1][0] if rows else 0
+        self._data_version = data_version
+        self._doc_signal = (rows[-1][0] if rows else None, len(rows))
+        self._mapped = True
+        self._vector_index = VectorIndex.from_matrix(list(self._docs.values()), self._store.matrix, self._store.counts)
+        if ann_changed:
+            self._load_ann()
+        attach_ann(self._vector_index, self._ann)
+        self._quantize(self._vector_index)
+        print(f"Index cache mapped vector store v{self._store.version} ({len(self._docs)} documents)")
+        return True
+
+    def _quantize(self, vi: VectorIndex):
+        """
+        Attach int8/binary codes for the first search pass (RAG_QUANTIZATION).
+        A resident index then drops its float rows: searches only rescore
+        shortlists, which are read back from SQLite.
+        """
+        attach_quantized(vi, QUANTIZATION)
+        if vi.quantized is not None and not self._mapped:
+            vi.drop_rows(self._chunk_vectors)
+
+    def _chunk_vectors(self, doc_ids: np.ndarray, ordinals: np.ndarray, dim: int) -> np.ndarray:
+        """
+        Normalized vectors of the given chunks, read from SQLite: the rows of
+        an index that dropped its float rows (see VectorIndex.drop_rows).
+        Chunks deleted in the meantime come back as zero vectors.
+        """
+        wanted = sorted(set(doc_ids.tolist()))
+        found = {}
+        with self._lock:
+            for start in range(0, len(wanted), FETCH_BATCH):
+                batch = wanted[start:start + FETCH_BATCH]
+                cursor = self._conn.execute(
+                    "SELECT document_id, ordinal, embedding, embedding_dim, embedding_dtype FROM chunks "
+                    f"WHERE document_id IN ({', '.join('?' for _ in batch)})",
+                    batch,
+                )
+                for document_id, ordinal, blob, row_dim, dtype in cursor:
+                    found[(document_id, ordinal)] = decode_embeddings(blob, row_dim, dtype)
+        out = np.zeros((len(doc_ids), dim), dtype=np.float32)
+        for i, key in enumerate(zip(doc_ids.tolist(), ordinals.tolist())):
+            if key in found:
+                out[i] = found[key]
+        return normalize_rows(out)
+
+    def _ann_file_changed(self) -> bool:
+        path = ann_path(self.db_file)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        return mtime != self._ann_mtime
+
+    def _load_ann(self):
+        path = ann_path(self.db_file)
+        self._ann_mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        self._ann = IVFIndex.load(path) if self._ann_mtime is not None else None
+
+    @property
+    def vector_index(self) -> VectorIndex:
+        self.refresh()
+        return self._vector_index
+
+    @property
+    def data_version(self):
+        return self._data_version
+
+    @property
+    def index_version(self) -> str:
+        """
+        Persistent identifier of the indexed content: any insert raises the id
+        watermark and any delete lowers the document count.
+        """
+        return self.snapshot()[1]
+
+    def snapshot(self) -> Tuple[VectorIndex, str]:
+        """
+        The current index together with its index_version, read at the same refresh.
+        """
+        self.refresh()
+        with self._lock:
+            return self._vector_index, f"{self._watermark}:{len(self._docs)}"
+
+    def lexical_search(self, query: str, index: VectorIndex, limit: int) -> List[Tuple[int, float]]:
+        """
+        BM25 hits of query as (document position in index, bm25), best first.
+        Documents that are not in index (written after it was built) are left out.
+        """
+        with self._lock:
+            rows = search_fulltext(self._conn, query, limit)
+        positions = [(index.position(row_id), score) for row_id, score in rows]
+        return [(position, score) for position, score in positions if position is not None]
+
+    def with_content(self, docs: List[Dict]) -> List[Dict]:
+        """
+        Return copies of the given cached documents with their full content loaded from SQLite.
+        """
+        if not docs:
+            return []
+        ids = [doc["id"] for doc in docs]
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT id, content FROM documents WHERE id IN ({', '.join('?' for _ in ids)})", ids
+            )
+            contents = dict(cursor.fetchall())
+        return [dict(doc, content=contents.get(doc["id"], "")) for doc in docs]
+
+    def chunk_passages(self, hits: List[Tuple[Dict, int, float]], window: int = NEIGHBOUR_WINDOW) -> List[Dict]:
+        """
+        Turn chunk hits (cached document, chunk ordinal, score) into text passages.
+        Each hit is widened by `window` neighbouring chunks on both sides, and
+        overlapping windows of the same document are merged. Only the needed
+        substring of each document is read. Documents without chunk offsets
+        (migrated from the legacy schema) contribute their whole content.
+        Passages keep the order of each document's best hit.
+        """
+        by_doc = {}
+        for doc, ordinal, score in hits:
+            entry = by_doc.setdefault(doc["id"], {"doc": doc, "ranges": [], "score": score})
+            entry["ranges"].append((max(0, ordinal - window), ordinal + window))
+        passages = []
+        with self._lock:
+            for document_id, entry in by_doc.items():
+                for lo, hi in _merge_ranges(entry["ranges"]):
+                    start, end, known = self._conn.execute(
+                        "SELECT MIN(char_start), MAX(char_end), COUNT(char_start) = COUNT(*) FROM chunks "
+                        "WHERE document_id = ? AND ordinal BETWEEN ? AND ?",
+                        (document_id, lo, hi),
+                    ).fetchone()
+                    if known and start is not None:
+                        # SQLite substr is 1-based and counts characters like Python slicing.
+                        row = self._conn.execute(
+                            "SELECT substr(content, ?, ?) FROM documents WHERE id = ?",
+                            (start + 1, end - start, document_id),
+                        ).fetchone()
+                    else:
+                        row = self._conn.execute("SELECT content FROM documents WHERE id = ?", (document_id,)).fetchone()
+                    if row is None:
+                        continue
+                    doc = {k: v for k, v in entry["doc"].items() if k != "embedding"}
+                    passages.append(dict(doc, content=row[0], score=entry["score"], chunk_range=(lo, hi)))
+                    if not known:
+                        break
+        return passages
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_index_cache(db_file: str) -> IndexCache:
+    """
+    Process-wide IndexCache per database file.
+    """
+    with _caches_lock:
+        if db_file not in _caches:
+            _caches[db_file] = IndexCache(db_file)
+        return _caches[db_file]
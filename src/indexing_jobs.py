@@ -0,0 +1,185 @@
+# src/indexing_jobs.py
+# Single-flight indexing jobs: at most one run at a time, extra start requests
+# while it runs are coalesced into one follow-up run, and each job reports
+# progress (counts, rate, ETA) and can be cancelled. A cancelled or failed run
+# is resumed by starting a new one: sources it already wrote are skipped
+# through their stored fingerprints.
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, Optional
+
+JOB_HISTORY = 20  # Finished jobs kept for the status page
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class IndexingCancelled(Exception):
+    pass
+
+
+class PipelineProgress:
+    """
+    Hooks the pipeline stages report to. This base class ignores the reports
+    and is never cancelled; IndexingProgress records them.
+    """
+
+    def set_total(self, n: int):
+        pass
+
+    def update(self, field: str, n: int = 1):
+        pass
+
+    def raise_if_cancelled(self):
+        pass
+
+
+NO_PROGRESS = PipelineProgress()
+
+
+class IndexingProgress(PipelineProgress):
+    """
+    Thread-safe counters for one run, fed by the pipeline stages.
+    """
+    FIELDS = ("fetched", "embedded", "chunks", "written", "unchanged", "skipped", "failed")
+
+    def __init__(self):
+        self.total = None
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def set_total(self, n: int):
+        with self._lock:
+            self.total = n
+
+    def update(self, field: str, n: int = 1):
+        with self._lock:
+            self.counts[field] += n
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def raise_if_cancelled(self):
+        if self._cancel.is_set():
+            raise IndexingCancelled()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = dict(self.counts)
+            total = self.total
+        # Sources that reached the end of the pipeline, one way or another.
+        done = counts["written"] + counts["unchanged"] + counts["skipped"] + counts["failed"]
+        elapsed = (self.finished or time.time()) - self.started if self.started else 0.0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (max(total - done, 0) / rate) if total is not None and rate > 0 else None
+        return dict(counts, discovered=total, done=done, elapsed_s=round(elapsed, 1),
+                    sources_per_s=round(rate, 2), eta_s=None if eta is None else round(eta, 1),
+                    percent=round(100.0 * done / total, 1) if total else None)
+
+
+class IndexingJob:
+    def __init__(self, run: Callable[[IndexingProgress], None], resumes: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.run = run
+        self.state = QUEUED
+        self.error = None
+        self.resumes = resumes
+        self.created = time.time()
+        self.progress = IndexingProgress()
+
+    def to_dict(self) -> Dict:
+        return {"id": self.id, "state": self.state, "error": self.error, "resumes": self.resumes,
+                "created": self.created, "started": self.progress.started, "finished": self.progress.finished,
+                "progress": self.progress.snapshot()}
+
+
+class IndexingJobManager:
+    """
+    Runs indexing jobs one at a time on a dedicated thread.
+    """
+
+    def __init__(self, history: int = JOB_HISTORY):
+        self._lock = threading.Lock()
+        self._current = None
+        self._pending = None
+        self._history = deque(maxlen=history)
+
+    def start(self, run: Callable[[IndexingProgress], None]) -> Dict:
+        """
+        Start a run, or while one is active, schedule a single follow-up run
+        (later requests replace it). Returns the job the caller should follow.
+        """
+        with self._lock:
+            if self._current is not None:
+                if self._pending is None:
+                    self._pending = IndexingJob(run)
+                else:
+                    self._pending.run = run
+                return self._pending.to_dict()
+            job = self._current = IndexingJob(run, resumes=self._resumable_id())
+        threading.Thread(target=self._worker, args=(job,), name="indexing-job", daemon=True).start()
+        return job.to_dict()
+
+    def _resumable_id(self) -> Optional[str]:
+        last = self._history[-1] if self._history else None
+        return last.id if last is not None and last.state in (CANCELLED, FAILED) else None
+
+    def _worker(self, job: IndexingJob):
+        while job is not None:
+            job.state = RUNNING
+            job.progress.started = time.time()
+            try:
+                job.run(job.progress)
+                job.state = COMPLETED
+            except IndexingCancelled:
+                job.state = CANCELLED
+            except Exception as e:
+                print(f"Indexing job {job.id} failed: {e}")
+                job.state, job.error = FAILED, str(e)
+            job.progress.finished = time.time()
+            print(f"Indexing job {job.id} {job.state}: {job.progress.snapshot()}")
+            with self._lock:
+                self._history.append(job)
+                job = self._pending
+                self._pending = None
+                if job is not None:
+                    job.resumes = self._resumable_id()
+                self._current = job
+
+    def cancel(self) -> Optional[Dict]:
+        """
+        Cancel the running job and drop any follow-up run.
+        """
+        with self._lock:
+            self._pending = None
+            job = self._current
+        if job is None:
+            return None
+        job.progress.cancel()
+        return job.to_dict()
+
+    def status(self) -> Dict:
+        with self._lock:
+            current = self._current.to_dict() if self._current is not None else None
+            pending = self._pending.to_dict() if self._pending is not None else None
+            recent = [job.to_dict() for job in reversed(self._history)]
+        return {"current": current, "pending": pending, "recent": recent}
+
+
+_manager = IndexingJobManager()
+
+
+def get_job_manager() -> IndexingJobManager:
+    return _manager
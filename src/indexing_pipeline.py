@@ -0,0 +1,305 @@
+# src/indexing_pipeline.py
+# Streaming indexing pipeline: source -> extract -> chunk/embed -> write.
+# Stages are generators connected by bounded queues, each running in its own
+# thread, so a slow stage blocks its producers instead of letting memory grow.
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from db import connection
+from embedding_store import delete_documents, insert_document, DEFAULT_DTYPE
+from fetcher import get_fetcher, extract_text
+from ann_index import ann_path
+from vector_store import vector_store_path
+from indexing_jobs import IndexingCancelled, PipelineProgress, NO_PROGRESS
+from metrics import STAGE_ITEMS, STAGE_SECONDS, span
+from fingerprints import (
+    load_fingerprints, save_fingerprints, sha256_hex, stat_unchanged, conditional_headers,
+)
+
+QUEUE_SIZE = 32           # Items buffered between two stages
+EMBED_DOCS_PER_BATCH = 16  # Documents handed to embed_batch at once
+COMMIT_EVERY = 32          # Rows written per transaction
+
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, error):
+        self.error = error
+
+
+def threaded(items: Iterable, maxsize: int = QUEUE_SIZE, name: str = "stage") -> Iterator:
+    """
+    Drain `items` on a background thread into a bounded queue and yield from it.
+    Exceptions raised upstream are re-raised in the consumer.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                q.put(item)
+            q.put(_DONE)
+        except BaseException as e:
+            q.put(_StageError(e))
+
+    thread = threading.Thread(target=pump, name=f"indexing-{name}", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        # Unblock the producer if the consumer stops early.
+        stop.set()
+        while thread.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                thread.join(timeout=0.05)
+
+
+def iter_links(folder_path: str) -> Iterator[str]:
+    """
+    Stream URLs (one per line) from all .txt files in the folder, each URL once.
+    """
+    seen = set()
+    for filename in os.listdir(folder_path):
+        if filename.endswith(".txt"):
+            with open(os.path.join(folder_path, filename), "r", encoding="utf-8") as f:
+                for line in f:
+                    url = line.strip()
+                    if not url:
+                        continue
+                    if url in seen:
+                        print(f"Skipping duplicate link: {url}")
+                        continue
+                    seen.add(url)
+                    yield url
+
+
+def iter_local_files(folder_path: str, known: Optional[Dict[str, Dict]] = None,
+                     exclude: Iterable[str] = (), progress: PipelineProgress = NO_PROGRESS) -> Iterator[Dict]:
+    """
+    Recursively stream files in the folder (excluding the 'links' subfolder) as {"file", "content"} dicts.
+    When `known` fingerprints are given, files whose size/mtime are unchanged are
+    skipped after a stat call, and files whose sha256 is unchanged are yielded as
+    {"unchanged": True} so only their fingerprint is refreshed.
+    """
+    exclude = {os.path.abspath(path) for path in exclude}
+    for root, dirs, files in os.walk(folder_path):
+        if os.path.basename(root) == "links":
+            continue
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) not in exclude]
+        for file in files:
+            file_path = os.path.join(root, file)
+            if os.path.abspath(file_path) in exclude:
+                continue
+            progress.raise_if_cancelled()
+            try:
+                if known is None:
+                    with open(file_path, "r", encoding="utf-8") as f:
+                        content = f.read()
+                    yield {"file": file_path, "content": content}
+                    continue
+                previous = known.get(file_path)
+                st = stat_unchanged(file_path, previous)
+                if st is None:
+                    progress.update("skipped")
+                    continue
+                with open(file_path, "rb") as f:
+                    data = f.read()
+                fingerprint = {"source": file_path, "source_type": "file", "size": st.st_size,
+                               "mtime": st.st_mtime, "sha256": sha256_hex(data)}
+                if previous and previous.get("sha256") == fingerprint["sha256"]:
+                    yield {"file": file_path, "unchanged": True, "fingerprint": fingerprint}
+                    continue
+                content = data.decode("utf-8")
+                progress.update("fetched")
+                yield {"file": file_path, "content": content, "fingerprint": fingerprint}
+            except Exception as e:
+                progress.update("failed")
+                print(f"Skipping {file_path} due to error: {e}")
+
+
+def extract_urls(urls: Iterable[str], known: Optional[Dict[str, Dict]] = None,
+                 progress: PipelineProgress = NO_PROGRESS) -> Iterator[Dict]:
+    """
+    Extract stage for web sources: concurrent conditional GETs, empty pages dropped.
+    A 304 (or a page whose text hash is unchanged) is not re-embedded.
+    """
+    known = known or {}
+
+    def fetch(url):
+        progress.raise_if_cancelled()
+        previous = known.get(url)
+        with span("index.fetch") as stage:
+            response = get_fetcher().fetch_conditional(url, conditional_headers(previous))
+            if response is not None:
+                stage["bytes"] = len(response.content)
+        if response is None:
+            return None
+        if response.status_code == 304:
+            return {"url": url, "unchanged": True}
+        with span("index.extract_text"):
+            content = extract_text(response.text)
+        fingerprint = {"source": url, "source_type": "url", "sha256": sha256_hex(content),
+                       "etag": response.headers.get("ETag"),
+                       "last_modified": response.headers.get("Last-Modified")}
+        if previous and previous.get("sha256") == fingerprint["sha256"]:
+            return {"url": url, "unchanged": True, "fingerprint": fingerprint}
+        return {"url": url, "content": content, "fingerprint": fingerprint}
+
+    for url, doc in get_fetcher().map(fetch, urls):
+        if doc is None or (not doc.get("unchanged") and not doc["content"]):
+            progress.update("failed" if doc is None else "skipped")
+            print(f"Skipping empty page: {url}")
+            continue
+        if doc.get("unchanged"):
+            print(f"Unchanged URL: {url}")
+            if "fingerprint" not in doc:
+                # 304: nothing to write at all.
+                progress.update("skipped")
+                continue
+        else:
+            progress.update("fetched")
+            print(f"Fetched URL: {url}")
+        yield doc
+
+
+def embed_documents(docs: Iterable[Dict], embedding_model, docs_per_batch: int = EMBED_DOCS_PER_BATCH,
+                    progress: PipelineProgress = NO_PROGRESS) -> Iterator[Dict]:
+    """
+    Chunk/embed stage: groups documents so embed_batch sees many chunks per call.
+    Each document gains a "chunks" list with char/token offsets and embeddings.
+    """
+    batch = []
+    for doc in docs:
+        if doc.get("unchanged"):
+            yield doc
+            continue
+        batch.append(doc)
+        if len(batch) >= docs_per_batch:
+            yield from _embed(batch, embedding_model, progress)
+            batch = []
+    if batch:
+        yield from _embed(batch, embedding_model, progress)
+
+
+def _embed(batch: List[Dict], embedding_model, progress: PipelineProgress = NO_PROGRESS) -> Iterator[Dict]:
+    progress.raise_if_cancelled()
+    with span("index.embed", documents=len(batch)) as stage:
+        chunked = embedding_model.embed_batch([doc["content"] for doc in batch], return_spans=True)
+        stage["chunks"] = sum(len(chunks) for chunks in chunked)
+    progress.update("embedded", len(batch))
+    progress.update("chunks", stage["chunks"])
+    for doc, chunks in zip(batch, chunked):
+        yield dict(doc, chunks=chunks)
+
+
+def write_documents(docs: Iterable[Dict], db_file: str, embedding_dtype: str = DEFAULT_DTYPE,
+                    commit_every: int = COMMIT_EVERY, progress: PipelineProgress = NO_PROGRESS) -> int:
+    """
+    Write stage: replaces the rows of each new or changed source, stores its
+    fingerprint, and writes every `commit_every` documents as one batched
+    transaction, so a crash loses at most one uncommitted batch. On
+    cancellation the buffered batch is still written, so the next run resumes
+    where this one stopped (their fingerprints match). Returns the number of
+    sources (re)written.
+    """
+    written = unchanged = 0
+    batch = []
+    # Time spent writing, excluding waits for the upstream stages.
+    write_seconds = 0.0
+
+    def flush(conn):
+        nonlocal written, unchanged
+        # documents.source is unique: a source listed twice keeps its last entry.
+        latest = {item[1]: item for item in batch}
+        if len(latest) < len(batch):
+            batch[:] = latest.values()
+        changed = [item for item in batch if not item[2].get("unchanged")]
+        cursor = conn.cursor()
+        with span("index.commit", documents=len(batch)):
+            # A changed source replaces its previous document and chunks.
+            delete_documents(cursor, [source for _, source, _ in changed])
+            for source_type, source, entry in changed:
+                insert_document(cursor, source_type, source, entry["content"], entry["chunks"], embedding_dtype)
+            save_fingerprints(cursor, [entry["fingerprint"] for _, _, entry in batch if entry.get("fingerprint")])
+            conn.commit()
+        written += len(changed)
+        unchanged += len(batch) - len(changed)
+        progress.update("written", len(changed))
+        progress.update("unchanged", len(batch) - len(changed))
+        batch.clear()
+
+    with connection(db_file) as conn:
+        try:
+            for entry in docs:
+                progress.raise_if_cancelled()
+                if "url" in entry:
+                    batch.append(("url", entry["url"], entry))
+                else:
+                    batch.append(("file", entry["file"], entry))
+                if len(batch) >= commit_every:
+                    started = time.perf_counter()
+                    flush(conn)
+                    write_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            flush(conn)
+            write_seconds += time.perf_counter() - started
+        except IndexingCancelled:
+            flush(conn)
+            print(f"Indexing cancelled after writing {written} sources")
+            raise
+    STAGE_SECONDS.observe(write_seconds, stage="index.write")
+    STAGE_ITEMS.inc(written, stage="index.write", item="documents_written")
+    STAGE_ITEMS.inc(unchanged, stage="index.write", item="documents_unchanged")
+    print(f"Wrote {written} new or changed sources, {unchanged} unchanged")
+    return written
+
+
+def iter_sources(links_folder: str, local_files_folder: str, known: Optional[Dict[str, Dict]] = None,
+                 exclude: Iterable[str] = (), progress: PipelineProgress = NO_PROGRESS) -> Iterator[Dict]:
+    """
+    Extracted documents from the web links first, then from local files.
+    """
+    yield from extract_urls(threaded(iter_links(links_folder), name="links"), known, progress)
+    yield from iter_local_files(local_files_folder, known if known is not None else {}, exclude, progress)
+
+
+def count_sources(links_folder: str, local_files_folder: str, exclude: Iterable[str] = ()) -> int:
+    """
+    Number of links and local files a run will visit, for progress reporting.
+    """
+    exclude = {os.path.abspath(path) for path in exclude}
+    total = sum(1 for _ in iter_links(links_folder))
+    for root, dirs, files in os.walk(local_files_folder):
+        if os.path.basename(root) == "links":
+            continue
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) not in exclude]
+        total += sum(1 for file in files if os.path.abspath(os.path.join(root, file)) not in exclude)
+    return total
+
+
+def run_pipeline(links_folder: str, local_files_folder: str, db_file: str, embedding_model,
+                 embedding_dtype: str = DEFAULT_DTYPE, progress: PipelineProgress = NO_PROGRESS) -> int:
+    with connection(db_file) as conn:
+        known = load_fingerprints(conn)
+    # Never index the database itself (or its journal, ANN and vector files) when it lives in the data folder.
+    exclude = [db_file, db_file + "-journal", db_file + "-wal", db_file + "-shm", ann_path(db_file),
+               vector_store_path(db_file)]
+    progress.set_total(count_sources(links_folder, local_files_folder, exclude))
+    docs = threaded(iter_sources(links_folder, local_files_folder, known, exclude, progress), name="extract")
+    embedded = threaded(embed_documents(docs, embedding_model, progress=progress), name="embed")
+    return write_documents(embedded, db_file, embedding_dtype, progress=progress)
@@ -1,23 +1,113 @@
+import queue
+
+from backends import create_chat_backend
+from batch_scheduler import MicroBatcher
+from conversation_memory import ConversationMemory, HISTORY_TOKEN_BUDGET
+
+CHAT_BATCH_SIZE = 16  # Conversations generated together in one engine batch
+CHAT_MAX_WAIT = 0.02  # Seconds a request waits for others to join its batch
+COMPACT_HISTORY = False  # Summarize turns that leave the history window instead of dropping them
+
+_END = object()
+
 class LocalLLMNode:
-    def __init__(self, model_path: str):
-        from vllm import LLM, SamplingParams 
-        self.sampling_params = SamplingParams(temperature=0.5, top_p=0.9)
-        self.engine = LLM(model_path, cpu_offload_gb=3, swap_space= 4, gpu_memory_utilization=0.8, enforce_eager=True)
+    def __init__(self, model_path: str, backend: str = None):
+        # vLLM or the CPU stand-in, see backends.py.
+        self.engine = create_chat_backend(model_path, backend)
+        # Concurrent chat requests are generated as one batch of conversations.
+        self.batcher = MicroBatcher(self._generate, max_batch_size=CHAT_BATCH_SIZE,
+                                    max_wait=CHAT_MAX_WAIT, name="chat-batcher")
+
+    def _generate(self, requests):
+        """
+        Generate a batch of (conversation, sink) requests. Partial text is pushed
+        to each request's sink queue (None for non-streaming requests) as it is
+        produced. Returns the reply text per request.
+        """
+        sinks = [sink for _, sink in requests]
+
+        def on_delta(i, text):
+            if sinks[i] is not None:
+                sinks[i].put(text)
+
+        try:
+            return self.engine.generate([conversation for conversation, _ in requests], on_delta)
+        finally:
+            for sink in sinks:
+                if sink is not None:
+                    sink.put(_END)
+
     def chat(self, conversation):
-        return self.engine.chat(conversation, sampling_params=self.sampling_params, use_tqdm=False)
+        # Copy so later appends by the caller cannot race with the queued request.
+        return [self.batcher((list(conversation), None))]
+
+    def stream_chat(self, conversation):
+        """
+        Yield the generated text in pieces as the engine produces them.
+        """
+        sink = queue.Queue()
+        future = self.batcher.submit((list(conversation), sink))
+        while True:
+            delta = sink.get()
+            if delta is _END:
+                break
+            yield delta
+        # Re-raise a generation error, if any.
+        future.result()
+
+    def close(self):
+        self.batcher.close()
 
 class LLMModel:
-    def __init__(self, model_path: str):
-        self.model = LocalLLMNode(model_path)
-        # Initialize conversation context once.
-        self.conversation = [
-            {"role": "system", "content": "You are a helpful assistant for answering questions based on the provided embedded documents."}
-        ]
-        
-    # Now chat() manages the conversation internally.
-    def chat(self, prompt):
-        self.conversation.append({"role": "user", "content": prompt})
-        outputs = self.model.chat(self.conversation)
-        response = [output.outputs[0].text for output in outputs] 
-        self.conversation.append({"role": "assistant", "content": response})
-        return response
\ No newline at end of file
+    def __init__(self, model_path: str, history_token_budget: int = HISTORY_TOKEN_BUDGET,
+                 compact_history: bool = COMPACT_HISTORY, backend: str = None):
+        self.model = LocalLLMNode(model_path, backend)
+        self.tokenizer = self.model.engine.get_tokenizer()
+        # Conversation state per session, bounded in both tokens and sessions.
+        self.memory = ConversationMemory(
+            self.count_tokens,
+            token_budget=history_token_budget,
+            summarize=self._compact if compact_history else None,
+        )
+
+    def close(self):
+        self.model.close()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def _compact(self, summary, turns) -> str:
+        """
+        Fold turns that left the history window into the running summary.
+        """
+        transcript = "\n".join(f"User: {user}\nAssistant: {assistant}" for user, assistant, _ in turns)
+        prompt = (
+            "Update the summary of this conversation with the new exchanges. "
+            "Keep it short and keep facts the user may refer back to.\n\n"
+            f"Current summary:\n{summary or '(none)'}\n\nNew exchanges:\n{transcript}\n\nUpdated summary:"
+        )
+        return self.model.chat(self.memory.messages(None, prompt))[0].strip()
+
+    def chat(self, prompt, session_id: str = None, history_prompt: str = None):
+        """
+        Answer prompt within the session's conversation. history_prompt, if
+        given, is what gets remembered for this turn instead of the full prompt
+        (e.g. the bare question without its retrieved context).
+        Without a session_id the prompt is answered statelessly.
+        """
+        response = self.model.chat(self.memory.messages(session_id, prompt))
+        self.memory.record(session_id, history_prompt or prompt, "".join(response))
+        return response
+
+    def stream_chat(self, prompt, session_id: str = None, history_prompt: str = None):
+        """
+        Streaming variant of chat(): yields text deltas, then records the full reply.
+        """
+        parts = []
+        for delta in self.model.stream_chat(self.memory.messages(session_id, prompt)):
+            parts.append(delta)
+            yield delta
+        self.memory.record(session_id, history_prompt or prompt, "".join(parts))
+
+    def reset_session(self, session_id: str):
+        self.memory.reset(session_id)
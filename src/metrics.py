@@ -0,0 +1,131 @@
+# src/metrics.py
+# Stage timing for the QA and indexing paths. span() measures one stage,
+# feeds process-wide histograms/counters (rendered in Prometheus text format
+# for /metrics) and, when a Trace is given, records the stage for a
+# per-request timing breakdown.
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# Upper bounds in seconds; covers sub-millisecond scoring up to long generations.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels_text(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_labels_text(key + (('le', le),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels_text(key)} {total}")
+                lines.append(f"{self.name}_count{_labels_text(key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "Time spent in each QA and indexing stage.")
+STAGE_ITEMS = Counter("rag_stage_items_total", "Items processed per stage (documents scored, tokens, chunks, ...).")
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Stages that ended with an exception.")
+_METRICS = [STAGE_SECONDS, STAGE_ITEMS, STAGE_ERRORS]
+
+
+def register(metric):
+    _METRICS.append(metric)
+    return metric
+
+
+class Trace:
+    """
+    Spans of one request, in the order they finished.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, stage: str, seconds: float, counts: Dict):
+        self.spans.append(dict(counts, stage=stage, ms=round(seconds * 1000, 2)))
+
+    def breakdown(self) -> Dict:
+        return {"stages": self.spans, "total_ms": round((time.perf_counter() - self.started) * 1000, 2)}
+
+
+@contextmanager
+def span(stage: str, trace: Optional[Trace] = None, **counts):
+    """
+    Time the enclosed block as `stage`. The yielded dict holds the stage's
+    counts; numeric values set on it before the block ends (e.g. tokens out)
+    are added to rag_stage_items_total.
+    """
+    record = dict(counts)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        for item, value in record.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                STAGE_ITEMS.inc(value, stage=stage, item=item)
+        if trace is not None:
+            trace.add(stage, elapsed, record)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,201 @@
+# src/model_client.py
+# Client side of the model server (model_server.py). Web workers talk to the
+# server over a local socket with pooled connections; every reply message is
+# awaited with a timeout, and a connection that fails or times out is dropped
+# instead of being returned to the pool.
+# Messages are pickled dicts (requests) and tuples (replies):
+#   ("delta", i, text)  a piece of conversation i's reply while generating
+#   ("done", result)    the final result of the request
+#   ("error", message)  the request failed on the server
+# The socket lives in a directory only this user may use, and both sides prove
+# they hold the auth key (RAG_MODEL_SERVER_KEY, or the one the server writes
+# next to its socket), so a worker never talks to a server someone else started.
+import os
+import stat
+import tempfile
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from typing import Dict, Iterator, Optional
+
+
+def _default_socket_dir() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "rag")
+    return os.path.join(tempfile.gettempdir(), f"rag-{os.getuid()}")
+
+
+MODEL_SERVER_ADDRESS = os.environ.get("RAG_MODEL_SERVER") or os.path.join(_default_socket_dir(), "model-server.sock")
+MODEL_SERVER_AUTHKEY = os.environ.get("RAG_MODEL_SERVER_KEY", "").encode() or None  # None: use the key file
+POOL_SIZE = 8            # Idle connections kept per server
+REQUEST_TIMEOUT = float(os.environ.get("RAG_MODEL_SERVER_TIMEOUT", "120"))  # Seconds to wait for each reply message
+HEALTH_TIMEOUT = 2.0     # Seconds a health check may take
+
+
+class ModelServerError(Exception):
+    pass
+
+
+class ModelServerUnavailable(ModelServerError):
+    pass
+
+
+class ModelServerTimeout(ModelServerError):
+    pass
+
+
+def key_file(address: str) -> str:
+    return address + ".key"
+
+
+def check_private(path: str, is_dir: bool):
+    """
+    Raise ModelServerError unless path is owned by this user and closed to everyone else.
+    """
+    st = os.lstat(path)
+    kind_ok = stat.S_ISDIR(st.st_mode) if is_dir else stat.S_ISREG(st.st_mode)
+    if not kind_ok or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        mode = "0700 directory" if is_dir else "0600 file"
+        raise ModelServerError(f"{path} must be a {mode} owned by this user")
+
+
+def read_authkey(address: str) -> bytes:
+    """
+    The auth key the server at address wrote to its key file.
+    """
+    try:
+        check_private(os.path.dirname(os.path.abspath(address)), is_dir=True)
+        path = key_file(address)
+        check_private(path, is_dir=False)
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError as e:
+        raise ModelServerUnavailable(f"Model server at {address} is unavailable: {e}") from e
+
+
+class ModelServerClient:
+    """
+    Pooled connections to one model server. A connection carries one request
+    at a time; concurrent callers use separate connections.
+    """
+
+    def __init__(self, address: str = MODEL_SERVER_ADDRESS, authkey: Optional[bytes] = MODEL_SERVER_AUTHKEY,
+                 pool_size: int = POOL_SIZE, timeout: float = REQUEST_TIMEOUT):
+        self.address = address
+        self.authkey = authkey
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.last_error = None
+        self.last_success = None
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Read on every connect: a restarted server writes a new key.
+        authkey = self.authkey or read_authkey(self.address)
+        try:
+            return Client(self.address, authkey=authkey)
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise ModelServerUnavailable(f"Model server at {self.address} is unavailable: {e}") from e
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _recv(self, conn, timeout: float):
+        if not conn.poll(timeout):
+            raise ModelServerTimeout(f"No reply from the model server within {timeout:.0f}s")
+        return conn.recv()
+
+    def stream(self, request: Dict, timeout: float = None) -> Iterator[tuple]:
+        """
+        Send request and yield its reply messages up to and including ("done", result).
+        """
+        timeout = timeout or self.timeout
+        conn, reused = self._acquire()
+        finished = False
+        try:
+            try:
+                conn.send(request)
+                message = self._recv(conn, timeout)
+            except (OSError, EOFError):
+                if not reused:
+                    raise
+                # A pooled connection went stale (e.g. the server restarted): retry once on a new one.
+                conn.close()
+                conn = self._connect()
+                conn.send(request)
+                message = self._recv(conn, timeout)
+            while True:
+                if message[0] == "error":
+                    finished = True
+                    raise ModelServerError(message[1])
+                if message[0] == "done":
+                    # Set before yielding: the caller may stop iterating at the result.
+                    finished = True
+                    self.last_success, self.last_error = time.time(), None
+                    yield message
+                    return
+                yield message
+                message = self._recv(conn, timeout)
+        except (OSError, EOFError) as e:
+            self.last_error = str(e)
+            raise ModelServerUnavailable(f"Lost the connection to the model server: {e}") from e
+        except ModelServerError as e:
+            self.last_error = str(e)
+            raise
+        finally:
+            # A connection left mid-reply cannot be reused.
+            if finished:
+                self._release(conn)
+            else:
+                conn.close()
+
+    def call(self, request: Dict, timeout: float = None):
+        """
+        Send request and return its result.
+        """
+        for message in self.stream(request, timeout):
+            if message[0] == "done":
+                return message[1]
+        raise ModelServerError("The model server closed the request without a result")
+
+    def health(self, timeout: float = HEALTH_TIMEOUT) -> Dict:
+        """
+        The server's health report, or {"ok": False, "error": ...} if it cannot be reached.
+        """
+        try:
+            return dict(self.call({"op": "health"}, timeout), ok=True)
+        except ModelServerError as e:
+            return {"ok": False, "error": str(e), "address": self.address}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(address: str = MODEL_SERVER_ADDRESS) -> ModelServerClient:
+    """
+    Process-wide client per server address.
+    """
+    with _clients_lock:
+        if address not in _clients:
+            _clients[address] = ModelServerClient(address)
+        return _clients[address]
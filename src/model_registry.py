@@ -0,0 +1,205 @@
+# src/model_registry.py
+# Process-wide registry so embedding and LLM engines are loaded once and shared
+# by the indexing, QA and chat-history code paths. Requests lease the models
+# they use, so unloading a model only closes it once those requests finished.
+import gc
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+        # One lock per key so loading the LLM does not block embedding lookups.
+        self._key_locks = {}
+        # id(model) -> number of leases held on it.
+        self._users = {}
+        # id(model) -> model that was unloaded while leased; closed by its last release.
+        self._retired = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+
+    def get(self, kind: str, model_path: str, factory):
+        """
+        Return the model registered under (kind, model_path), building it with
+        factory(model_path) the first time it is requested.
+        """
+        key = (kind, model_path)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._key_lock(key):
+            # Another thread may have finished loading while we waited.
+            model = self._models.get(key)
+            if model is None:
+                print(f"Loading {kind} model: {model_path}")
+                model = factory(model_path)
+                self._models[key] = model
+            return model
+
+    def acquire(self, kind: str, model_path: str, factory):
+        """
+        get(), holding a lease on the model until release(model).
+        """
+        key = (kind, model_path)
+        while True:
+            model = self.get(kind, model_path, factory)
+            with self._lock:
+                # Unless it was unloaded between get() and here; then load it again.
+                if self._models.get(key) is model:
+                    self._users[id(model)] = self._users.get(id(model), 0) + 1
+                    return model
+
+    def release(self, model):
+        with self._lock:
+            users = self._users.pop(id(model)) - 1
+            if users:
+                self._users[id(model)] = users
+                return
+            model = self._retired.pop(id(model), None)
+        if model is not None:
+            print("Closing unloaded model after its last request")
+            _close(model)
+            _release_gpu_memory()
+
+    @contextmanager
+    def lease(self, kind: str, model_path: str, factory):
+        """
+        `with registry.lease(...) as model:` uses the model without it being
+        closed underneath by a concurrent unload.
+        """
+        model = self.acquire(kind, model_path, factory)
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    def is_loaded(self, kind: str, model_path: str) -> bool:
+        return (kind, model_path) in self._models
+
+    def loaded(self):
+        return list(self._models)
+
+    def unload(self, kind: str = None, model_path: str = None):
+        """
+        Drop models from the registry. With no arguments every model is released.
+        Models without leases are closed now, leased ones when their last lease is released.
+        """
+        idle = []
+        with self._lock:
+            keys = [
+                key for key in self._models
+                if (kind is None or key[0] == kind) and (model_path is None or key[1] == model_path)
+            ]
+            for key in keys:
+                print(f"Unloading {key[0]} model: {key[1]}")
+                model = self._models.pop(key)
+                if id(model) in self._users:
+                    self._retired[id(model)] = model
+                else:
+                    idle.append(model)
+        for model in idle:
+            _close(model)
+        if idle:
+            _release_gpu_memory()
+        return len(keys)
+
+
+def _close(model):
+    # Stop the model's batching worker, which holds a reference to the engine.
+    if hasattr(model, "close"):
+        model.close()
+
+
+def _release_gpu_memory():
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+registry = ModelRegistry()
+
+
+def _load_embedding_model(model_path: str):
+    from embedding_model import EmbeddingModel
+    return EmbeddingModel(model_path=model_path)
+
+
+def _load_llm_model(model_path: str):
+    from llm_model import LLMModel
+    return LLMModel(model_path)
+
+
+def get_embedding_model(model_path: str):
+    return registry.get("embedding", model_path, _load_embedding_model)
+
+
+def get_llm_model(model_path: str):
+    return registry.get("llm", model_path, _load_llm_model)
+
+
+def lease_embedding_model(model_path: str):
+    return registry.lease("embedding", model_path, _load_embedding_model)
+
+
+def lease_llm_model(model_path: str):
+    return registry.lease("llm", model_path, _load_llm_model)
+
+
+def warm_up(embedding_model_path: str = None, llm_model_path: str = None):
+    """
+    Load the given models ahead of the first request.
+    """
+    if embedding_model_path:
+        get_embedding_model(embedding_model_path)
+    if llm_model_path:
+        get_llm_model(llm_model_path)
+
+
+_warm_up_lock = threading.Lock()
+_warm_up = {"state": "idle", "error": None, "seconds": None}
+
+
+def start_warm_up(embedding_model_path: str = None, llm_model_path: str = None):
+    """
+    Run warm_up on a background thread unless one is already running.
+    Progress is reported by warm_up_status().
+    """
+    with _warm_up_lock:
+        if _warm_up["state"] == "loading":
+            return None
+        _warm_up.update(state="loading", error=None, seconds=None)
+
+    def run():
+        started = time.perf_counter()
+        try:
+            warm_up(embedding_model_path, llm_model_path)
+            state, error = "ready", None
+        except Exception as e:
+            print(f"Model warm-up failed: {e}")
+            state, error = "failed", str(e)
+        with _warm_up_lock:
+            _warm_up.update(state=state, error=error, seconds=round(time.perf_counter() - started, 2))
+
+    thread = threading.Thread(target=run, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_up_status() -> dict:
+    with _warm_up_lock:
+        return dict(_warm_up)
+
+
+def unload_models(kind: str = None, model_path: str = None) -> int:
+    return registry.unload(kind, model_path)
@@ -0,0 +1,217 @@
+# src/model_server.py
+# Long-lived process that owns the embedding and LLM engines and serves them
+# over a local Unix socket, so Flask workers (RAG_BACKEND=remote) stay small
+# and start instantly while the engines are loaded once. Requests from every
+# connected worker go through the same micro-batchers as in-process requests,
+# so the engines still see batched work. Protocol: see model_client.py.
+# The socket's directory is created 0700, and without RAG_MODEL_SERVER_KEY the
+# server generates a key and writes it to <socket>.key (0600) for the workers.
+# Usage: RAG_BACKEND=cpu python model_server.py [--address PATH] [--embedding PATH] [--llm PATH]
+import argparse
+import os
+import queue
+import secrets
+import signal
+import socket
+import stat
+import threading
+import time
+from multiprocessing.connection import Listener
+from multiprocessing import AuthenticationError
+from typing import Dict
+
+from backends import BACKEND_REMOTE, resolve_backend
+from config import EMBEDDING_MODEL_PATH, LLM_MODEL_PATH
+from model_client import MODEL_SERVER_ADDRESS, MODEL_SERVER_AUTHKEY, check_private, key_file
+from model_registry import ModelRegistry
+
+KINDS = ("embedding", "chat")
+
+
+class _TaggedSink:
+    """
+    Sink of one conversation of a generate request: tags what LocalLLMNode
+    pushes with the conversation's position, so one queue serves the request.
+    """
+
+    def __init__(self, out: queue.Queue, i: int):
+        self.out = out
+        self.i = i
+
+    def put(self, item):
+        self.out.put((self.i, item))
+
+
+class ModelServer:
+    def __init__(self, address: str = MODEL_SERVER_ADDRESS, backend: str = None,
+                 authkey: bytes = MODEL_SERVER_AUTHKEY):
+        self.backend = resolve_backend(backend)
+        if self.backend == BACKEND_REMOTE:
+            raise ValueError("The model server needs a local backend (RAG_BACKEND=vllm or cpu)")
+        self.address = address
+        self.authkey = authkey
+        self.engines = ModelRegistry()
+        self.started = time.time()
+        self.served = 0
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def node(self, kind: str, model_path: str):
+        """
+        The batched engine node for (kind, model_path), loading it on first use.
+        """
+        if kind == "embedding":
+            from embedding_model import LocalEmbeddingNode
+            return self.engines.get(kind, model_path, lambda path: LocalEmbeddingNode(path, self.backend))
+        if kind == "chat":
+            from llm_model import LocalLLMNode
+            return self.engines.get(kind, model_path, lambda path: LocalLLMNode(path, self.backend))
+        raise ValueError(f"Unknown model kind: {kind!r} (expected one of {KINDS})")
+
+    def health(self) -> Dict:
+        models = [{"kind": kind, "model_path": path} for kind, path in self.engines.loaded()]
+        return {"backend": self.backend, "pid": os.getpid(), "uptime_s": round(time.time() - self.started, 1),
+                "models": models, "active_requests": self.active, "served": self.served}
+
+    def _generate(self, conn, request: Dict):
+        node = self.node("chat", request["model_path"])
+        conversations = request["conversations"]
+        if not request.get("stream"):
+            futures = [node.batcher.submit((list(c), None)) for c in conversations]
+            conn.send(("done", [future.result() for future in futures]))
+            return
+        out = queue.Queue()
+        futures = [node.batcher.submit((list(c), _TaggedSink(out, i))) for i, c in enumerate(conversations)]
+        ended = 0
+        while ended < len(futures):
+            i, delta = out.get()
+            # LocalLLMNode ends each sink with a non-text marker.
+            if isinstance(delta, str):
+                conn.send(("delta", i, delta))
+            else:
+                ended += 1
+        conn.send(("done", [future.result() for future in futures]))
+
+    def _dispatch(self, conn, request: Dict):
+        op = request.get("op")
+        if op == "health":
+            conn.send(("done", self.health()))
+        elif op == "load":
+            self.node(request["kind"], request["model_path"])
+            conn.send(("done", {"backend": self.backend}))
+        elif op == "embed":
+            node = self.node("embedding", request["model_path"])
+            conn.send(("done", node.run_batch(request["prompts"])))
+        elif op == "generate":
+            self._generate(conn, request)
+        else:
+            conn.send(("error", f"Unknown operation: {op!r}"))
+
+    def handle(self, conn):
+        """
+        Serve one client connection until it is closed.
+        """
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                with self._lock:
+                    self.active += 1
+                try:
+                    self._dispatch(conn, request)
+                except (EOFError, OSError):
+                    # The client went away mid-reply.
+                    return
+                except Exception as e:
+                    print(f"Model server request {request.get('op')!r} failed: {e}")
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+                finally:
+                    with self._lock:
+                        self.active -= 1
+                        self.served += 1
+        finally:
+            conn.close()
+
+    def _prepare_socket_dir(self):
+        directory = os.path.dirname(os.path.abspath(self.address))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_private(directory, is_dir=True)
+
+    def _write_key_file(self):
+        """
+        Generate this run's auth key and publish it to workers of the same user.
+        """
+        self.authkey = secrets.token_bytes(32)
+        path = key_file(self.address)
+        if os.path.lexists(path):
+            os.remove(path)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.authkey)
+        return path
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.address):
+            return
+        if not stat.S_ISSOCK(os.stat(self.address).st_mode):
+            raise RuntimeError(f"{self.address} exists and is not a socket")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.address)
+            raise RuntimeError(f"Another model server is listening on {self.address}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(self.address)
+        finally:
+            probe.close()
+
+    def serve_forever(self):
+        self._prepare_socket_dir()
+        self._remove_stale_socket()
+        written_key = None if self.authkey else self._write_key_file()
+        # Owner-only socket: requests are pickled, so only this user may connect.
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        print(f"Model server ({self.backend}) listening on {self.address}")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as e:
+                    print(f"Model server rejected a connection: {e}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), name="model-server-conn", daemon=True).start()
+        finally:
+            listener.close()
+            if written_key:
+                os.remove(written_key)
+            self.engines.unload()
+
+
+def _exit_on_signal(signum, frame):
+    # Lets `kill` run the cleanup in serve_forever.
+    raise SystemExit(0)
+
+
+if __name__ == "__main__":
+    # Preload the paths the web app asks for, so they are loaded before its first request.
+    parser = argparse.ArgumentParser(description="Serve the embedding and LLM engines to web workers.")
+    parser.add_argument("--address", default=MODEL_SERVER_ADDRESS, help="Unix socket path")
+    parser.add_argument("--backend", default=None, help="vllm or cpu (default: RAG_BACKEND)")
+    parser.add_argument("--embedding", default=EMBEDDING_MODEL_PATH, help="Embedding model to preload")
+    parser.add_argument("--llm", default=LLM_MODEL_PATH, help="LLM to preload")
+    args = parser.parse_args()
+    server = ModelServer(args.address, args.backend)
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+    if args.embedding:
+        server.node("embedding", args.embedding)
+    if args.llm:
+        server.node("chat", args.llm)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,13 +1,33 @@
 # src/qa_node.py
 
 import json
+import os
 import numpy as  np
 from typing import List, Dict
-import requests
-from bs4 import BeautifulSoup
-import subprocess
+import time
+from contextlib import contextmanager
 
-from embedding_model import EmbeddingModel
+import chunker
+from model_registry import get_embedding_model, get_llm_model, lease_embedding_model, lease_llm_model
+from db import connection
+from embedding_store import decode_embeddings
+from retrieval import VectorIndex, as_query_matrix, reciprocal_rank_fusion
+from index_cache import get_index_cache
+from caches import embed_query, get_answer_cache
+from metrics import Histogram, Trace, register, span
+
+RETRIEVAL_DENSE = "dense"      # Cosine similarity over every chunk (or the ANN index)
+RETRIEVAL_LEXICAL = "lexical"  # BM25 over the full-text index
+RETRIEVAL_HYBRID = "hybrid"    # BM25 candidates fused with their chunks' similarity
+RETRIEVAL_MODES = (RETRIEVAL_DENSE, RETRIEVAL_LEXICAL, RETRIEVAL_HYBRID)
+RETRIEVAL_MODE = os.environ.get("RAG_RETRIEVAL_MODE", RETRIEVAL_HYBRID)
+# Name of the score each mode reports for its sources: cosine similarity, BM25 or fused RRF score.
+SCORE_FIELDS = {RETRIEVAL_DENSE: "score", RETRIEVAL_LEXICAL: "bm25", RETRIEVAL_HYBRID: "rrf_score"}
+LEXICAL_CANDIDATES = 200  # Documents taken from BM25 before dense scoring
+DENSE_CANDIDATES = 50     # Chunks taken from the dense side when BM25 finds too few documents
+
+FIRST_TOKEN_SECONDS = register(Histogram("rag_time_to_first_token_seconds",
+                                         "Time from a streamed question to its first answer token."))
 
 def cosine_similarity(vec1, vec2):
     """
@@ -29,39 +49,116 @@ def load_index(index_file: str) -> List[Dict]:
 
 # New helper function to load the index from a SQLite DB.
 def load_index_sqlite(db_file: str) -> List[Dict]:
-    import sqlite3, json
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute("SELECT source_type, source, content, embedding FROM embeddings")
-    rows = cursor.fetchall()
+    """
+    Load every document with its content and its (n_chunks, dim) chunk embeddings.
+    """
+    with connection(db_file) as conn:
+        chunk_rows = conn.execute("SELECT document_id, embedding, embedding_dim, embedding_dtype FROM chunks ORDER BY document_id, ordinal").fetchall()
+        document_rows = conn.execute("SELECT id, source_type, source, content FROM documents ORDER BY id").fetchall()
+    vectors = {}
+    for document_id, blob, dim, dtype in chunk_rows:
+        vectors.setdefault(document_id, []).append(decode_embeddings(blob, dim, dtype))
     index = []
-    for row in rows:
-        source_type, source, content, embedding_str = row
-        embedding = json.loads(embedding_str)
+    for row_id, source_type, source, content in document_rows:
+        if row_id not in vectors:
+            continue
+        embedding = np.concatenate(vectors[row_id])
         if source_type == "url":
-            index.append({"url": source, "content": content, "embedding": embedding})
+            index.append({"id": row_id, "url": source, "content": content, "embedding": embedding})
         else:
-            index.append({"file": source, "content": content, "embedding": embedding})
-    conn.close()
+            index.append({"id": row_id, "file": source, "content": content, "embedding": embedding})
     return index
 
-def retrieve_relevant_documents(query_embedding, index: List[Dict], top_k: int = 2, min_similarity: float = 0.6) -> List[Dict]:
+def retrieve_relevant_documents(query_embedding, index, top_k: int = 2, min_similarity: float = 0.6) -> List[Dict]:
     """
-    Compute cosine similarity for each document, discard those below min_similarity,
-    and return the top_k matches.
+    Score all chunks with one matrix product, keep each document's best chunk,
+    discard those below min_similarity, and return the top_k matches.
+    `index` is either a list of documents or a prebuilt VectorIndex.
     """
-    scored_docs = []
-    for doc in index:
-        embedding_data = doc["embedding"]
-        if isinstance(embedding_data[0], list):
-            sims = [cosine_similarity(query_embedding, np.expand_dims(vec, axis=0)) for vec in embedding_data]
-            sim = max(sims)
-        else:
-            sim = cosine_similarity(query_embedding, embedding_data)
-        if sim >= min_similarity:
-            scored_docs.append((sim, doc))
-    scored_docs.sort(key=lambda x: x[0], reverse=True)
-    return [doc for _, doc in scored_docs[:top_k]]
+    if not isinstance(index, VectorIndex):
+        index = VectorIndex(index)
+    return [index.docs[i] for i, _ in index.search_one(query_embedding, top_k, min_similarity)]
+
+def retrieve_relevant_documents_batch(query_embeddings, index, top_k: int = 2, min_similarity: float = 0.6) -> List[List[Dict]]:
+    """
+    Batched variant of retrieve_relevant_documents: one result list per query vector.
+    """
+    if not isinstance(index, VectorIndex):
+        index = VectorIndex(index)
+    return [[index.docs[i] for i, _ in hits] for hits in index.search(query_embeddings, top_k, min_similarity)]
+
+def retrieve_relevant_chunks(query_embedding, index: VectorIndex, top_k: int = 4, min_similarity: float = 0.6):
+    """
+    Return (document, chunk_ordinal, similarity) for the top_k chunks at or above
+    min_similarity. A chunked query embedding is averaged into one vector.
+    """
+    query = np.asarray(query_embedding, dtype=np.float32)
+    if len(index) == 0:
+        return []
+    query = query.reshape(-1, index.dim).mean(axis=0)
+    return [(index.docs[i], ordinal, score) for i, ordinal, score in index.search_chunks(query, top_k, min_similarity)[0]]
+
+def _query_vector(query_embedding, index: VectorIndex) -> np.ndarray:
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(-1, index.dim).mean(axis=0)
+    return as_query_matrix(query, index.dim)[0]
+
+def retrieve_lexical_chunks(query_embedding, index: VectorIndex, lexical_hits, top_k: int = 4):
+    """
+    Return (document, chunk_ordinal, -bm25) for the top_k BM25 documents; BM25
+    ranks whole documents, so each contributes its chunk most similar to the query.
+    """
+    if len(index) == 0:
+        return []
+    query = _query_vector(query_embedding, index)
+    hits = []
+    for position, bm25 in lexical_hits[:top_k]:
+        rows = index.doc_rows(position)
+        best = int(np.argmax(index.rows(rows) @ query))
+        hits.append((index.docs[position], best, -bm25))
+    return hits
+
+def retrieve_hybrid_chunks(query_embedding, index: VectorIndex, lexical_hits, top_k: int = 4,
+                           min_similarity: float = 0.6):
+    """
+    Fuse the dense ranking of chunks with the BM25 ranking of documents by
+    reciprocal rank fusion. When BM25 matched at least top_k documents only
+    their chunks are scored; otherwise the dense side also searches the whole
+    index. A document's BM25 rank is credited to its chunk most similar to the
+    query, and chunks below min_similarity get no dense rank.
+    Returns ((document, chunk_ordinal, fused score) for the top_k chunks, chunks scored).
+    """
+    if len(index) == 0:
+        return [], 0
+    query = _query_vector(query_embedding, index)
+    segments = [index.doc_rows(position) for position, _ in lexical_hits]
+    rows = np.concatenate(segments) if segments else np.zeros(0, dtype=np.int64)
+    chunks_scored = len(rows)
+    if len(lexical_hits) < top_k:
+        dense = index.search_chunks(query, DENSE_CANDIDATES, min_similarity)[0]
+        extra = np.array([index.doc_offsets[i] + ordinal for i, ordinal, _ in dense], dtype=np.int64)
+        rows = np.concatenate([rows, extra[~np.isin(extra, rows)]])
+        chunks_scored = index.n_rows
+    scores = index.rows(rows) @ query
+    order = np.argsort(-scores, kind="stable")
+    dense_ranking = [int(rows[i]) for i in order if scores[i] >= min_similarity]
+    lexical_ranking = []
+    start = 0
+    for segment in segments:
+        lexical_ranking.append(int(segment[np.argmax(scores[start:start + len(segment)])]))
+        start += len(segment)
+    fused = reciprocal_rank_fusion([dense_ranking, lexical_ranking])
+    hits = []
+    for row in sorted(fused, key=fused.get, reverse=True)[:top_k]:
+        i, ordinal = index.locate(row)
+        hits.append((index.docs[i], ordinal, fused[row]))
+    return hits, chunks_scored
+
+def format_context(passages: List[Dict]) -> str:
+    parts = []
+    for passage in passages:
+        label = f"URL: {passage['url']}" if "url" in passage else f"File: {passage['file']}"
+        parts.append(f"{label}\nContent: {passage['content']}")
+    return "\n\n".join(parts)
 
 # New helper function to generate a summary of the context.
 def summarize_context(context: str, llm, tokenizer, max_tokens: int = 3000) -> str:
@@ -73,71 +170,200 @@ def summarize_context(context: str, llm, tokenizer, max_tokens: int = 3000) -> s
         "Summarize the key points and important details concisely:\n\n" + context
     )
     summary = llm.chat(summary_prompt)
+    if isinstance(summary, list):
+        summary = " ".join(summary)
     return summary
 
 # New helper to chunk text based on the model's maximum token length.
 def chunk_text(text: str, tokenizer, max_tokens: int) -> list:
-    tokens = tokenizer.encode(text)
-    if len(tokens) <= max_tokens:
-        return [text]
-    chunks = []
-    for i in range(0, len(tokens), max_tokens):
-        chunk_tokens = tokens[i:i+max_tokens]
-        chunk = tokenizer.decode(chunk_tokens)
-        chunks.append(chunk)
-    return chunks
+    return [chunk["text"] for chunk in chunker.chunk_text(text, tokenizer, max_tokens, reserve_special_tokens=False)]
 
 # Updated QAClass to use the .chat method and chunk overly long prompts.
 class QAClass:
-    def __init__(self, index_file: str, embedding_model_path: str, llm_model_path: str, engine: str = "vllm"):
+    def __init__(self, index_file: str, embedding_model_path: str, llm_model_path: str, engine: str = "vllm",
+                 use_answer_cache: bool = False):
         self.index_file = index_file
         self.embedding_model_path = embedding_model_path
         self.llm_model_path = llm_model_path
         self.engine = engine
-        from embedding_model import EmbeddingModel
-        self.embedding_model = EmbeddingModel(model_path=embedding_model_path)
-        from llm_model import LLMModel
-        # Instantiate local LLM instance.
-        self.llm = LLMModel(llm_model_path)
-        # Initialize conversation context.
-
-    def answer(self, query: str) -> str:
-        # Load the index from the SQLite DB.
-        index = load_index_sqlite(self.index_file)
-        # Generate embedding for the query.
-        query_embedding = self.embedding_model.embed_text(query)
-        # Retrieve relevant documents.
-        relevant_docs = retrieve_relevant_documents(query_embedding, index)
-        context = "\n".join([
-            f"URL: {doc['url']}\nContent: {doc['content']}..."
-            for doc in relevant_docs if "url" in doc
-        ])
+        # Models come from the process-wide registry so repeated QAClass
+        # construction does not reload the engines.
+        self.embedding_model = get_embedding_model(embedding_model_path)
+        self.llm = get_llm_model(llm_model_path)
+        # Resident index shared by every QAClass on the same DB; refreshed incrementally.
+        self.index_cache = get_index_cache(index_file)
+        # Opt-in: reuse answers of near-identical recent questions on an unchanged index.
+        self.answer_cache = get_answer_cache(index_file) if use_answer_cache else None
+
+    @contextmanager
+    def _models_in_use(self):
+        """
+        Lease both models for one answer, so unloading them waits until it is done.
+        """
+        with lease_embedding_model(self.embedding_model_path) as embedding_model, \
+                lease_llm_model(self.llm_model_path) as llm:
+            # Models reloaded after an unload replace the ones taken in __init__.
+            self.embedding_model, self.llm = embedding_model, llm
+            yield
+
+    def _retrieve(self, query: str, query_embedding, index: VectorIndex, retrieval_mode: str, stage: Dict):
+        """
+        Chunk hits of one of RETRIEVAL_MODES; records how much was scored on stage.
+        """
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode} (expected one of {RETRIEVAL_MODES})")
+        if retrieval_mode == RETRIEVAL_DENSE:
+            stage.update(documents_scored=len(index), chunks_scored=index.n_rows)
+            return retrieve_relevant_chunks(query_embedding, index)
+        lexical_hits = self.index_cache.lexical_search(query, index, LEXICAL_CANDIDATES)
+        stage["lexical_hits"] = len(lexical_hits)
+        if retrieval_mode == RETRIEVAL_LEXICAL:
+            return retrieve_lexical_chunks(query_embedding, index, lexical_hits)
+        hits, stage["chunks_scored"] = retrieve_hybrid_chunks(query_embedding, index, lexical_hits)
+        return hits
+
+    def _prepare(self, query: str, session_id: str = None, trace: Trace = None, retrieval_mode: str = None):
+        """
+        Embed the query and retrieve its passages with retrieval_mode (default
+        RETRIEVAL_MODE). Returns (query_embedding, index_version, cached_answer,
+        passages, prompt_chunks); when the answer cache hits (it only reuses
+        answers given in session_id), passages and prompt_chunks are None.
+        """
+        retrieval_mode = retrieval_mode or RETRIEVAL_MODE
+        # Pick up rows written since the last query, if any.
+        with span("qa.index_refresh", trace) as stage:
+            # The version names the index the answer is retrieved from, even if indexing commits meanwhile.
+            index, index_version = self.index_cache.snapshot()
+            stage["documents"] = len(index)
+        # Generate embedding for the query (cached for repeated questions).
+        with span("qa.embed_query", trace):
+            query_embedding = embed_query(self.embedding_model, self.embedding_model_path, query)
+        if self.answer_cache is not None:
+            with span("qa.answer_cache", trace) as stage:
+                cached = self.answer_cache.lookup(query_embedding, index_version, session_id)
+                stage["hits"] = int(cached is not None)
+            if cached is not None:
+                return query_embedding, index_version, cached, None, None
+        # Retrieve the best chunks and read only their text plus neighbouring chunks.
+        with span("qa.retrieve", trace, mode=retrieval_mode) as stage:
+            hits = self._retrieve(query, query_embedding, index, retrieval_mode, stage)
+            stage["hits"] = len(hits)
+        with span("qa.read_passages", trace) as stage:
+            passages = self.index_cache.chunk_passages(hits)
+            context = format_context(passages)
+            stage["passages"] = len(passages)
         # Obtain tokenizer from the embedding node and summarize context if too long.
+        # With chunk-level passages this only triggers for unusually long contexts.
         tokenizer = self.embedding_model.model.engine.get_tokenizer()
-        context = summarize_context(context, self, tokenizer, max_tokens=8000)
+        with span("qa.summarize_context", trace) as stage:
+            summarized = summarize_context(context, self.llm, tokenizer, max_tokens=8000)
+            stage["summarized"] = int(summarized is not context)
+        context = summarized
         prompt = (
             f"Using the following summarized context, answer the question:\n\n"
             f"Summary:\n{context}\n\nQuestion: {query}\nAnswer:"
         )
         # Define a max prompt tokens limit (adjust based on model capabilities).
         MAX_PROMPT_TOKENS = 8000
-        
-        prompt_chunks = chunk_text(prompt, tokenizer, MAX_PROMPT_TOKENS)
-        #prompt_chunks = prompt
+        with span("qa.chunk_prompt", trace) as stage:
+            chunks = chunker.chunk_text(prompt, tokenizer, MAX_PROMPT_TOKENS, reserve_special_tokens=False)
+            prompt_chunks = [chunk["text"] for chunk in chunks]
+            stage["tokens_in"] = chunks[-1]["token_end"]
+        return query_embedding, index_version, None, passages, prompt_chunks
+
+    def answer(self, query: str, session_id: str = None, trace: Trace = None, retrieval_mode: str = None,
+               return_version: bool = False):
+        """
+        Answer query; pass a metrics.Trace to collect its per-stage timings.
+        With return_version, returns (answer, index_version of the index it was retrieved from).
+        """
+        with self._models_in_use():
+            return self._answer(query, session_id, trace, retrieval_mode, return_version)
+
+    def _answer(self, query: str, session_id: str, trace: Trace, retrieval_mode: str, return_version: bool):
+        query_embedding, index_version, cached, _, prompt_chunks = self._prepare(query, session_id, trace, retrieval_mode)
+        if cached is not None:
+            self._remember_cached(session_id, query, cached)
+            return (cached, index_version) if return_version else cached
         responses = []
-        for chunk in prompt_chunks:
-            # Pass chunk instead of the full list
-            responses.append(self.llm.chat(chunk))
-        flattened_responses = []
-        for r in responses:
-            if isinstance(r, list):
-                flattened_responses.append(" ".join(r))
-            elif isinstance(r, str):
-                flattened_responses.append(r)
-            else:
-                continue
-        response = " ".join(flattened_responses)
-        return response
+        with span("qa.generate", trace, prompt_chunks=len(prompt_chunks)) as stage:
+            for chunk in prompt_chunks:
+                # Pass chunk instead of the full list
+                responses.append(self.llm.chat(chunk, session_id=session_id, history_prompt=query))
+            flattened_responses = []
+            for r in responses:
+                if isinstance(r, list):
+                    flattened_responses.append(" ".join(r))
+                elif isinstance(r, str):
+                    flattened_responses.append(r)
+                else:
+                    continue
+            response = " ".join(flattened_responses)
+            stage["tokens_out"] = self.llm.count_tokens(response)
+        if self.answer_cache is not None:
+            self.answer_cache.add(query, query_embedding, response, index_version, session_id)
+        return (response, index_version) if return_version else response
+
+    def _remember_cached(self, session_id: str, query: str, answer: str):
+        # A cached answer skips the LLM, so record the turn in the session's conversation here.
+        self.llm.memory.record(session_id, query, answer)
+
+    def answer_stream(self, query: str, session_id: str = None, retrieval_mode: str = None):
+        """
+        Streaming variant of answer(). Yields event dicts:
+        {"type": "sources", "sources": [...]} once retrieval is done (each source's
+        score is named after the retrieval mode, see SCORE_FIELDS), then
+        {"type": "token", "text": ...} per generated piece, then
+        {"type": "done", "answer", "ttft_ms", "total_ms", "index_version", "timings"}.
+        """
+        with self._models_in_use():
+            yield from self._answer_stream(query, session_id, retrieval_mode)
+
+    def _answer_stream(self, query: str, session_id: str, retrieval_mode: str):
+        trace = Trace()
+        started = trace.started
+        retrieval_mode = retrieval_mode or RETRIEVAL_MODE
+        query_embedding, index_version, cached, passages, prompt_chunks = self._prepare(query, session_id, trace, retrieval_mode)
+        score_field = SCORE_FIELDS[retrieval_mode]
+        sources = [] if passages is None else [
+            {"source": p.get("url", p.get("file")), "type": "url" if "url" in p else "file",
+             score_field: round(float(p["score"]), 4), "chunk_range": list(p["chunk_range"])}
+            for p in passages
+        ]
+        yield {"type": "sources", "sources": sources, "cached": cached is not None, "retrieval": retrieval_mode}
+        first_token_at = None
+        if cached is not None:
+            first_token_at = time.perf_counter()
+            self._remember_cached(session_id, query, cached)
+            yield {"type": "token", "text": cached}
+            response = cached
+        else:
+            parts = []
+            # Includes time the client takes to consume each event.
+            with span("qa.generate", trace, prompt_chunks=len(prompt_chunks)) as stage:
+                for n, chunk in enumerate(prompt_chunks):
+                    if n:
+                        parts.append(" ")
+                        yield {"type": "token", "text": " "}
+                    for delta in self.llm.stream_chat(chunk, session_id=session_id, history_prompt=query):
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            FIRST_TOKEN_SECONDS.observe(first_token_at - started)
+                        parts.append(delta)
+                        yield {"type": "token", "text": delta}
+                response = "".join(parts)
+                stage["tokens_out"] = self.llm.count_tokens(response)
+            if self.answer_cache is not None:
+                self.answer_cache.add(query, query_embedding, response, index_version, session_id)
+        finished = time.perf_counter()
+        yield {
+            "type": "done",
+            "answer": response,
+            "index_version": index_version,
+            "ttft_ms": None if first_token_at is None else round((first_token_at - started) * 1000, 1),
+            "total_ms": round((finished - started) * 1000, 1),
+            "timings": trace.breakdown(),
+        }
 
 # New interactive chat function
 def interactive_chat(index_file: str, embedding_model_path: str, llm_model_path: str, engine: str = "vllm"):
@@ -148,13 +374,20 @@ def interactive_chat(index_file: str, embedding_model_path: str, llm_model_path:
         if query.lower().strip() == "exit":
             print("Exiting chat.")
             break
-        answer = qa.answer(query)
+        answer = qa.answer(query, session_id="interactive")
         print("AI:", answer)
 
 # Modify run_qa to use QAClass.
-def run_qa(query: str, index_file: str, embedding_model_path: str, llm_model_path: str, engine: str = "vllm"):
-    qa = QAClass(index_file, embedding_model_path, llm_model_path, engine)
-    return qa.answer(query)
+def run_qa(query: str, index_file: str, embedding_model_path: str, llm_model_path: str, engine: str = "vllm",
+           use_answer_cache: bool = False, session_id: str = None, trace: Trace = None, retrieval_mode: str = None,
+           return_version: bool = False):
+    qa = QAClass(index_file, embedding_model_path, llm_model_path, engine, use_answer_cache)
+    return qa.answer(query, session_id, trace, retrieval_mode, return_version)
+
+def run_qa_stream(query: str, index_file: str, embedding_model_path: str, llm_model_path: str, engine: str = "vllm",
+                  use_answer_cache: bool = False, session_id: str = None, retrieval_mode: str = None):
+    qa = QAClass(index_file, embedding_model_path, llm_model_path, engine, use_answer_cache)
+    return qa.answer_stream(query, session_id, retrieval_mode)
 
 # # Modify main block to use interactive chat.
 # if __name__ == "__main__":
@@ -0,0 +1,299 @@
+# src/quantization.py
+# Compact codes for the chunk vectors: int8 scalar quantization (1 byte per
+# dimension) or 1-bit binary quantization (sign bits, 1/32 of float32). A
+# search scores every chunk on its codes (Hamming distance for binary), then
+# rescores a shortlist exactly against the full-precision rows, which then need
+# not stay in memory: IndexCache drops them and rescores from the memory-mapped
+# store or from the SQLite BLOBs. Codes of rows appended to an index
+# (VectorIndex.extend) are appended with the same scales.
+# Usage: python quantization.py <index.db> [n_queries] [k]  (memory and recall report)
+import copy
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+import numpy as np
+
+from retrieval import RowBuffer, VectorIndex, as_query_matrix, select_top_k
+
+QUANTIZATION_NONE = "none"
+QUANTIZATION_INT8 = "int8"
+QUANTIZATION_BINARY = "binary"
+QUANTIZATION_METHODS = (QUANTIZATION_NONE, QUANTIZATION_INT8, QUANTIZATION_BINARY)
+QUANTIZATION = os.environ.get("RAG_QUANTIZATION", QUANTIZATION_NONE)
+RESCORE_FACTOR = 10   # Shortlist size per requested hit that is rescored exactly
+RESCORE_MIN = 100     # Smallest shortlist, so small top_k still rescores enough candidates
+SCORE_BATCH = 65_536  # Rows compared per block while scoring binary codes
+INT8_BLOCK = 256      # Rows decoded to float32 at a time; small enough to stay in cache
+
+# Bits set in each byte value, for numpy versions without bitwise_count.
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+
+def _popcount_rows(bits: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[bits].sum(axis=1, dtype=np.int32)
+
+
+class _Codes:
+    """
+    Codes of the first `size` rows of a shared append buffer; see extend.
+    """
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def _store(self, matrix: np.ndarray):
+        self._buffer = RowBuffer(self.encode(matrix))
+        self.size = len(matrix)
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._buffer.view(self.size)
+
+    def extend(self, matrix: np.ndarray) -> "_Codes":
+        """
+        These codes followed by the codes of matrix's rows; this object is left unchanged.
+        """
+        extended = copy.copy(self)
+        extended._buffer = self._buffer.append(self.size, self.encode(matrix))
+        extended.size = self.size + len(matrix)
+        return extended
+
+    def subset(self, rows: np.ndarray) -> "_Codes":
+        """
+        The codes of the given rows only.
+        """
+        subset = copy.copy(self)
+        subset._buffer = RowBuffer(self.codes[rows])
+        subset.size = len(rows)
+        return subset
+
+
+class Int8Codes(_Codes):
+    """
+    Symmetric per-dimension scalar quantization: x ~ code * scale with codes in [-127, 127].
+    Appended rows reuse the scales, so their values beyond the original peaks are clipped.
+    """
+
+    def __init__(self, matrix: np.ndarray):
+        peak = np.abs(matrix).max(axis=0) if len(matrix) else np.ones(matrix.shape[1], dtype=np.float32)
+        self.scale = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        self._store(matrix)
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(matrix / self.scale), -127, 127).astype(np.int8)
+
+    @property
+    def nbytes(self) -> int:
+        return self._buffer.data.nbytes + self.scale.nbytes
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """
+        Approximate cosine similarity of a normalized query with every row.
+        """
+        weights = query * self.scale
+        codes = self.codes
+        out = np.empty(len(codes), dtype=np.float32)
+        buffer = np.empty((INT8_BLOCK, codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), INT8_BLOCK):
+            block = codes[start:start + INT8_BLOCK]
+            decoded = buffer[:len(block)]
+            np.copyto(decoded, block, casting="unsafe")
+            out[start:start + len(block)] = decoded @ weights
+        return out
+
+
+class BinaryCodes(_Codes):
+    """
+    One sign bit per dimension, packed 8 per byte. Rows are compared by
+    Hamming distance, mapped to 1 - 2 * distance / dim so higher is closer.
+    """
+
+    def __init__(self, matrix: np.ndarray):
+        self.dim = matrix.shape[1]
+        self._store(matrix)
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        return np.packbits(matrix > 0, axis=1)
+
+    @property
+    def nbytes(self) -> int:
+        return self._buffer.data.nbytes
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        bits = np.packbits(query > 0)
+        codes = self.codes
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BATCH):
+            block = codes[start:start + SCORE_BATCH]
+            out[start:start + len(block)] = _popcount_rows(np.bitwise_xor(block, bits))
+        return 1.0 - 2.0 * out / self.dim
+
+
+class QuantizedIndex:
+    """
+    First-pass search over the codes of a VectorIndex's chunks, with exact
+    rescoring of a shortlist against its matrix. Attached to the index as
+    `quantized` (see attach_quantized); same search contracts as VectorIndex.
+    """
+
+    def __init__(self, vector_index: VectorIndex, method: str = QUANTIZATION_INT8,
+                 rescore_factor: int = RESCORE_FACTOR, matrix: np.ndarray = None):
+        # matrix: vector_index.matrix, when the caller already holds it.
+        matrix = vector_index.matrix if matrix is None else matrix
+        if method == QUANTIZATION_INT8:
+            self.codes = Int8Codes(matrix)
+        elif method == QUANTIZATION_BINARY:
+            self.codes = BinaryCodes(matrix)
+        else:
+            raise ValueError(f"Unknown quantization: {method} (expected one of {QUANTIZATION_METHODS[1:]})")
+        self.method = method
+        self.rescore_factor = rescore_factor
+        self._index = vector_index
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def extend(self, vector_index: VectorIndex, rows: np.ndarray) -> "QuantizedIndex":
+        """
+        These codes carried over to `vector_index`, a version extended from
+        the indexed one by `rows`: only those are encoded.
+        """
+        extended = copy.copy(self)
+        extended.codes = self.codes.extend(rows)
+        extended._index = vector_index
+        return extended
+
+    def compact(self, vector_index: VectorIndex, kept_rows: np.ndarray) -> "QuantizedIndex":
+        """
+        These codes carried over to `vector_index`, built from the kept_rows of the indexed one.
+        """
+        compacted = copy.copy(self)
+        compacted.codes = self.codes.subset(kept_rows)
+        compacted._index = vector_index
+        return compacted
+
+    def _shortlist(self, query: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Matrix rows of the best chunks by their codes; deleted documents are left out.
+        """
+        approx = self.codes.scores(query)
+        alive = self._index.row_alive if self._index.n_dead_rows else None
+        if alive is not None:
+            approx[~alive] = -np.inf
+        n = min(len(approx), max(top_k * self.rescore_factor, RESCORE_MIN))
+        rows = np.argpartition(-approx, n - 1)[:n] if n < len(approx) else np.arange(len(approx))
+        return rows if alive is None else rows[alive[rows]]
+
+    def search(self, query_embeddings, top_k: int = 2, min_similarity: float = 0.6) -> List[List[Tuple[int, float]]]:
+        """
+        Same contract as VectorIndex.search: documents ranked by their best
+        rescored chunk among the shortlist.
+        """
+        vi = self._index
+        results = []
+        for query in as_query_matrix(query_embeddings, vi.dim):
+            rows = self._shortlist(query, top_k)
+            if len(rows) == 0:
+                results.append([])
+                continue
+            scores = vi.rows(rows) @ query
+            docs = vi.chunk_to_doc[rows]
+            # Best chunk per candidate document: sort by (doc, -score) and keep the first of each doc.
+            order = np.lexsort((-scores, docs))
+            docs, scores = docs[order], scores[order]
+            first = np.concatenate(([True], docs[1:] != docs[:-1]))
+            candidates = docs[first]
+            hits = select_top_k(scores[first][None, :], top_k, min_similarity)[0]
+            results.append([(int(candidates[i]), score) for i, score in hits])
+        return results
+
+    def search_chunks(self, query_embeddings, top_k: int = 4,
+                      min_similarity: float = 0.6) -> List[List[Tuple[int, int, float]]]:
+        """
+        Same contract as VectorIndex.search_chunks.
+        """
+        vi = self._index
+        results = []
+        for query in as_query_matrix(query_embeddings, vi.dim):
+            rows = self._shortlist(query, top_k)
+            hits = select_top_k((vi.rows(rows) @ query)[None, :], top_k, min_similarity)[0]
+            results.append([vi.locate(rows[i]) + (score,) for i, score in hits])
+        return results
+
+
+def attach_quantized(vector_index: VectorIndex, method: str = QUANTIZATION):
+    """
+    Route vector_index searches through codes of the given method ("none" detaches).
+    """
+    if method == QUANTIZATION_NONE or len(vector_index) == 0:
+        vector_index.quantized = None
+        return
+    vector_index.quantized = QuantizedIndex(vector_index, method)
+
+
+def memory_report(vector_index: VectorIndex, methods=(QUANTIZATION_INT8, QUANTIZATION_BINARY)) -> List[Dict]:
+    """
+    Bytes of process memory the chunk vectors take as float32 rows and as each
+    method's codes (an index searched through codes drops its float rows, see
+    IndexCache), and what vector_index holds right now ("current": rows, codes,
+    ANN lists and layout; a memory-mapped store is shared page cache and not counted).
+    """
+    baseline = vector_index.n_rows * vector_index.dim * 4
+    report = [{"method": "float32", "bytes": baseline, "ratio": 1.0}]
+    matrix = vector_index.matrix
+    for method in methods:
+        nbytes = QuantizedIndex(vector_index, method, matrix=matrix).nbytes
+        report.append({"method": method, "bytes": nbytes, "ratio": nbytes / max(baseline, 1)})
+    current = vector_index.nbytes
+    report.append({"method": "current", "bytes": current, "ratio": current / max(baseline, 1)})
+    return report
+
+
+def recall_report(vector_index: VectorIndex, queries: np.ndarray, k: int = 10,
+                  methods=(QUANTIZATION_INT8, QUANTIZATION_BINARY)) -> List[Dict]:
+    """
+    recall@k of chunk search and mean per-query latency for each method, with
+    and without rescoring, against exact float32 search on the same queries.
+    """
+    def timed(search):
+        start = time.perf_counter()
+        hits = [[row for row, _ in search(query)] for query in as_query_matrix(queries, vector_index.dim)]
+        return hits, (time.perf_counter() - start) * 1000 / len(queries)
+
+    def recall(hits, exact):
+        found = sum(len(set(a) & set(e)) for a, e in zip(hits, exact))
+        return found / max(sum(len(e) for e in exact), 1)
+
+    matrix = vector_index.matrix
+    exact, exact_ms = timed(lambda q: select_top_k((matrix @ q)[None, :], k, -1.0)[0])
+    report = [{"method": "float32", "rescored": None, "recall": 1.0, "latency_ms": exact_ms}]
+    for method in methods:
+        quantized = QuantizedIndex(vector_index, method, matrix=matrix)
+        codes_only, codes_ms = timed(lambda q: select_top_k(quantized.codes.scores(q)[None, :], k, -2.0)[0])
+        report.append({"method": method, "rescored": False, "recall": recall(codes_only, exact), "latency_ms": codes_ms})
+        rescored, rescored_ms = timed(
+            lambda q: [(int(vector_index.doc_offsets[d]) + o, s) for d, o, s in quantized.search_chunks(q, k, -1.0)[0]])
+        report.append({"method": method, "rescored": True, "recall": recall(rescored, exact), "latency_ms": rescored_ms})
+    return report
+
+
+if __name__ == "__main__":
+    from index_cache import IndexCache
+    db_file = sys.argv[1]
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    vi = IndexCache(db_file).vector_index
+    rng = np.random.default_rng(0)
+    # Perturbed stored chunks stand in for real queries.
+    queries = vi.rows(rng.choice(vi.n_rows, n_queries)) + rng.normal(0, 0.05, (n_queries, vi.dim)).astype(np.float32)
+    print(f"{'method':<10}{'MiB':>10}{'ratio':>8}")
+    for row in memory_report(vi):
+        print(f"{row['method']:<10}{row['bytes'] / 2 ** 20:>10.2f}{row['ratio']:>8.3f}")
+    print(f"{'method':<10}{'rescored':>10}{'recall@' + str(k):>12}{'ms/query':>12}")
+    for row in recall_report(vi, queries, k):
+        print(f"{row['method']:<10}{'-' if row['rescored'] is None else str(row['rescored']):>10}"
+              f"{row['recall']:>12.3f}{row['latency_ms']:>12.3f}")
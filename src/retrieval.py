@@ -0,0 +1,423 @@
+# src/retrieval.py
+# Vectorized retrieval over all chunk embeddings of the index, and fusion of
+# dense and lexical (BM25) rankings for hybrid retrieval. An index grows by
+# appending versions (VectorIndex.extend) that share the rows already built.
+import copy
+from typing import List, Dict, Tuple
+import numpy as np
+
+RRF_K = 60  # Rank offset of reciprocal rank fusion; damps the weight of the very first ranks
+MIN_BUFFER_ROWS = 1024  # Smallest capacity of an append buffer
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize each row; all-zero rows stay zero so they score 0 like cosine_similarity.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def as_query_matrix(query_embeddings, dim: int) -> np.ndarray:
+    """
+    Coerce one query embedding (possibly chunked, e.g. the output of embed_text)
+    or a batch of query vectors into a normalized (n_queries, dim) matrix.
+    """
+    arr = np.asarray(query_embeddings, dtype=np.float32)
+    return normalize_rows(arr.reshape(-1, dim))
+
+
+class RowBuffer:
+    """
+    Append-only array shared by successive index versions. Each version views
+    a prefix of `data`; appending past the capacity moves to a copy twice as
+    large, so appends cost O(rows added) amortized and never touch the rows
+    that older versions still read.
+    """
+
+    def __init__(self, data: np.ndarray, size: int = None):
+        self.data = data
+        self.size = len(data) if size is None else size
+
+    def view(self, size: int) -> np.ndarray:
+        return self.data[:size]
+
+    def append(self, size: int, rows: np.ndarray) -> "RowBuffer":
+        """
+        The buffer holding the first `size` rows followed by `rows`.
+        """
+        rows = np.asarray(rows, dtype=self.data.dtype)
+        buffer = self
+        # Another version already appended after `size`, or the buffer is full: continue in a copy.
+        if size != self.size or size + len(rows) > len(self.data):
+            capacity = max(2 * (size + len(rows)), MIN_BUFFER_ROWS)
+            data = np.empty((capacity,) + rows.shape[1:], dtype=self.data.dtype)
+            data[:size] = self.data[:size]
+            buffer = RowBuffer(data, size)
+        buffer.data[size:size + len(rows)] = rows
+        buffer.size = size + len(rows)
+        return buffer
+
+
+class VectorIndex:
+    """
+    Holds every chunk vector of the index, pre-normalized: an immutable `base`
+    matrix (possibly memory-mapped) followed by rows appended since it was
+    built (see extend). Chunks of a document are stored contiguously, so
+    doc_offsets[i] is the first row of document i and chunk_to_doc maps each
+    row back to its document. Deleted documents keep their position and rows
+    until the index is rebuilt but never match a search.
+    An approximate index (see ann_index.attach_ann) can be attached as `ann`,
+    and quantized codes (see quantization.attach_quantized) as `quantized`;
+    searches go through the codes first, then the ANN index.
+    """
+
+    def __init__(self, docs: List[Dict]):
+        kept, blocks = _chunk_blocks(docs)
+        if blocks:
+            matrix = np.ascontiguousarray(normalize_rows(np.concatenate(blocks)))
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        self._set_layout(kept, matrix, np.array([len(block) for block in blocks], dtype=np.int64))
+
+    @classmethod
+    def from_matrix(cls, docs: List[Dict], matrix: np.ndarray, counts) -> "VectorIndex":
+        """
+        Index over an already normalized matrix (e.g. a memory-mapped vector
+        store) holding counts[i] consecutive rows for docs[i]. The matrix is
+        used as is, not copied.
+        """
+        index = cls.__new__(cls)
+        counts = np.asarray(counts, dtype=np.int64)
+        docs = [doc for doc, count in zip(docs, counts) if count > 0]
+        index._set_layout(docs, matrix if len(matrix) else np.zeros((0, 0), dtype=np.float32), counts[counts > 0])
+        return index
+
+    def _set_layout(self, docs: List[Dict], matrix: np.ndarray, counts: np.ndarray):
+        # Positions past n_docs belong to newer versions sharing the list.
+        self.docs = docs
+        # Versions extended from this one; only the newest appends to the shared list and ids.
+        self._lineage = {"head": 0}
+        self._version = 0
+        self.n_docs = len(docs)
+        self.base = matrix
+        self.n_rows = len(matrix)
+        self._tail = None
+        # Set by drop_rows: reads rows that are not held in memory.
+        self._fetch = None
+        self._chunk_to_doc = RowBuffer(np.repeat(np.arange(len(counts)), counts))
+        self._doc_offsets = RowBuffer(np.cumsum(counts) - counts)
+        self._doc_counts = RowBuffer(counts)
+        self.alive = np.ones(len(counts), dtype=bool)
+        self.n_dead = 0
+        self.n_dead_rows = 0
+        self._row_alive = None
+        # Database id -> position, to map lexical hits onto this index (see position).
+        self.positions = {doc["id"]: i for i, doc in enumerate(self.docs) if "id" in doc}
+        self.ann = None
+        self.quantized = None
+
+    def __len__(self):
+        return self.n_docs - self.n_dead
+
+    @property
+    def dim(self) -> int:
+        if self.base.shape[1] or self._tail is None:
+            return self.base.shape[1]
+        return self._tail.data.shape[1]
+
+    @property
+    def tail(self) -> np.ndarray:
+        """
+        Rows appended after the base.
+        """
+        if self._tail is None:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return self._tail.view(self.n_rows - len(self.base))
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        Every row as one array: the base itself, or a copy once rows were
+        appended or dropped. For tools and training; searches use rows() and chunk_scores().
+        """
+        if self._fetch is not None:
+            return self.rows(np.arange(self.n_rows))
+        if self.n_rows == len(self.base):
+            return self.base
+        return np.concatenate([self.base.reshape(-1, self.dim), self.tail])
+
+    @property
+    def chunk_to_doc(self) -> np.ndarray:
+        return self._chunk_to_doc.view(self.n_rows)
+
+    @property
+    def doc_offsets(self) -> np.ndarray:
+        return self._doc_offsets.view(self.n_docs)
+
+    @property
+    def doc_counts(self) -> np.ndarray:
+        return self._doc_counts.view(self.n_docs)
+
+    @property
+    def row_alive(self) -> np.ndarray:
+        """
+        Per-row mask of rows whose document was not deleted.
+        """
+        if self._row_alive is None:
+            self._row_alive = self.alive[self.chunk_to_doc]
+        return self._row_alive
+
+    def position(self, doc_id: int):
+        """
+        Position of a live document of this version by database id, or None.
+        """
+        i = self.positions.get(doc_id)
+        return i if i is not None and i < self.n_docs and self.alive[i] else None
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Process memory held for this version's rows: float rows, layout,
+        codes and ANN lists. A memory-mapped base lives in the shared page
+        cache and is not counted.
+        """
+        nbytes = 0 if isinstance(self.base, np.memmap) else self.base.nbytes
+        if self._tail is not None:
+            nbytes += self._tail.data.nbytes
+        nbytes += sum(buffer.data.nbytes for buffer in (self._chunk_to_doc, self._doc_offsets, self._doc_counts))
+        for attached in (self.ann, self.quantized):
+            nbytes += attached.nbytes if attached is not None else 0
+        return nbytes
+
+    def drop_rows(self, fetch):
+        """
+        Release the float rows held in memory; rows() then reads them with
+        fetch(doc_ids, ordinals, dim), which returns normalized vectors. For
+        an index searched through quantized codes, which only rescores shortlists.
+        """
+        self.base = np.zeros((0, self.dim), dtype=np.float32)
+        self._tail = None
+        self._fetch = fetch
+
+    def rows(self, rows) -> np.ndarray:
+        """
+        Vectors of the given row numbers.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if self._fetch is not None:
+            docs = self.chunk_to_doc[rows]
+            doc_ids = np.array([self.docs[doc]["id"] for doc in docs.tolist()], dtype=np.int64)
+            return self._fetch(doc_ids, rows - self.doc_offsets[docs], self.dim)
+        n_base = len(self.base)
+        if self.n_rows == n_base:
+            return np.asarray(self.base[rows])
+        if n_base == 0:
+            return self._tail.data[rows]
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        in_base = rows < n_base
+        out[in_base] = self.base[rows[in_base]]
+        out[~in_base] = self._tail.data[rows[~in_base] - n_base]
+        return out
+
+    def chunk_scores(self, query_matrix: np.ndarray) -> np.ndarray:
+        """
+        Similarity of each query with every row, shape (n_queries, n_rows);
+        rows of deleted documents score -inf.
+        """
+        n_base = len(self.base)
+        if self._fetch is not None:
+            scores = query_matrix @ self.matrix.T
+        elif self.n_rows == n_base:
+            scores = query_matrix @ self.base.T
+        else:
+            scores = np.empty((len(query_matrix), self.n_rows), dtype=np.float32)
+            if n_base:
+                scores[:, :n_base] = query_matrix @ self.base.T
+            scores[:, n_base:] = query_matrix @ self.tail.T
+        if self.n_dead_rows:
+            scores[:, ~self.row_alive] = -np.inf
+        return scores
+
+    def doc_scores(self, query_matrix: np.ndarray) -> np.ndarray:
+        """
+        Best chunk similarity per document for each query: shape (n_queries, n_docs).
+        """
+        return np.maximum.reduceat(self.chunk_scores(query_matrix), self.doc_offsets, axis=1)
+
+    def extend(self, docs: List[Dict], removed_ids=()) -> "VectorIndex":
+        """
+        A new version with `docs` appended and the documents with `removed_ids`
+        masked out, built in time proportional to the change: the base is
+        shared, new rows go to the append-only tail, and the attached ANN index
+        and codes are extended the same way. This version stays unchanged.
+        """
+        index = copy.copy(self)
+        index._row_alive = None
+        index._version = self._version + 1
+        kept, blocks = _chunk_blocks(docs)
+        rows = normalize_rows(np.concatenate(blocks)) if blocks else np.zeros((0, self.dim), dtype=np.float32)
+        if self._lineage["head"] == self._version:
+            self._lineage["head"] = index._version
+        else:
+            # A sibling version already changed the shared list and ids: continue in copies.
+            index._lineage = {"head": index._version}
+            index.docs = self.docs[:self.n_docs]
+            index.positions = {doc["id"]: i for i, doc in enumerate(index.docs) if "id" in doc and self.alive[i]}
+        if blocks:
+            counts = np.array([len(block) for block in blocks], dtype=np.int64)
+            if self._fetch is None:
+                tail = self._tail or RowBuffer(np.zeros((0, rows.shape[1]), dtype=np.float32))
+                index._tail = tail.append(self.n_rows - len(self.base), rows)
+            index._chunk_to_doc = self._chunk_to_doc.append(
+                self.n_rows, np.repeat(np.arange(self.n_docs, self.n_docs + len(kept)), counts))
+            index._doc_offsets = self._doc_offsets.append(self.n_docs, self.n_rows + np.cumsum(counts) - counts)
+            index._doc_counts = self._doc_counts.append(self.n_docs, counts)
+            index.docs.extend(kept)
+            index.n_docs = self.n_docs + len(kept)
+            index.n_rows = self.n_rows + len(rows)
+            index.alive = np.concatenate([self.alive, np.ones(len(kept), dtype=bool)])
+            for i, doc in enumerate(kept, self.n_docs):
+                if "id" in doc:
+                    index.positions[doc["id"]] = i
+        removed = [index.positions.pop(doc_id) for doc_id in removed_ids if doc_id in index.positions]
+        if removed:
+            if index.alive is self.alive:
+                index.alive = self.alive.copy()
+            index.alive[removed] = False
+            index.n_dead = self.n_dead + len(removed)
+            index.n_dead_rows = self.n_dead_rows + int(index.doc_counts[removed].sum())
+        if self.ann is not None:
+            index.ann = self.ann.extend(index, rows)
+        if self.quantized is not None:
+            index.quantized = self.quantized.extend(index, rows)
+        return index
+
+    def compact(self) -> "VectorIndex":
+        """
+        A new version without the rows and positions of deleted documents.
+        The attached ANN index and codes keep the entries of the remaining rows.
+        """
+        live = np.flatnonzero(self.alive)
+        live_rows = np.flatnonzero(self.row_alive)
+        if self._fetch is None:
+            matrix = self.rows(live_rows)
+        else:
+            matrix = np.zeros((0, self.dim), dtype=np.float32)
+        index = VectorIndex.__new__(VectorIndex)
+        index._set_layout([self.docs[i] for i in live.tolist()], matrix, self.doc_counts[live])
+        if self._fetch is not None:
+            index.n_rows = len(live_rows)
+            index._fetch = self._fetch
+        if self.ann is not None:
+            index.ann = self.ann.compact(index, live_rows)
+        if self.quantized is not None:
+            index.quantized = self.quantized.compact(index, live_rows)
+        return index
+
+    def search(self, query_embeddings, top_k: int = 2, min_similarity: float = 0.6) -> List[List[Tuple[int, float]]]:
+        """
+        Score a batch of queries and return, per query, (doc_position, similarity)
+        pairs for the top_k documents at or above min_similarity, best first.
+        """
+        if self.quantized is not None:
+            return self.quantized.search(query_embeddings, top_k, min_similarity)
+        if self.ann is not None:
+            return self.ann.search(query_embeddings, top_k, min_similarity)
+        return self.search_exact(query_embeddings, top_k, min_similarity)
+
+    def search_exact(self, query_embeddings, top_k: int = 2, min_similarity: float = 0.6) -> List[List[Tuple[int, float]]]:
+        if len(self) == 0:
+            queries = np.asarray(query_embeddings)
+            return [[] for _ in range(queries.size // max(queries.shape[-1], 1) if queries.ndim else 1)]
+        queries = as_query_matrix(query_embeddings, self.dim)
+        return select_top_k(self.doc_scores(queries), top_k, min_similarity)
+
+    def search_chunks(self, query_embeddings, top_k: int = 4, min_similarity: float = 0.6) -> List[List[Tuple[int, int, float]]]:
+        """
+        Chunk-level search: per query, (doc_position, chunk_ordinal, similarity)
+        for the top_k chunks at or above min_similarity, best first.
+        """
+        if len(self) == 0:
+            queries = np.asarray(query_embeddings)
+            return [[] for _ in range(queries.size // max(queries.shape[-1], 1) if queries.ndim else 1)]
+        if self.quantized is not None:
+            return self.quantized.search_chunks(query_embeddings, top_k, min_similarity)
+        if self.ann is not None:
+            return self.ann.search_chunks(query_embeddings, top_k, min_similarity)
+        queries = as_query_matrix(query_embeddings, self.dim)
+        hits = select_top_k(self.chunk_scores(queries), top_k, min_similarity)
+        return [[self.locate(row) + (score,) for row, score in per_query] for per_query in hits]
+
+    def doc_rows(self, position: int) -> np.ndarray:
+        """
+        Matrix rows of one document's chunks.
+        """
+        start = int(self.doc_offsets[position])
+        return np.arange(start, start + int(self.doc_counts[position]))
+
+    def locate(self, row: int) -> Tuple[int, int]:
+        """
+        (doc_position, chunk_ordinal) of a matrix row.
+        """
+        doc = int(self.chunk_to_doc[row])
+        return doc, int(row - self.doc_offsets[doc])
+
+    def search_one(self, query_embedding, top_k: int = 2, min_similarity: float = 0.6) -> List[Tuple[int, float]]:
+        """
+        Search with a single query. A chunked query embedding is averaged into one vector.
+        """
+        if len(self) == 0:
+            return []
+        query = as_query_matrix(query_embedding, self.dim)
+        if len(query) > 1:
+            query = normalize_rows(query.mean(axis=0, keepdims=True))
+        return self.search(query, top_k, min_similarity)[0]
+
+
+def _chunk_blocks(docs: List[Dict]) -> Tuple[List[Dict], List[np.ndarray]]:
+    """
+    The documents that have chunk vectors, and their vectors as (n_chunks, dim) blocks.
+    """
+    kept, blocks = [], []
+    for doc in docs:
+        embedding = np.asarray(doc["embedding"], dtype=np.float32)
+        if embedding.size == 0:
+            continue
+        blocks.append(embedding.reshape(-1, embedding.shape[-1]))
+        kept.append(doc)
+    return kept, blocks
+
+
+def select_top_k(scores: np.ndarray, top_k: int, min_similarity: float) -> List[List[Tuple[int, float]]]:
+    """
+    Pick the top_k columns of each row of scores with argpartition, dropping
+    entries below min_similarity.
+    """
+    n_docs = scores.shape[1]
+    k = min(top_k, n_docs)
+    if k <= 0:
+        return [[] for _ in range(len(scores))]
+    if k < n_docs:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(n_docs), (len(scores), 1))
+    results = []
+    for row, cand in zip(scores, candidates):
+        cand = cand[np.argsort(-row[cand], kind="stable")]
+        results.append([(int(i), float(row[i])) for i in cand if row[i] >= min_similarity])
+    return results
+
+
+def reciprocal_rank_fusion(rankings: List[List], k: int = RRF_K) -> Dict:
+    """
+    Fuse ranked lists of keys (best first): a key scores the sum of
+    1 / (k + rank) over the lists it appears in.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return fused
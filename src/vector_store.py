@@ -0,0 +1,158 @@
+# src/vector_store.py
+# Contiguous on-disk copy of the normalized chunk vectors, written by
+# run_indexing next to index.db and opened by query processes with np.memmap,
+# so every worker shares one copy through the OS page cache and starts without
+# decoding the BLOBs. Layout of <index.db>.vectors/:
+#   manifest.json              current version, row count, dim and file names
+#   vectors-<version>.f32      raw little-endian float32 rows, chunks of each document in id order
+#   ids-<version>.npz          document ids and their chunk counts, in row order
+# New documents are appended to the data file (readers of an older version only
+# map the rows their manifest lists); deleted documents trigger a rewrite into
+# a new data file. Either way a new manifest is swapped in atomically, and the
+# files of the version it replaces are kept until the next update, so a reader
+# that has just read the previous manifest can still open them.
+import json
+import os
+from typing import Dict, Optional
+import numpy as np
+
+from db import connection
+from embedding_store import decode_embeddings
+from retrieval import normalize_rows
+
+MANIFEST = "manifest.json"
+WRITE_BATCH = 4096  # Chunk rows read from SQLite and written per block
+
+
+def vector_store_path(db_file: str) -> str:
+    return db_file + ".vectors"
+
+
+def read_manifest(db_file: str) -> Optional[Dict]:
+    path = os.path.join(vector_store_path(db_file), MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class VectorStore:
+    """
+    One version of the store, opened read-only. `matrix` is a memory map of
+    the data file limited to the rows of this version.
+    """
+
+    def __init__(self, db_file: str, manifest: Dict):
+        path = vector_store_path(db_file)
+        self.version = manifest["version"]
+        self.dim = manifest["dim"]
+        self.rows = manifest["rows"]
+        self.data_file = manifest["data"]
+        self.ids_file = manifest["ids"]
+        with np.load(os.path.join(path, manifest["ids"])) as ids:
+            self.doc_ids = ids["doc_ids"]
+            self.counts = ids["counts"]
+        if self.rows:
+            self.matrix = np.memmap(os.path.join(path, self.data_file), dtype="<f4", mode="r",
+                                    shape=(self.rows, self.dim))
+        else:
+            self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+
+    @classmethod
+    def open(cls, db_file: str) -> Optional["VectorStore"]:
+        manifest = read_manifest(db_file)
+        if manifest is None:
+            return None
+        try:
+            return cls(db_file, manifest)
+        except FileNotFoundError:
+            # Two updates landed since the manifest was read; the current one names files that exist.
+            return cls(db_file, read_manifest(db_file))
+
+
+def _write_chunks(conn, f, after_id: int, doc_counts: Dict[int, int], dim: Optional[int]) -> Optional[int]:
+    """
+    Append the normalized chunk vectors of documents above after_id to f,
+    counting rows per document. Returns the vector dimension (None if no rows).
+    """
+    cursor = conn.execute(
+        "SELECT document_id, embedding, embedding_dim, embedding_dtype FROM chunks "
+        "WHERE document_id > ? ORDER BY document_id, ordinal",
+        (after_id,),
+    )
+    while True:
+        rows = cursor.fetchmany(WRITE_BATCH)
+        if not rows:
+            return dim
+        blocks = []
+        for document_id, blob, row_dim, dtype in rows:
+            block = decode_embeddings(blob, row_dim, dtype)
+            if dim is None:
+                dim = row_dim
+            elif row_dim != dim:
+                raise ValueError(f"Document {document_id} has {row_dim}-dim vectors, expected {dim}")
+            doc_counts[document_id] = doc_counts.get(document_id, 0) + len(block)
+            blocks.append(block)
+        f.write(normalize_rows(np.concatenate(blocks)).astype("<f4").tobytes())
+
+
+def update_vector_store(db_file: str) -> Optional[Dict]:
+    """
+    Bring the on-disk vectors up to date with index.db: append new documents,
+    or rewrite the data file when documents were deleted. Returns the new
+    manifest, or None when nothing changed.
+    """
+    path = vector_store_path(db_file)
+    os.makedirs(path, exist_ok=True)
+    current = VectorStore.open(db_file)
+    with connection(db_file) as conn:
+        # Ids and chunks from one snapshot, so a concurrent writer cannot split a document.
+        conn.execute("BEGIN")
+        live = [row[0] for row in conn.execute("SELECT id FROM documents ORDER BY id")]
+        known = current.doc_ids.tolist() if current is not None else []
+        if known == live:
+            return None
+        # Ids are AUTOINCREMENT, so without deletions the new documents follow the known ones.
+        append = current is not None and live[:len(known)] == known
+        version = current.version + 1 if current is not None else 1
+        doc_counts = {}
+        if append:
+            data_file, after_id, dim = current.data_file, (known[-1] if known else 0), current.dim or None
+            with open(os.path.join(path, data_file), "r+b") as f:
+                # Drop rows a crashed run wrote after the last manifest.
+                f.truncate(current.rows * current.dim * 4)
+                f.seek(0, os.SEEK_END)
+                dim = _write_chunks(conn, f, after_id, doc_counts, dim)
+                f.flush()
+                os.fsync(f.fileno())
+            new_ids = live[len(known):]
+            doc_ids = np.concatenate([current.doc_ids, np.array(new_ids, dtype=np.int64)])
+            counts = np.concatenate([current.counts, np.array([doc_counts.get(i, 0) for i in new_ids], dtype=np.int32)])
+        else:
+            data_file = f"vectors-{version:06d}.f32"
+            with open(os.path.join(path, data_file), "wb") as f:
+                dim = _write_chunks(conn, f, 0, doc_counts, None)
+                f.flush()
+                os.fsync(f.fileno())
+            doc_ids = np.array(live, dtype=np.int64)
+            counts = np.array([doc_counts.get(i, 0) for i in live], dtype=np.int32)
+    ids_file = f"ids-{version:06d}.npz"
+    np.savez(os.path.join(path, ids_file), doc_ids=doc_ids, counts=counts)
+    manifest = {"version": version, "dim": dim or 0, "rows": int(counts.sum()), "data": data_file, "ids": ids_file}
+    tmp = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(path, MANIFEST))
+    # Processes that still map an old data file keep reading it until they reopen;
+    # the replaced version's files stay for readers that are opening it right now.
+    keep = {MANIFEST, data_file, ids_file}
+    if current is not None:
+        keep.update((current.data_file, current.ids_file))
+    for name in os.listdir(path):
+        if name not in keep:
+            os.remove(os.path.join(path, name))
+    print(f"Vector store v{version}: {'appended' if append else 'rewrote'} "
+          f"{sum(doc_counts.values())} rows ({manifest['rows']} total)")
+    return manifest
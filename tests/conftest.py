@@ -0,0 +1,10 @@
+# tests/conftest.py
+# The modules under src/ import each other by plain name, as when run from src/.
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# No GPU or model weights here: the deterministic CPU backend stands in for the engines.
+os.environ.setdefault("RAG_BACKEND", "cpu")
+os.environ.setdefault("RAG_WARM_UP", "0")
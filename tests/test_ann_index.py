@@ -0,0 +1,75 @@
+# tests/test_ann_index.py
+# The IVF index returns exact results when every list is probed, across index versions.
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex, attach_ann
+from retrieval import VectorIndex, as_query_matrix, select_top_k
+
+DIM = 16
+N_LISTS = 8
+
+
+def _docs(rng, ids):
+    return [{"id": i, "embedding": rng.standard_normal((int(rng.integers(1, 6)), DIM)).astype(np.float32)}
+            for i in ids]
+
+
+def _keyed(index, hits):
+    return [[(index.docs[hit[0]]["id"],) + tuple(hit[1:-1]) for hit in per_query] for per_query in hits]
+
+
+def _assert_exact_at_full_nprobe(index, queries):
+    ivf = index.ann
+    exact_docs = index.search_exact(queries, 5, -1.0)
+    ivf_docs = ivf.search(queries, 5, -1.0, nprobe=N_LISTS)
+    assert _keyed(index, ivf_docs) == _keyed(index, exact_docs)
+    assert [[s for _, s in q] for q in ivf_docs] == [pytest.approx([s for _, s in q], abs=1e-5) for q in exact_docs]
+    scores = index.chunk_scores(as_query_matrix(queries, DIM))
+    exact_chunks = [[index.locate(row) + (score,) for row, score in hits] for hits in select_top_k(scores, 8, -1.0)]
+    assert _keyed(index, ivf.search_chunks(queries, 8, -1.0, nprobe=N_LISTS)) == _keyed(index, exact_chunks)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def test_full_nprobe_matches_exact_search(rng):
+    index = VectorIndex(_docs(rng, range(1, 301)))
+    attach_ann(index, IVFIndex.train(index, n_lists=N_LISTS), min_chunks=0)
+    queries = rng.standard_normal((5, DIM)).astype(np.float32)
+    _assert_exact_at_full_nprobe(index, queries)
+    # Probing fewer lists scores fewer rows, from the probed lists only.
+    _, rows = next(index.ann._probe(queries[:1], nprobe=1))
+    assert 0 < len(rows) < index.n_rows
+
+
+def test_extended_and_compacted_versions_stay_exact(rng):
+    index = VectorIndex(_docs(rng, range(1, 201)))
+    attach_ann(index, IVFIndex.train(index, n_lists=N_LISTS), min_chunks=0)
+    queries = rng.standard_normal((5, DIM)).astype(np.float32)
+    next_id = 201
+    for step in range(6):
+        removed = [int(i) for i in rng.choice(list(index.positions), size=10, replace=False)]
+        index = index.extend(_docs(rng, range(next_id, next_id + 15)), removed)
+        next_id += 15
+        assert index.ann._index is index
+        _assert_exact_at_full_nprobe(index, queries)
+        if step % 2:
+            index = index.compact()
+            _assert_exact_at_full_nprobe(index, queries)
+
+
+def test_binding_leaves_other_indexes_untouched(rng, tmp_path):
+    first = VectorIndex(_docs(rng, range(1, 101)))
+    ivf = IVFIndex.train(first, n_lists=N_LISTS)
+    attach_ann(first, ivf, min_chunks=0)
+    second = VectorIndex(_docs(rng, range(101, 151)))
+    attach_ann(second, ivf, min_chunks=0)
+    assert first.ann._index is first and second.ann._index is second
+    path = str(tmp_path / "index.ivf.npz")
+    first.ann.save(path)
+    loaded = IVFIndex.load(path).bind(first)
+    assert loaded.added == 0
+    np.testing.assert_array_equal(loaded.keys()[2], first.ann.keys()[2])
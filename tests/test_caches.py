@@ -0,0 +1,35 @@
+# tests/test_caches.py
+# The semantic answer cache only reuses answers within one chat session.
+import numpy as np
+
+from caches import SemanticAnswerCache
+from db import connection
+from embedding_store import encode_embeddings
+
+QUESTION = np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32)
+REPHRASED = np.array([1.0, 0.01, 0.0, 0.0], dtype=np.float32)
+
+
+def test_answers_are_reused_within_a_session_only(tmp_path):
+    cache = SemanticAnswerCache(str(tmp_path / "index.db"))
+    cache.add("What is RAG?", QUESTION, "Answer for alice", "v1", session_id="alice")
+    assert cache.lookup(REPHRASED, "v1", session_id="alice") == "Answer for alice"
+    assert cache.lookup(REPHRASED, "v1", session_id="bob") is None
+    # A different index version never hits.
+    assert cache.lookup(REPHRASED, "v2", session_id="alice") is None
+
+
+def test_warms_from_the_sessions_own_history(tmp_path):
+    db_file = str(tmp_path / "index.db")
+    blob, dim, dtype = encode_embeddings(QUESTION)
+    with connection(db_file) as conn:
+        conn.executemany("""
+            INSERT INTO chat_history (session_id, user_message, bot_answer, user_embedding,
+                                      embedding_dim, embedding_dtype, index_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [("alice", "What is RAG?", "Answer for alice", blob, dim, dtype, "v1"),
+              ("carol", "What is RAG?", "Answer for carol", blob, dim, dtype, "v1")])
+    cache = SemanticAnswerCache(db_file)
+    assert cache.lookup(REPHRASED, "v1", session_id="bob") is None
+    assert cache.lookup(REPHRASED, "v1", session_id="carol") == "Answer for carol"
+    assert cache.lookup(REPHRASED, "v1", session_id="alice") == "Answer for alice"
@@ -0,0 +1,76 @@
+# tests/test_chunker.py
+# Token ranges and character spans of chunk_text, with the CPU backend's tokenizer.
+import pytest
+
+from backends import HashingTokenizer
+from chunker import SNAP_SENTENCE, chunk_text
+
+TEXT = " ".join(f"Sentence number {i} talks about topic {i % 7} in some detail." for i in range(40))
+
+
+@pytest.fixture
+def tokenizer():
+    return HashingTokenizer()
+
+
+def test_chunks_tile_the_text_without_overlap(tokenizer):
+    n_tokens = len(tokenizer.encode(TEXT, add_special_tokens=False))
+    chunks = chunk_text(TEXT, tokenizer, max_tokens=32)
+    assert len(chunks) > 1
+    assert chunks[0]["token_start"] == 0 and chunks[-1]["token_end"] == n_tokens
+    assert chunks[0]["char_start"] == 0 and chunks[-1]["char_end"] == len(TEXT)
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert chunk["token_end"] == following["token_start"]
+        assert chunk["char_end"] == following["char_start"]
+    assert "".join(chunk["text"] for chunk in chunks) == TEXT
+    for chunk in chunks:
+        # Two of the 32 tokens are reserved for the model's special tokens.
+        assert chunk["token_end"] - chunk["token_start"] <= 30
+        assert chunk["text"] == TEXT[chunk["char_start"]:chunk["char_end"]]
+        assert len(tokenizer.encode(chunk["text"], add_special_tokens=False)) == chunk["token_end"] - chunk["token_start"]
+
+
+def test_overlapping_chunks_share_tokens(tokenizer):
+    chunks = chunk_text(TEXT, tokenizer, max_tokens=32, overlap=5)
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert following["token_start"] == chunk["token_end"] - 5
+        # Each chunk's span ends at its last token, so spans overlap by the shared tokens.
+        assert following["char_start"] < chunk["char_end"]
+        shared = TEXT[following["char_start"]:chunk["char_end"]]
+        assert tokenizer.encode(shared, add_special_tokens=False) == \
+            tokenizer.encode(chunk["text"], add_special_tokens=False)[-5:]
+
+
+def test_sentence_snapping_ends_chunks_at_sentence_boundaries(tokenizer):
+    chunks = chunk_text(TEXT, tokenizer, max_tokens=32, snap=SNAP_SENTENCE)
+    for chunk in chunks[:-1]:
+        assert chunk["text"].rstrip().endswith(".")
+        # Snapping never shrinks a chunk below half of its 30-token budget.
+        assert chunk["token_end"] - chunk["token_start"] >= 15
+    assert "".join(chunk["text"] for chunk in chunks) == TEXT
+
+
+def test_token_ids_include_special_tokens(tokenizer):
+    chunks = chunk_text(TEXT, tokenizer, max_tokens=32, with_token_ids=True)
+    for chunk in chunks:
+        assert chunk["token_ids"] == tokenizer.encode(chunk["text"])
+        assert len(chunk["token_ids"]) <= 32
+
+
+def test_single_chunk_and_errors(tokenizer):
+    assert chunk_text("Short text.", tokenizer, max_tokens=32) == [
+        {"token_start": 0, "token_end": 3, "char_start": 0, "char_end": 11, "text": "Short text."}]
+    with pytest.raises(ValueError):
+        chunk_text(TEXT, tokenizer, max_tokens=2)
+
+
+def test_tokenizer_without_offsets_decodes_chunks(tokenizer):
+    class NoOffsets(HashingTokenizer):
+        def __call__(self, text, add_special_tokens=True, return_offsets_mapping=False):
+            if return_offsets_mapping:
+                raise NotImplementedError
+            return super().__call__(text, add_special_tokens)
+
+    chunks = chunk_text(TEXT, NoOffsets(), max_tokens=32)
+    assert all(chunk["char_start"] is None and chunk["char_end"] is None for chunk in chunks)
+    assert " ".join(chunk["text"] for chunk in chunks) == tokenizer.decode(tokenizer.encode(TEXT))
@@ -0,0 +1,47 @@
+# tests/test_conversation_memory.py
+# Token-budgeted conversation memory and its summary compaction.
+import threading
+
+from conversation_memory import ConversationMemory
+
+
+def _count_words(text):
+    return len(text.split())
+
+
+def test_turns_past_the_budget_are_summarized():
+    memory = ConversationMemory(_count_words, token_budget=8,
+                                summarize=lambda summary, turns: " ".join(user for user, _, _ in turns))
+    memory.record("s", "first question", "first answer")
+    memory.record("s", "second question", "second answer")
+    messages = memory.messages("s", "third question")
+    assert "first question" in messages[0]["content"]
+    assert [m["content"] for m in messages[1:]] == ["second question", "second answer", "third question"]
+    assert memory.stats()["compactions"] == 1
+
+
+def test_summarizing_does_not_block_other_calls():
+    started, release = threading.Event(), threading.Event()
+
+    def slow_summary(summary, turns):
+        started.set()
+        assert release.wait(5)
+        return "summary"
+
+    memory = ConversationMemory(_count_words, token_budget=8, summarize=slow_summary)
+    memory.record("s", "first question", "first answer")
+    compacting = threading.Thread(target=memory.record, args=("s", "second question", "second answer"))
+    compacting.start()
+    try:
+        assert started.wait(5)
+        # The session's own turns and other sessions stay usable while the summary is generated.
+        assert [m["content"] for m in memory.messages("s", "next")[1:]] == ["second question", "second answer", "next"]
+        memory.record("other", "hello", "hi")
+        memory.record("s", "third", "reply")
+    finally:
+        release.set()
+        compacting.join(5)
+    assert not compacting.is_alive()
+    # The turn dropped meanwhile was folded in by the running compaction.
+    assert memory.stats()["compactions"] == 2
+    assert "summary" in memory.messages("s", "next")[0]["content"]
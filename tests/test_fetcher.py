@@ -0,0 +1,152 @@
+# tests/test_fetcher.py
+# Fetcher and the URL extract stage against a local http.server.
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fetcher
+import indexing_pipeline
+from fetcher import Fetcher
+from indexing_jobs import PipelineProgress
+
+PAGE = b"<html><body><p>Hello from the test server</p></body></html>"
+ETAG = '"v1"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits.setdefault(self.path, []).append(time.monotonic())
+            attempt = len(server.hits[self.path])
+        if self.path.startswith("/flaky"):
+            # Fails twice, then succeeds.
+            if attempt <= 2:
+                self._reply(503)
+            else:
+                self._reply(200, PAGE)
+        elif self.path == "/down":
+            self._reply(503)
+        elif self.path.startswith("/slow"):
+            with server.lock:
+                server.active += 1
+                server.peak = max(server.peak, server.active)
+            time.sleep(0.1)
+            with server.lock:
+                server.active -= 1
+            self._reply(200, PAGE)
+        elif self.path == "/etag":
+            if self.headers.get("If-None-Match") == ETAG:
+                self._reply(304, headers={"ETag": ETAG})
+            else:
+                self._reply(200, PAGE, {"ETag": ETAG})
+        elif self.path == "/empty":
+            self._reply(200, b"<html><script>var x = 1;</script></html>")
+        else:
+            self._reply(404)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.lock = threading.Lock()
+    httpd.hits = {}
+    httpd.active = 0
+    httpd.peak = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def fast_fetcher(monkeypatch):
+    instance = Fetcher(min_host_interval=0.0, backoff_base=0.05)
+    monkeypatch.setattr(fetcher, "_default_fetcher", instance)
+    return instance
+
+
+class _RecordingProgress(PipelineProgress):
+    def __init__(self):
+        self.counts = {}
+
+    def update(self, field, n=1):
+        self.counts[field] = self.counts.get(field, 0) + n
+
+
+def test_retries_retryable_statuses_with_backoff(server, fast_fetcher):
+    response = fast_fetcher.get(server.url + "/flaky")
+    assert response.status_code == 200
+    hits = server.hits["/flaky"]
+    assert len(hits) == 3
+    # Backoff doubles: 0.05s before the second attempt, 0.1s before the third.
+    assert hits[1] - hits[0] >= 0.05
+    assert hits[2] - hits[1] >= 0.1
+
+
+def test_gives_up_after_max_retries(server):
+    client = Fetcher(min_host_interval=0.0, max_retries=2, backoff_base=0.01)
+    assert client.get(server.url + "/down").status_code == 503
+    assert len(server.hits["/down"]) == 3
+    assert client.fetch_conditional(server.url + "/down") is None
+
+
+def test_limits_concurrency_per_host(server):
+    client = Fetcher(max_workers=8, max_per_host=2, min_host_interval=0.0)
+    urls = [f"{server.url}/slow/{i}" for i in range(8)]
+    results = dict(client.fetch_all(urls))
+    assert set(results) == set(urls)
+    assert all(text == "Hello from the test server" for text in results.values())
+    assert server.peak == 2
+
+
+def test_spaces_out_requests_to_one_host(server):
+    client = Fetcher(max_per_host=4, min_host_interval=0.05)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(client.get, [f"{server.url}/slow/{i}" for i in range(4)]))
+    starts = sorted(hit for path, hits in server.hits.items() for hit in hits)
+    gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+    assert min(gaps) >= 0.04
+
+
+def test_conditional_get_returns_304_for_known_etag(server, fast_fetcher):
+    first = fast_fetcher.fetch_conditional(server.url + "/etag")
+    assert first.status_code == 200 and first.headers["ETag"] == ETAG
+    again = fast_fetcher.fetch_conditional(server.url + "/etag", {"If-None-Match": ETAG})
+    assert again.status_code == 304
+
+
+def test_extract_urls_skips_not_modified_pages(server, fast_fetcher):
+    url = server.url + "/etag"
+    progress = _RecordingProgress()
+    docs = list(indexing_pipeline.extract_urls([url], progress=progress))
+    assert [doc["url"] for doc in docs] == [url]
+    assert docs[0]["fingerprint"]["etag"] == ETAG
+    known = {url: docs[0]["fingerprint"]}
+    assert list(indexing_pipeline.extract_urls([url], known, progress)) == []
+    assert progress.counts == {"fetched": 1, "skipped": 1}
+
+
+def test_extract_urls_skips_empty_and_failed_pages(server, fast_fetcher):
+    progress = _RecordingProgress()
+    urls = [server.url + "/empty", server.url + "/missing", server.url + "/etag"]
+    docs = list(indexing_pipeline.extract_urls(urls, progress=progress))
+    assert [doc["url"] for doc in docs] == [server.url + "/etag"]
+    assert docs[0]["content"] == "Hello from the test server"
+    assert progress.counts == {"skipped": 1, "failed": 1, "fetched": 1}
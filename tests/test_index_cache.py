@@ -0,0 +1,70 @@
+# tests/test_index_cache.py
+# The resident index kept by IndexCache as documents are written and deleted.
+import numpy as np
+import pytest
+
+import index_cache
+from db import connection
+from embedding_store import delete_documents, insert_document
+from index_cache import IndexCache
+from quantization import QUANTIZATION_INT8
+
+DIM = 16
+
+
+def _write(db_file, sources, seed=0):
+    rng = np.random.default_rng(seed)
+    with connection(db_file) as conn:
+        cursor = conn.cursor()
+        for source in sources:
+            chunks = [{"embedding": rng.standard_normal(DIM).astype(np.float32)} for _ in range(3)]
+            insert_document(cursor, "url", source, f"Text of {source}", chunks)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = IndexCache(str(tmp_path / "index.db"))
+    yield cache
+    cache.close()
+
+
+def test_quantizes_an_index_that_started_empty(cache, monkeypatch):
+    monkeypatch.setattr(index_cache, "QUANTIZATION", QUANTIZATION_INT8)
+    cache.refresh()
+    assert len(cache.vector_index) == 0 and cache.vector_index.quantized is None
+    _write(cache.db_file, [f"http://example.com/{i}" for i in range(20)])
+    assert cache.refresh()
+    vi = cache.vector_index
+    assert len(vi) == 20
+    assert vi.quantized is not None
+    # Only the codes stay resident; rescoring reads rows back from SQLite.
+    assert len(vi.base) == 0
+    query = vi.rows([7])[0]
+    position, score = vi.search(query, top_k=1, min_similarity=0.0)[0][0]
+    assert vi.docs[position]["url"] == "http://example.com/2" and score == pytest.approx(1.0, abs=1e-3)
+
+
+def test_refresh_follows_inserts_and_deletes(cache):
+    sources = [f"http://example.com/{i}" for i in range(10)]
+    _write(cache.db_file, sources)
+    cache.refresh()
+    with connection(cache.db_file) as conn:
+        delete_documents(conn.cursor(), sources[:4])
+    _write(cache.db_file, ["http://example.com/new"], seed=1)
+    assert cache.refresh()
+    assert len(cache.vector_index) == 7
+    assert not cache.refresh()
+
+
+def test_chat_turns_do_not_rescan_documents(cache):
+    _write(cache.db_file, [f"http://example.com/{i}" for i in range(5)])
+    cache.refresh()
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    with connection(cache.db_file) as conn:
+        conn.execute("INSERT INTO chat_history (session_id, user_message, bot_answer) VALUES ('s', 'q', 'a')")
+    assert not cache.refresh()
+    assert not any("SELECT id FROM documents" in sql for sql in statements)
+    _write(cache.db_file, ["http://example.com/new"], seed=1)
+    assert cache.refresh()
+    assert len(cache.vector_index) == 6
@@ -0,0 +1,90 @@
+# tests/test_indexing_jobs.py
+# The single-flight indexing job manager: follow-up runs, cancellation and resume ids.
+import threading
+import time
+
+from indexing_jobs import CANCELLED, COMPLETED, FAILED, IndexingJobManager
+
+
+def _wait_idle(manager, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while manager.status()["current"] is not None:
+        assert time.monotonic() < deadline, "indexing job did not finish"
+        time.sleep(0.01)
+    return manager.status()
+
+
+def test_runs_one_job_at_a_time_with_one_follow_up():
+    manager = IndexingJobManager()
+    release = threading.Event()
+    active, peak, calls = [0], [0], []
+    lock = threading.Lock()
+
+    def run_named(name):
+        def run(progress):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+                calls.append(name)
+            release.wait(5)
+            with lock:
+                active[0] -= 1
+        return run
+
+    first = manager.start(run_named("first"))
+    second = manager.start(run_named("second"))
+    third = manager.start(run_named("third"))
+    # Requests made while a run is active collapse into one pending follow-up; the latest wins.
+    assert second["id"] == third["id"] != first["id"]
+    assert manager.status()["pending"]["id"] == second["id"]
+    release.set()
+    status = _wait_idle(manager)
+    assert calls == ["first", "third"]
+    assert peak[0] == 1
+    assert [job["id"] for job in status["recent"]] == [second["id"], first["id"]]
+    assert all(job["state"] == COMPLETED for job in status["recent"])
+
+
+def test_cancel_stops_the_run_and_drops_the_follow_up():
+    manager = IndexingJobManager()
+    started = threading.Event()
+    follow_up = []
+
+    def run(progress):
+        progress.set_total(100)
+        started.set()
+        while True:
+            progress.update("written")
+            progress.raise_if_cancelled()
+            time.sleep(0.005)
+
+    job = manager.start(run)
+    assert started.wait(5)
+    manager.start(lambda progress: follow_up.append(progress))
+    assert manager.cancel()["id"] == job["id"]
+    status = _wait_idle(manager)
+    assert follow_up == []
+    assert [(j["id"], j["state"]) for j in status["recent"]] == [(job["id"], CANCELLED)]
+    progress = status["recent"][0]["progress"]
+    assert progress["discovered"] == 100 and 0 < progress["written"] == progress["done"]
+    # The next run resumes where the cancelled one stopped.
+    resumed = manager.start(lambda progress: None)
+    assert resumed["resumes"] == job["id"]
+    assert _wait_idle(manager)["recent"][0]["state"] == COMPLETED
+    assert manager.cancel() is None
+
+
+def test_a_failed_run_is_recorded_and_resumed():
+    manager = IndexingJobManager()
+
+    def fail(progress):
+        raise RuntimeError("disk full")
+
+    job = manager.start(fail)
+    failed = _wait_idle(manager)["recent"][0]
+    assert failed["id"] == job["id"] and failed["state"] == FAILED and failed["error"] == "disk full"
+    assert manager.start(lambda progress: None)["resumes"] == job["id"]
+    _wait_idle(manager)
+    # A completed run leaves nothing to resume.
+    assert manager.start(lambda progress: None)["resumes"] is None
+    _wait_idle(manager)
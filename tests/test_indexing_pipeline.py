@@ -0,0 +1,82 @@
+# tests/test_indexing_pipeline.py
+# Indexing runs end to end: links served by a local http.server, CPU backend.
+import functools
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fetcher
+from db import connection
+from embedding_node import run_indexing
+from fetcher import Fetcher
+from indexing_pipeline import iter_links, write_documents
+
+PAGES = {
+    "one.html": "<html><body><p>The first page talks about apples.</p></body></html>",
+    "two.html": "<html><body><p>The second page talks about pears.</p></body></html>",
+}
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site(tmp_path):
+    root = tmp_path / "site"
+    root.mkdir()
+    for name, html in PAGES.items():
+        (root / name).write_text(html)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_QuietHandler, directory=str(root)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_fetcher(monkeypatch):
+    monkeypatch.setattr(fetcher, "_default_fetcher", Fetcher(min_host_interval=0.0, backoff_base=0.01))
+
+
+def _links_folder(tmp_path, lines):
+    links = tmp_path / "data" / "links"
+    links.mkdir(parents=True)
+    (links / "links.txt").write_text("\n".join(lines) + "\n")
+    return str(links)
+
+
+def _sources(db_file):
+    with connection(db_file) as conn:
+        return sorted(row[0] for row in conn.execute("SELECT source FROM documents"))
+
+
+def test_iter_links_yields_each_url_once(tmp_path):
+    folder = _links_folder(tmp_path, ["http://a/", "", "http://b/", "http://a/"])
+    assert list(iter_links(folder)) == ["http://a/", "http://b/"]
+
+
+def test_duplicate_links_are_indexed_once(tmp_path, site):
+    one, two = f"{site}/one.html", f"{site}/two.html"
+    folder = _links_folder(tmp_path, [one, two, one])
+    db_file = str(tmp_path / "index.db")
+    run_indexing(folder, db_file, "embedding")
+    assert _sources(db_file) == [one, two]
+    # A second run sees both pages unchanged and keeps them.
+    run_indexing(folder, db_file, "embedding")
+    assert _sources(db_file) == [one, two]
+
+
+def test_write_documents_keeps_the_last_entry_of_a_source(tmp_path):
+    db_file = str(tmp_path / "index.db")
+    chunk = {"char_start": 0, "char_end": 3, "token_start": 0, "token_end": 1, "embedding": [1.0, 0.0]}
+    docs = [{"url": "http://a/", "content": "old", "chunks": [chunk]},
+            {"url": "http://b/", "content": "other", "chunks": [chunk]},
+            {"url": "http://a/", "content": "new", "chunks": [chunk]}]
+    assert write_documents(docs, db_file) == 2
+    with connection(db_file) as conn:
+        rows = dict(conn.execute("SELECT source, content FROM documents"))
+    assert rows == {"http://a/": "new", "http://b/": "other"}
@@ -0,0 +1,65 @@
+# tests/test_model_server.py
+# The model server with the CPU backend, driven through model_client.
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from model_client import ModelServerClient, ModelServerUnavailable, key_file
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+START_TIMEOUT = 30.0     # Seconds to wait for the server's socket and key file
+
+
+@pytest.fixture
+def server_address(tmp_path):
+    address = str(tmp_path / "run" / "model-server.sock")
+    env = dict(os.environ, RAG_BACKEND="cpu", PYTHONPATH=SRC_DIR)
+    env.pop("RAG_MODEL_SERVER_KEY", None)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(SRC_DIR, "model_server.py"),
+         "--address", address, "--embedding", "", "--llm", ""],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + START_TIMEOUT
+        while not (os.path.exists(address) and os.path.exists(key_file(address))):
+            if process.poll() is not None or time.monotonic() > deadline:
+                pytest.fail(f"Model server did not start (exit code {process.poll()})")
+            time.sleep(0.05)
+        yield address
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    assert not os.path.exists(key_file(address))
+
+
+def test_socket_directory_and_key_are_private(server_address):
+    assert os.stat(os.path.dirname(server_address)).st_mode & 0o777 == 0o700
+    assert os.stat(key_file(server_address)).st_mode & 0o777 == 0o600
+
+
+def test_embed_and_generate(server_address):
+    client = ModelServerClient(server_address)
+    try:
+        health = client.health()
+        assert health["ok"] and health["backend"] == "cpu"
+        vectors = client.call({"op": "embed", "model_path": "embedding", "prompts": ["first", "second"]})
+        assert len(vectors) == 2
+        conversations = [[{"role": "user", "content": "Hello?"}], [{"role": "user", "content": "Bye?"}]]
+        replies = client.call({"op": "generate", "model_path": "llm", "conversations": conversations})
+        assert len(replies) == 2 and all(isinstance(reply, str) and reply for reply in replies)
+        streamed = list(client.stream({"op": "generate", "model_path": "llm",
+                                       "conversations": conversations[:1], "stream": True}))
+        assert streamed[-1] == ("done", [replies[0]])
+        assert "".join(text for kind, _, text in streamed[:-1]) == replies[0]
+    finally:
+        client.close()
+
+
+def test_wrong_key_is_rejected(server_address):
+    client = ModelServerClient(server_address, authkey=b"not the key", timeout=5)
+    with pytest.raises(ModelServerUnavailable):
+        client.call({"op": "health"})
+    assert not client.health()["ok"]
@@ -0,0 +1,112 @@
+# tests/test_retrieval.py
+# Vectorized retrieval: incremental index versions against full rebuilds, top-k selection and RRF.
+import numpy as np
+import pytest
+
+from retrieval import VectorIndex, normalize_rows, reciprocal_rank_fusion, select_top_k
+
+DIM = 12
+
+
+def _docs(rng, ids):
+    return [{"id": i, "url": f"http://example.com/{i}",
+             "embedding": rng.standard_normal((int(rng.integers(1, 5)), DIM)).astype(np.float32)} for i in ids]
+
+
+def _doc_hits(index, queries, top_k=5):
+    return [[(index.docs[pos]["id"], score) for pos, score in hits]
+            for hits in index.search_exact(queries, top_k, min_similarity=-1.0)]
+
+
+def _chunk_hits(index, queries, top_k=8):
+    return [[(index.docs[pos]["id"], ordinal, score) for pos, ordinal, score in hits]
+            for hits in index.search_chunks(queries, top_k, min_similarity=-1.0)]
+
+
+def _assert_same_hits(hits, expected):
+    assert [[hit[:-1] for hit in per_query] for per_query in hits] == \
+        [[hit[:-1] for hit in per_query] for per_query in expected]
+    assert [[hit[-1] for hit in per_query] for per_query in hits] == \
+        [pytest.approx([hit[-1] for hit in per_query], abs=1e-5) for per_query in expected]
+
+
+def _assert_same_results(index, docs_by_id, queries):
+    rebuilt = VectorIndex([docs_by_id[i] for i in sorted(docs_by_id)])
+    assert len(index) == len(rebuilt)
+    _assert_same_hits(_doc_hits(index, queries), _doc_hits(rebuilt, queries))
+    _assert_same_hits(_chunk_hits(index, queries), _chunk_hits(rebuilt, queries))
+
+
+def test_extend_and_compact_match_a_rebuild():
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((6, DIM)).astype(np.float32)
+    docs_by_id = {doc["id"]: doc for doc in _docs(rng, range(1, 21))}
+    index = VectorIndex(list(docs_by_id.values()))
+    next_id = 21
+    for step in range(8):
+        removed = [int(i) for i in rng.choice(sorted(docs_by_id), size=3, replace=False)]
+        added = _docs(rng, range(next_id, next_id + 4))
+        next_id += 4
+        for doc_id in removed:
+            del docs_by_id[doc_id]
+        docs_by_id.update((doc["id"], doc) for doc in added)
+        index = index.extend(added, removed)
+        _assert_same_results(index, docs_by_id, queries)
+        if step % 3 == 2:
+            index = index.compact()
+            assert index.n_dead_rows == 0
+            assert index.n_rows == sum(len(doc["embedding"]) for doc in docs_by_id.values())
+            _assert_same_results(index, docs_by_id, queries)
+
+
+def test_older_versions_are_unchanged_by_extend():
+    rng = np.random.default_rng(1)
+    queries = rng.standard_normal((3, DIM)).astype(np.float32)
+    docs = _docs(rng, range(1, 11))
+    base = VectorIndex(docs)
+    before = _chunk_hits(base, queries)
+    first = base.extend(_docs(rng, [11, 12]), removed_ids=[3])
+    # A sibling of `first` extends the same version again.
+    second = base.extend(_docs(rng, [13]), removed_ids=[4])
+    _assert_same_hits(_chunk_hits(base, queries), before)
+    assert sorted(doc["id"] for i, doc in enumerate(first.docs[:first.n_docs]) if first.alive[i]) == \
+        [1, 2, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+    assert sorted(doc["id"] for i, doc in enumerate(second.docs[:second.n_docs]) if second.alive[i]) == \
+        [1, 2, 3, 5, 6, 7, 8, 9, 10, 13]
+    assert first.position(13) is None and second.position(11) is None
+
+
+def test_mapped_base_and_dropped_rows_give_the_same_results():
+    rng = np.random.default_rng(2)
+    queries = rng.standard_normal((4, DIM)).astype(np.float32)
+    docs = _docs(rng, range(1, 16))
+    exact = VectorIndex(docs)
+    counts = [len(doc["embedding"]) for doc in docs]
+    matrix = normalize_rows(np.concatenate([doc["embedding"] for doc in docs]))
+    mapped = VectorIndex.from_matrix([{"id": doc["id"], "url": doc["url"]} for doc in docs], matrix, counts)
+    _assert_same_hits(_chunk_hits(mapped, queries), _chunk_hits(exact, queries))
+    vectors = {doc["id"]: normalize_rows(doc["embedding"]) for doc in docs}
+    dropped = VectorIndex(docs)
+    dropped.drop_rows(lambda doc_ids, ordinals, dim: np.stack(
+        [vectors[d][o] for d, o in zip(doc_ids.tolist(), ordinals.tolist())]))
+    assert len(dropped.base) == 0
+    np.testing.assert_allclose(dropped.rows([0, 5, 9]), exact.rows([0, 5, 9]))
+    _assert_same_hits(_chunk_hits(dropped, queries), _chunk_hits(exact, queries))
+
+
+def test_select_top_k_matches_a_full_sort():
+    rng = np.random.default_rng(3)
+    scores = rng.uniform(-1, 1, (5, 40)).astype(np.float32)
+    for top_k, threshold in ((1, -1.0), (7, 0.2), (40, 0.0), (100, -1.0)):
+        expected = [[(int(i), float(row[i])) for i in np.argsort(-row, kind="stable")[:top_k] if row[i] >= threshold]
+                    for row in scores]
+        assert select_top_k(scores, top_k, threshold) == expected
+    assert select_top_k(scores, 0, 0.0) == [[] for _ in range(5)]
+
+
+def test_reciprocal_rank_fusion_sums_inverse_ranks():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60)
+    assert fused["a"] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused["b"] == pytest.approx(1 / 62)
+    assert fused["c"] == pytest.approx(1 / 63 + 1 / 61)
+    assert sorted(fused, key=fused.get, reverse=True) == ["a", "c", "b"]
@@ -0,0 +1,72 @@
+# tests/test_vector_store.py
+# Versions of the memory-mapped vector store and readers opening them concurrently.
+import numpy as np
+
+import vector_store
+from db import connection
+from embedding_store import delete_documents, insert_document
+from retrieval import normalize_rows
+from vector_store import VectorStore, read_manifest, update_vector_store
+
+DIM = 8
+
+
+def _write(db_file, sources):
+    rng = np.random.default_rng(len(sources))
+    vectors = {}
+    with connection(db_file) as conn:
+        cursor = conn.cursor()
+        for source in sources:
+            block = rng.standard_normal((2, DIM)).astype(np.float32)
+            insert_document(cursor, "url", source, source, [{"embedding": row} for row in block])
+            vectors[source] = normalize_rows(block)
+    return vectors
+
+
+def test_appends_and_rewrites_match_the_database(tmp_path):
+    db_file = str(tmp_path / "index.db")
+    vectors = _write(db_file, ["a", "b"])
+    assert update_vector_store(db_file)["version"] == 1
+    vectors.update(_write(db_file, ["c"]))
+    manifest = update_vector_store(db_file)
+    assert manifest["version"] == 2 and manifest["rows"] == 6
+    with connection(db_file) as conn:
+        delete_documents(conn.cursor(), ["a"])
+    manifest = update_vector_store(db_file)
+    assert manifest["rows"] == 4 and manifest["data"] == "vectors-000003.f32"
+    store = VectorStore.open(db_file)
+    np.testing.assert_allclose(store.matrix, np.concatenate([vectors["b"], vectors["c"]]), atol=1e-6)
+    assert store.counts.tolist() == [2, 2]
+    assert update_vector_store(db_file) is None
+
+
+def test_previous_version_stays_readable_until_the_next_update(tmp_path):
+    db_file = str(tmp_path / "index.db")
+    _write(db_file, ["a", "b"])
+    update_vector_store(db_file)
+    first = read_manifest(db_file)
+    with connection(db_file) as conn:
+        delete_documents(conn.cursor(), ["a"])
+    update_vector_store(db_file)
+    # A reader that read the first manifest just before the swap can still open it.
+    assert VectorStore(db_file, first).rows == 4
+    _write(db_file, ["c"])
+    update_vector_store(db_file)
+    assert VectorStore(db_file, read_manifest(db_file)).rows == 4
+
+
+def test_open_retries_when_its_version_was_removed(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "index.db")
+    _write(db_file, ["a"])
+    update_vector_store(db_file)
+    stale = read_manifest(db_file)
+    # Two rewrites: the second removes the files of the first version.
+    for old, new in (("a", "b"), ("b", "c")):
+        with connection(db_file) as conn:
+            delete_documents(conn.cursor(), [old])
+        _write(db_file, [new])
+        update_vector_store(db_file)
+    manifests = [stale, read_manifest(db_file)]
+    monkeypatch.setattr(vector_store, "read_manifest", lambda db_file: manifests.pop(0))
+    store = VectorStore.open(db_file)
+    assert store.version == 3 and store.rows == 2